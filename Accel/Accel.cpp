@@ -29,128 +29,678 @@
 
 #include <pybind11/pybind11.h>
 #include <pybind11/numpy.h>
+#include <pybind11/stl.h>
 #include <glm/glm.hpp>
 
 #include <iostream>
 #include <limits>
+#include <string>
+#include <vector>
+#include <memory>
+#include <optional>
+
+#ifdef _OPENMP
+#include <omp.h>
+#endif
 
 #include "closest_point.h"
+#include "mesh_index.h"
 
-constexpr std::tuple<int,int,int> version(1, 0, 0);
+constexpr std::tuple<int,int,int> version(1, 2, 0);
 
 namespace py = pybind11;
 
 #define UNUSED(x) (void)x
 
 // ======================================================================== //
-//                              main entry point                            //
+//                                 utilities                                //
 // ======================================================================== //
 
+using OptionalIntArray = std::optional<py::array_t<int>>;
+
+ProjectionMethod parseProjectionMethod(std::string const& method)
+{
+	if (method == "bvh") return ProjectionMethod::Bvh;
+	if (method == "brute_force") return ProjectionMethod::BruteForce;
+	throw std::runtime_error("method must be either 'bvh' or 'brute_force'");
+}
+
+void checkShape(py::buffer_info const& buf, const char *name)
+{
+	if (buf.ndim != 2)
+		throw std::runtime_error(std::string(name) + " must have dimension 2");
+
+	if (buf.shape[1] != 3)
+		throw std::runtime_error(std::string(name) + " must have shape (*, 3)");
+}
+
 /**
- * For each sample, find the closest point on the mesh defined by (vertices, triangles)
- * @param vertices (n,3) array of vertex coordinates
- * @param triangles (m,3) array of indices in (0,n-1) telling which vertiçces
- *                  are connected by each face
- * @param samples (p,3) array of points to project
- * @return (
- *     projections (p,3) array of closest points to sample within the mesh
- *     bcoords (p,2) array of barycentric coordinates of the closest points within their triangle
- *     proj_triangles (p,) array of triangle indices, telling which face the closest point belongs to
- * )
+ * Copy a (n,3) array of coordinates into a vector of Vec3
  */
 template<typename Float, typename Vec3>
-std::tuple<py::array_t<Float>,py::array_t<Float>,py::array_t<int>>
-project(py::array_t<Float> vertices, py::array_t<int> triangles, py::array_t<Float> samples)
+std::vector<Vec3> toVec3Vector(py::array_t<Float> const& array, const char *name)
 {
-	py::buffer_info vertices_buf = vertices.request();
+	checkShape(array.request(), name);
+	auto data = array.template unchecked<2>();
+	py::gil_scoped_release release;
+	std::vector<Vec3> vec(static_cast<size_t>(data.shape(0)));
+	for (py::ssize_t i = 0; i < data.shape(0); ++i) {
+		vec[i] = Vec3(data(i, 0), data(i, 1), data(i, 2));
+	}
+	return vec;
+}
 
-	if (vertices_buf.ndim != 2)
-		throw std::runtime_error("vertices must have dimension 2");
+/**
+ * Read the offset tables describing how meshes have been concatenated.
+ * Both are (k+1,) arrays for k parts, starting with 0 and ending with the
+ * total number of vertices (resp. triangles). If both are None, the whole
+ * mesh is a single part.
+ */
+std::vector<MeshPart> toPartVector(OptionalIntArray const& vertex_offsets, OptionalIntArray const& triangle_offsets, size_t vertex_count, size_t triangle_count)
+{
+	if (!vertex_offsets.has_value() && !triangle_offsets.has_value()) {
+		MeshPart part;
+		part.vertexCount = static_cast<int>(vertex_count);
+		part.triangleCount = static_cast<int>(triangle_count);
+		return { part };
+	}
 
-	if (vertices_buf.shape[1] != 3)
-		throw std::runtime_error("vertices must have shape (*, 3)");
+	if (!vertex_offsets.has_value() || !triangle_offsets.has_value())
+		throw std::runtime_error("vertex_offsets and triangle_offsets must be provided together");
 
-	py::buffer_info triangles_buf = triangles.request();
+	auto vertex_offsets_data = vertex_offsets->unchecked<1>();
+	auto triangle_offsets_data = triangle_offsets->unchecked<1>();
+	if (vertex_offsets_data.shape(0) != triangle_offsets_data.shape(0) || vertex_offsets_data.shape(0) < 2)
+		throw std::runtime_error("vertex_offsets and triangle_offsets must both have shape (k+1,) for k meshes");
 
-	if (triangles_buf.ndim != 2)
-		throw std::runtime_error("triangles must have dimension 2");
+	py::ssize_t part_count = vertex_offsets_data.shape(0) - 1;
+	if (vertex_offsets_data(0) != 0 || triangle_offsets_data(0) != 0
+		|| static_cast<size_t>(vertex_offsets_data(part_count)) != vertex_count
+		|| static_cast<size_t>(triangle_offsets_data(part_count)) != triangle_count)
+		throw std::runtime_error("offsets must start with 0 and end with the total vertex (resp. triangle) count");
 
-	if (triangles_buf.shape[1] != 3)
-		throw std::runtime_error("triangles must have shape (*, 3)");
+	std::vector<MeshPart> parts(static_cast<size_t>(part_count));
+	for (py::ssize_t i = 0; i < part_count; ++i) {
+		parts[i].firstVertex = vertex_offsets_data(i);
+		parts[i].vertexCount = vertex_offsets_data(i + 1) - vertex_offsets_data(i);
+		parts[i].firstTriangle = triangle_offsets_data(i);
+		parts[i].triangleCount = triangle_offsets_data(i + 1) - triangle_offsets_data(i);
+		if (parts[i].vertexCount < 0 || parts[i].triangleCount < 0)
+			throw std::runtime_error("offsets must be non decreasing");
+	}
+	return parts;
+}
 
-	py::buffer_info samples_buf = samples.request();
+/**
+ * Copy a (m,3) array of vertex indices into a vector of ivec3. Indices
+ * are local to the part the triangle belongs to, they are checked to be
+ * within the range of the part's vertices and offset to index the full
+ * vertex array.
+ */
+std::vector<glm::ivec3> toTriangleVector(py::array_t<int> const& array, std::vector<MeshPart> const& parts)
+{
+	checkShape(array.request(), "triangles");
+	auto data = array.template unchecked<2>();
+	py::gil_scoped_release release;
+	std::vector<glm::ivec3> vec(static_cast<size_t>(data.shape(0)));
+	for (MeshPart const& part : parts) {
+		for (int i = part.firstTriangle; i < part.firstTriangle + part.triangleCount; ++i) {
+			vec[i] = glm::ivec3(data(i, 0), data(i, 1), data(i, 2));
+			for (int k = 0; k < 3; ++k) {
+				if (vec[i][k] < 0 || vec[i][k] >= part.vertexCount)
+					throw std::runtime_error("triangles must contain indices in range (0, n-1), where n is the vertex count of their mesh");
+				vec[i][k] += part.firstVertex;
+			}
+		}
+	}
+	return vec;
+}
 
-	if (samples_buf.ndim != 2)
-		throw std::runtime_error("samples must have dimension 2");
+/**
+ * Read the part of the mesh that each sample must be projected onto
+ */
+std::vector<int> toSamplePartVector(OptionalIntArray const& object_ids, py::ssize_t sample_count, size_t part_count)
+{
+	std::vector<int> sample_parts(static_cast<size_t>(sample_count), 0);
+	if (object_ids.has_value()) {
+		auto object_ids_data = object_ids->unchecked<1>();
+		if (object_ids_data.shape(0) != sample_count)
+			throw std::runtime_error("object_ids must have shape (p,) where p is the number of samples");
+		for (py::ssize_t i = 0; i < object_ids_data.shape(0); ++i) {
+			sample_parts[i] = object_ids_data(i);
+			if (sample_parts[i] < 0 || static_cast<size_t>(sample_parts[i]) >= part_count)
+				throw std::runtime_error("object_ids must contain indices in range (0, k-1) for k meshes");
+		}
+	} else if (part_count > 1) {
+		throw std::runtime_error("object_ids must be provided when the index contains several meshes");
+	}
+	return sample_parts;
+}
 
-	if (samples_buf.shape[1] != 3)
-		throw std::runtime_error("samples must have shape (*, 3)");
+// ======================================================================== //
+//                                 MeshIndex                                //
+// ======================================================================== //
 
-	auto samples_data = samples.template unchecked<2>();
-	for (long long idx = 0; idx < vertices_buf.shape[0]; idx++) {
-		samples_data(idx, 0);
-	}
+template<typename Float, typename Vec3>
+std::unique_ptr<MeshIndex<Float, Vec3>>
+makeMeshIndex(py::array_t<Float> vertices, py::array_t<int> triangles, OptionalIntArray vertex_offsets, OptionalIntArray triangle_offsets, std::string method)
+{
+	ProjectionMethod projection_method = parseProjectionMethod(method);
+	std::vector<Vec3> vertices_vec = toVec3Vector<Float, Vec3>(vertices, "vertices");
+	std::vector<MeshPart> parts = toPartVector(vertex_offsets, triangle_offsets, vertices_vec.size(), static_cast<size_t>(triangles.shape(0)));
+	std::vector<glm::ivec3> triangles_vec = toTriangleVector(triangles, parts);
+	py::gil_scoped_release release;
+	return std::make_unique<MeshIndex<Float, Vec3>>(std::move(vertices_vec), std::move(triangles_vec), std::move(parts), projection_method);
+}
 
+template<typename Float, typename Vec3>
+void refitMeshIndex(MeshIndex<Float, Vec3> & index, py::array_t<Float> vertices)
+{
+	std::vector<Vec3> vertices_vec = toVec3Vector<Float, Vec3>(vertices, "vertices");
+	py::gil_scoped_release release;
+	auto lock = index.writeLock();
+	index.refit(std::move(vertices_vec));
+}
+
+/**
+ * Tell whether the index has been built with exactly these triangles and
+ * offsets, in which case it can be refitted rather than rebuilt.
+ */
+template<typename Float, typename Vec3>
+bool sameTriangles(MeshIndex<Float, Vec3> const& index, py::array_t<int> triangles, OptionalIntArray vertex_offsets, OptionalIntArray triangle_offsets)
+{
+	py::buffer_info triangles_buf = triangles.request();
+	checkShape(triangles_buf, "triangles");
 	auto triangles_data = triangles.template unchecked<2>();
-	auto vertices_data = vertices.template unchecked<2>();
+
+	std::vector<MeshPart> parts;
+	try {
+		parts = toPartVector(vertex_offsets, triangle_offsets, index.vertices().size(), static_cast<size_t>(triangles_buf.shape[0]));
+	} catch (std::runtime_error const&) {
+		return false;
+	}
+
+	py::gil_scoped_release release;
+	auto lock = index.readLock();
+	auto const& index_triangles = index.triangles();
+	auto const& index_parts = index.parts();
+	if (static_cast<size_t>(triangles_buf.shape[0]) != index_triangles.size()) return false;
+	if (parts.size() != index_parts.size()) return false;
+
+	for (size_t p = 0; p < parts.size(); ++p) {
+		MeshPart const& part = index_parts[p];
+		if (parts[p].firstVertex != part.firstVertex || parts[p].firstTriangle != part.firstTriangle) return false;
+		for (int i = part.firstTriangle; i < part.firstTriangle + part.triangleCount; ++i) {
+			for (int k = 0; k < 3; ++k) {
+				if (triangles_data(i, k) + part.firstVertex != index_triangles[i][k]) return false;
+			}
+		}
+	}
+	return true;
+}
+
+/**
+ * For each sample, find the closest point on the indexed mesh
+ * @param samples (p,3) array of points to project
+ * @param object_ids optional (p,) array telling for each sample the part
+ *                   of the mesh onto which it must be projected
+ * @param early_exit_distance stop searching as soon as a point closer than
+ *                            this is found, or never if negative
+ * @return (
+ *     projections (p,3) array of closest points to sample within the mesh
+ *     bcoords (p,3) array of barycentric coordinates of the closest points within their triangle
+ *     proj_triangles (p,) array of triangle indices, telling which face the closest point belongs to,
+ *                    indices are relative to the first triangle of the sample's part
+ * )
+ */
+template<typename Float, typename Vec3>
+std::tuple<py::array_t<Float>,py::array_t<Float>,py::array_t<int>>
+projectOnMeshIndex(MeshIndex<Float, Vec3> const& index, py::array_t<Float> samples, OptionalIntArray object_ids, Float early_exit_distance)
+{
+	py::buffer_info samples_buf = samples.request();
+	checkShape(samples_buf, "samples");
+	auto samples_data = samples.template unchecked<2>();
+
+	auto const& parts = index.parts();
+	std::vector<int> sample_parts = toSamplePartVector(object_ids, samples_buf.shape[0], parts.size());
 
 	// Copy to output
 	auto projections = py::array_t<Float>({ static_cast<size_t>(samples_buf.shape[0]), static_cast<size_t>(3) });
 	auto bcoords = py::array_t<Float>({ static_cast<size_t>(samples_buf.shape[0]), static_cast<size_t>(3) });
-	auto proj_triangles = py::array_t<int>( static_cast<pybind11::ssize_t>(samples_buf.shape[0]) );
+	// NB: array_t(ssize_t count) creates an array with null strides, so the
+	// shape is explicitly given as a container.
+	auto proj_triangles = py::array_t<int>(std::vector<py::ssize_t>{ samples_buf.shape[0] });
 	auto projections_data = projections.template mutable_unchecked<2>();
 	auto bcoords_data = bcoords.template mutable_unchecked<2>();
 	auto proj_triangles_data = proj_triangles.template mutable_unchecked<1>();
 
-	#pragma omp parallel for
-	for (long long sample_idx = 0; sample_idx < samples_buf.shape[0]; sample_idx++) {
-		Vec3 query_point = Vec3(
-			samples_data(sample_idx, 0), samples_data(sample_idx, 1), samples_data(sample_idx, 2)
-		);
+	{
+		// The GIL must be released before locking the index (see MeshIndex)
+		py::gil_scoped_release release;
+		auto lock = index.readLock();
+		long long early_exit_count = 0;
+		Float early_exit_squared_distance = early_exit_distance >= 0 ? early_exit_distance * early_exit_distance : -1;
+
+		#pragma omp parallel for reduction(+:early_exit_count)
+		for (long long sample_idx = 0; sample_idx < samples_buf.shape[0]; sample_idx++) {
+			Vec3 query_point = Vec3(
+				samples_data(sample_idx, 0), samples_data(sample_idx, 1), samples_data(sample_idx, 2)
+			);
+
+			int part_idx = sample_parts[sample_idx];
+			auto best = index.closestPoint(query_point, part_idx, early_exit_distance);
+			if (best.squaredDistance <= early_exit_squared_distance) ++early_exit_count;
+
+			projections_data(sample_idx, 0) = best.hit.point.x;
+			projections_data(sample_idx, 1) = best.hit.point.y;
+			projections_data(sample_idx, 2) = best.hit.point.z;
+			bcoords_data(sample_idx, 0) = best.hit.ba;
+			bcoords_data(sample_idx, 1) = best.hit.bb;
+			bcoords_data(sample_idx, 2) = best.hit.bc;
+			proj_triangles_data(sample_idx) = best.triangle >= 0 ? static_cast<int>(best.triangle) - parts[part_idx].firstTriangle : -1;
+		}
+
+		index.countQueries(samples_buf.shape[0], early_exit_count);
+	}
+
+	return std::tuple<py::array_t<Float>,py::array_t<Float>,py::array_t<int>>(projections, bcoords, proj_triangles);
+}
+
+/**
+ * Find the first intersection of each ray with any part of the indexed mesh
+ * @param origins (p,3) array of ray origins
+ * @param directions (p,3) array of ray directions, not necessarily normalized
+ * @return (
+ *     hits (p,) boolean array telling which rays hit the mesh
+ *     locations (p,3) array of hit points (NaN where there is no hit)
+ *     bcoords (p,3) array of barycentric coordinates of the hit points within their triangle
+ *     hit_triangles (p,) array of hit triangles, relative to the first triangle of their part (-1 where there is no hit)
+ *     object_ids (p,) array of the part of the mesh that contains the hit triangle (-1 where there is no hit)
+ * )
+ */
+template<typename Float, typename Vec3>
+std::tuple<py::array_t<bool>,py::array_t<Float>,py::array_t<Float>,py::array_t<int>,py::array_t<int>>
+castRaysOnMeshIndex(MeshIndex<Float, Vec3> const& index, py::array_t<Float> origins, py::array_t<Float> directions)
+{
+	py::buffer_info origins_buf = origins.request();
+	py::buffer_info directions_buf = directions.request();
+	checkShape(origins_buf, "origins");
+	checkShape(directions_buf, "directions");
+	if (origins_buf.shape[0] != directions_buf.shape[0])
+		throw std::runtime_error("origins and directions must have the same number of rays");
+	auto origins_data = origins.template unchecked<2>();
+	auto directions_data = directions.template unchecked<2>();
+
+	py::ssize_t ray_count = origins_buf.shape[0];
+	auto hits = py::array_t<bool>(std::vector<py::ssize_t>{ ray_count });
+	auto locations = py::array_t<Float>({ static_cast<size_t>(ray_count), static_cast<size_t>(3) });
+	auto bcoords = py::array_t<Float>({ static_cast<size_t>(ray_count), static_cast<size_t>(3) });
+	auto hit_triangles = py::array_t<int>(std::vector<py::ssize_t>{ ray_count });
+	auto object_ids = py::array_t<int>(std::vector<py::ssize_t>{ ray_count });
+	auto hits_data = hits.template mutable_unchecked<1>();
+	auto locations_data = locations.template mutable_unchecked<2>();
+	auto bcoords_data = bcoords.template mutable_unchecked<2>();
+	auto hit_triangles_data = hit_triangles.template mutable_unchecked<1>();
+	auto object_ids_data = object_ids.template mutable_unchecked<1>();
+
+	{
+		// The GIL must be released before locking the index (see MeshIndex)
+		py::gil_scoped_release release;
+		auto lock = index.readLock();
+		auto const& parts = index.parts();
+
+		#pragma omp parallel for
+		for (long long ray_idx = 0; ray_idx < ray_count; ray_idx++) {
+			Vec3 origin = Vec3(origins_data(ray_idx, 0), origins_data(ray_idx, 1), origins_data(ray_idx, 2));
+			Vec3 direction = Vec3(directions_data(ray_idx, 0), directions_data(ray_idx, 1), directions_data(ray_idx, 2));
 
-		auto hit = Hit<Float, Vec3>();
-		auto best_hit = Hit<Float, Vec3>();
-		Vec3 a, b, c, diff;
-		Float err;
-		Float min_err = std::numeric_limits<Float>::max();
-		long long best_tri = -1;
-		for (long long triangle_idx = 0 ; triangle_idx < triangles_buf.shape[0] ; ++triangle_idx) {
-			int vert_idx0 = triangles_data(triangle_idx, 0);
-			int vert_idx1 = triangles_data(triangle_idx, 1);
-			int vert_idx2 = triangles_data(triangle_idx, 2);
-			a = Vec3(vertices_data(vert_idx0, 0), vertices_data(vert_idx0, 1), vertices_data(vert_idx0, 2));
-			b = Vec3(vertices_data(vert_idx1, 0), vertices_data(vert_idx1, 1), vertices_data(vert_idx1, 2));
-			c = Vec3(vertices_data(vert_idx2, 0), vertices_data(vert_idx2, 1), vertices_data(vert_idx2, 2));
-			hit = closestPointTriangle<Float,Vec3>(query_point, a, b, c);
-			diff = hit.point - query_point;
-			err = dot(diff, diff);
-			if (err < min_err) {
-				min_err = err;
-				best_hit = hit;
-				best_tri = triangle_idx;
+			auto best = index.intersectRay(origin, direction);
+			bool hit = best.triangle >= 0;
+			hits_data(ray_idx) = hit;
+
+			if (!hit) {
+				for (int k = 0; k < 3; ++k) {
+					locations_data(ray_idx, k) = std::numeric_limits<Float>::quiet_NaN();
+					bcoords_data(ray_idx, k) = std::numeric_limits<Float>::quiet_NaN();
+				}
+				hit_triangles_data(ray_idx) = -1;
+				object_ids_data(ray_idx) = -1;
+				continue;
 			}
+
+			Vec3 location = origin + best.distance * direction;
+			int part_idx = index.partOfTriangle(best.triangle);
+			locations_data(ray_idx, 0) = location.x;
+			locations_data(ray_idx, 1) = location.y;
+			locations_data(ray_idx, 2) = location.z;
+			bcoords_data(ray_idx, 0) = 1 - best.bb - best.bc;
+			bcoords_data(ray_idx, 1) = best.bb;
+			bcoords_data(ray_idx, 2) = best.bc;
+			hit_triangles_data(ray_idx) = static_cast<int>(best.triangle) - parts[part_idx].firstTriangle;
+			object_ids_data(ray_idx) = part_idx;
 		}
-		
-		projections_data(sample_idx, 0) = best_hit.point.x;
-		projections_data(sample_idx, 1) = best_hit.point.y;
-		projections_data(sample_idx, 2) = best_hit.point.z;
-		bcoords_data(sample_idx, 0) = best_hit.ba;
-		bcoords_data(sample_idx, 1) = best_hit.bb;
-		bcoords_data(sample_idx, 2) = best_hit.bc;
-		proj_triangles_data(sample_idx) = static_cast<int>(best_tri);
 	}
 
+	return std::make_tuple(hits, locations, bcoords, hit_triangles, object_ids);
+}
 
-	return std::tuple<py::array_t<Float>,py::array_t<Float>,py::array_t<int>>(projections, bcoords, proj_triangles);
+// ======================================================================== //
+//                              bound positions                             //
+// ======================================================================== //
+
+/**
+ * Evaluate the transformed position of points given by a triangle and
+ * barycentric coordinates on each mesh, typically coparams that have been
+ * projected once with MeshIndex.project() (see uv_coparam.CoparamBinding).
+ * The projection is done once, when binding the points, so that evaluating
+ * them again after the meshes deform does not require any search.
+ * @param corner_vertices (p,3) array of the vertices of the triangle of
+ *                        each point, local to the mesh of the point
+ * @param bcoords (p,3) array of barycentric coordinates within this triangle
+ * @param object_ids (p,) array of mesh index in (0,k-1) for each point
+ * @param vertices list of k (n_i,3) arrays of vertex positions, one per mesh
+ * @param matrices (k,4,4) array of transforms applied to each mesh
+ * @param found optional (p,) boolean array, points where it is false get NaN positions
+ * @return (p,3) array of transformed positions
+ */
+template<typename Float, typename Vec3>
+py::array_t<Float>
+evalBoundPositions(
+	py::array_t<int> corner_vertices,
+	py::array_t<Float> bcoords,
+	py::array_t<int> object_ids,
+	std::vector<py::array_t<Float>> vertices,
+	py::array_t<Float> matrices,
+	std::optional<py::array_t<bool>> found)
+{
+	py::buffer_info corner_vertices_buf = corner_vertices.request();
+	checkShape(corner_vertices_buf, "corner_vertices");
+	checkShape(bcoords.request(), "bcoords");
+	py::ssize_t point_count = corner_vertices_buf.shape[0];
+	auto corner_vertices_data = corner_vertices.template unchecked<2>();
+	auto bcoords_data = bcoords.template unchecked<2>();
+	auto object_ids_data = object_ids.template unchecked<1>();
+	auto matrices_data = matrices.template unchecked<3>();
+
+	if (bcoords_data.shape(0) != point_count || object_ids_data.shape(0) != point_count)
+		throw std::runtime_error("corner_vertices, bcoords and object_ids must have the same number of points");
+
+	size_t mesh_count = vertices.size();
+	if (matrices_data.shape(0) != static_cast<py::ssize_t>(mesh_count) || matrices_data.shape(1) != 4 || matrices_data.shape(2) != 4)
+		throw std::runtime_error("matrices must have shape (k,4,4) for k meshes");
+
+	std::vector<decltype(vertices[0].template unchecked<2>())> vertices_data;
+	vertices_data.reserve(mesh_count);
+	for (auto const& array : vertices) {
+		checkShape(array.request(), "vertices");
+		vertices_data.push_back(array.template unchecked<2>());
+	}
+
+	std::vector<char> found_vec(static_cast<size_t>(point_count), 1);
+	if (found.has_value()) {
+		auto found_data = found->template unchecked<1>();
+		if (found_data.shape(0) != point_count)
+			throw std::runtime_error("found must have shape (p,) where p is the number of points");
+		for (py::ssize_t i = 0; i < point_count; ++i) {
+			found_vec[i] = found_data(i);
+		}
+	}
+
+	for (py::ssize_t i = 0; i < point_count; ++i) {
+		int object_id = object_ids_data(i);
+		if (object_id < 0 || static_cast<size_t>(object_id) >= mesh_count)
+			throw std::runtime_error("object_ids must contain indices in range (0, k-1) for k meshes");
+		if (!found_vec[i]) continue;
+		for (int k = 0; k < 3; ++k) {
+			if (corner_vertices_data(i, k) < 0 || corner_vertices_data(i, k) >= vertices_data[object_id].shape(0))
+				throw std::runtime_error("corner_vertices must contain indices in range (0, n-1), where n is the vertex count of their mesh");
+		}
+	}
+
+	auto positions = py::array_t<Float>({ static_cast<size_t>(point_count), static_cast<size_t>(3) });
+	auto positions_data = positions.template mutable_unchecked<2>();
+
+	{
+		py::gil_scoped_release release;
+
+		#pragma omp parallel for
+		for (long long i = 0; i < point_count; i++) {
+			if (!found_vec[i]) {
+				for (int k = 0; k < 3; ++k) {
+					positions_data(i, k) = std::numeric_limits<Float>::quiet_NaN();
+				}
+				continue;
+			}
+
+			int object_id = object_ids_data(i);
+			auto const& mesh_vertices = vertices_data[object_id];
+			Vec3 local(0);
+			for (int k = 0; k < 3; ++k) {
+				py::ssize_t vertex_idx = corner_vertices_data(i, k);
+				local += bcoords_data(i, k) * Vec3(mesh_vertices(vertex_idx, 0), mesh_vertices(vertex_idx, 1), mesh_vertices(vertex_idx, 2));
+			}
+
+			for (int k = 0; k < 3; ++k) {
+				positions_data(i, k) =
+					matrices_data(object_id, k, 0) * local.x
+					+ matrices_data(object_id, k, 1) * local.y
+					+ matrices_data(object_id, k, 2) * local.z
+					+ matrices_data(object_id, k, 3);
+			}
+		}
+	}
+
+	return positions;
 }
 
-PYBIND11_MODULE(Accel, m) {
-	m.doc() = "Accel internal module for DagAmendment";
-	m.attr("__version__") = version;
-	m.def("project", &project<double, glm::dvec3>,
+// ======================================================================== //
+//                                 threading                                //
+// ======================================================================== //
+
+/**
+ * Number of threads used by parallel loops started from the calling thread
+ */
+int threadCount()
+{
+#ifdef _OPENMP
+	return omp_get_max_threads();
+#else
+	return 1;
+#endif
+}
+
+void setThreadCount(int count)
+{
+	if (count < 1)
+		throw std::runtime_error("thread count must be at least 1");
+#ifdef _OPENMP
+	omp_set_num_threads(count);
+#endif
+}
+
+// ======================================================================== //
+//                              main entry point                            //
+// ======================================================================== //
+
+/**
+ * For each sample, find the closest point on the mesh defined by (vertices, triangles)
+ * @param vertices (n,3) array of vertex coordinates
+ * @param triangles (m,3) array of indices in (0,n-1) telling which vertiçces
+ *                  are connected by each face
+ * @param samples (p,3) array of points to project
+ * @param method either "bvh" (default) to build a bounding volume hierarchy
+ *               over the triangles and prune the search, or "brute_force"
+ *               to test all triangles for each sample (for validation)
+ * @return (
+ *     projections (p,3) array of closest points to sample within the mesh
+ *     bcoords (p,2) array of barycentric coordinates of the closest points within their triangle
+ *     proj_triangles (p,) array of triangle indices, telling which face the closest point belongs to
+ * )
+ */
+template<typename Float, typename Vec3>
+std::tuple<py::array_t<Float>,py::array_t<Float>,py::array_t<int>>
+project(py::array_t<Float> vertices, py::array_t<int> triangles, py::array_t<Float> samples, std::string method)
+{
+	auto index = makeMeshIndex<Float, Vec3>(vertices, triangles, std::nullopt, std::nullopt, method);
+	return projectOnMeshIndex<Float, Vec3>(*index, samples, std::nullopt, -1);
+}
+
+/**
+ * Same as project() for several meshes at once, each sample being
+ * projected only onto the mesh it belongs to.
+ * @param vertices (n,3) concatenation of the vertices of all meshes
+ * @param triangles (m,3) concatenation of the triangles of all meshes,
+ *                  with vertex indices local to their mesh
+ * @param vertex_offsets (k+1,) array such that the vertices of mesh #i
+ *                       are in range (vertex_offsets[i], vertex_offsets[i+1]-1)
+ * @param triangle_offsets (k+1,) same for triangles
+ * @param samples (p,3) array of points to project
+ * @param object_ids (p,) array of mesh index in (0,k-1) for each sample
+ * @return same as project(), with triangle indices local to their mesh
+ */
+template<typename Float, typename Vec3>
+std::tuple<py::array_t<Float>,py::array_t<Float>,py::array_t<int>>
+projectBatch(py::array_t<Float> vertices, py::array_t<int> triangles, py::array_t<int> vertex_offsets, py::array_t<int> triangle_offsets, py::array_t<Float> samples, py::array_t<int> object_ids, std::string method)
+{
+	auto index = makeMeshIndex<Float, Vec3>(vertices, triangles, vertex_offsets, triangle_offsets, method);
+	return projectOnMeshIndex<Float, Vec3>(*index, samples, object_ids, -1);
+}
+
+/**
+ * Same as MeshIndex.cast_rays() without keeping the index
+ */
+template<typename Float, typename Vec3>
+std::tuple<py::array_t<bool>,py::array_t<Float>,py::array_t<Float>,py::array_t<int>,py::array_t<int>>
+castRays(py::array_t<Float> vertices, py::array_t<int> triangles, py::array_t<Float> origins, py::array_t<Float> directions, OptionalIntArray vertex_offsets, OptionalIntArray triangle_offsets, std::string method)
+{
+	auto index = makeMeshIndex<Float, Vec3>(vertices, triangles, vertex_offsets, triangle_offsets, method);
+	return castRaysOnMeshIndex<Float, Vec3>(*index, origins, directions);
+}
+
+template<typename Float, typename Vec3>
+void defineProjectFunctions(py::module_ & m)
+{
+	m.def("project", &project<Float, Vec3>,
 		"Project points onto a mesh",
 		py::arg("vertices"),
 		py::arg("triangles"),
-		py::arg("samples")
+		py::arg("samples"),
+		py::arg("method") = "bvh"
+		);
+	m.def("project_batch", &projectBatch<Float, Vec3>,
+		"Project points onto several concatenated meshes in a single pass, each sample onto the mesh given by object_ids",
+		py::arg("vertices"),
+		py::arg("triangles"),
+		py::arg("vertex_offsets"),
+		py::arg("triangle_offsets"),
+		py::arg("samples"),
+		py::arg("object_ids"),
+		py::arg("method") = "bvh"
+		);
+	m.def("eval_bound_positions", &evalBoundPositions<Float, Vec3>,
+		"Evaluate the transformed position of points given by a triangle (corner_vertices) and barycentric "
+		"coordinates on the mesh object_ids, NaN where found is false (see uv_coparam.CoparamBinding)",
+		py::arg("corner_vertices"),
+		py::arg("bcoords"),
+		py::arg("object_ids"),
+		py::arg("vertices"),
+		py::arg("matrices"),
+		py::arg("found") = py::none()
+		);
+	m.def("cast_rays", &castRays<Float, Vec3>,
+		"Intersect a batch of rays with one or several concatenated meshes, see MeshIndex.cast_rays()",
+		py::arg("vertices"),
+		py::arg("triangles"),
+		py::arg("origins"),
+		py::arg("directions"),
+		py::arg("vertex_offsets") = py::none(),
+		py::arg("triangle_offsets") = py::none(),
+		py::arg("method") = "bvh"
 		);
 }
+
+template<typename Float, typename Vec3>
+void defineMeshIndex(py::module_ & m, const char *name, const char *doc)
+{
+	using MeshIndexT = MeshIndex<Float, Vec3>;
+	py::class_<MeshIndexT>(m, name, doc)
+		.def(py::init(&makeMeshIndex<Float, Vec3>),
+			py::arg("vertices"),
+			py::arg("triangles"),
+			py::arg("vertex_offsets") = py::none(),
+			py::arg("triangle_offsets") = py::none(),
+			py::arg("method") = "bvh"
+			)
+		.def("project", &projectOnMeshIndex<Float, Vec3>,
+			"Project points onto the mesh, same output as Accel.project() (or Accel.project_batch() if object_ids is given). "
+			"If early_exit_distance is not negative, the search stops for samples as soon as a point closer than this is found.",
+			py::arg("samples"),
+			py::arg("object_ids") = py::none(),
+			py::arg("early_exit_distance") = -1
+			)
+		.def("cast_rays", &castRaysOnMeshIndex<Float, Vec3>,
+			"Find the first intersection of each ray (origins, directions) with any of the meshes. "
+			"Returns (hits, locations, bcoords, hit_triangles, object_ids), with triangle indices local to their mesh",
+			py::arg("origins"),
+			py::arg("directions")
+			)
+		.def("refit", &refitMeshIndex<Float, Vec3>,
+			"Update vertex positions without rebuilding the index (the vertex count must not change)",
+			py::arg("vertices")
+			)
+		.def("same_triangles", &sameTriangles<Float, Vec3>,
+			"Tell whether the index was built from the very same triangle array and offsets",
+			py::arg("triangles"),
+			py::arg("vertex_offsets") = py::none(),
+			py::arg("triangle_offsets") = py::none()
+			)
+		.def_property_readonly("vertex_count", [](MeshIndexT const& index) { return index.vertices().size(); })
+		.def_property_readonly("triangle_count", [](MeshIndexT const& index) { return index.triangles().size(); })
+		.def_property_readonly("mesh_count", [](MeshIndexT const& index) { return index.parts().size(); })
+		.def_property_readonly("query_count", &MeshIndexT::queryCount,
+			"Number of samples projected since creation or the last call to reset_counters()")
+		.def_property_readonly("early_exit_count", &MeshIndexT::earlyExitCount,
+			"Number of samples whose search stopped early because they were within early_exit_distance of the mesh")
+		.def("reset_counters", &MeshIndexT::resetCounters)
+		.def("layer_count", [](MeshIndexT const& index, size_t object_id) { return index.layerCount(object_id); },
+			"Number of distinct integer z planes (i.e. materials) in which triangles of the given mesh are indexed separately",
+			py::arg("object_id") = 0
+			)
+		;
+}
+
+PYBIND11_MODULE(Accel, m) {
+	m.doc() =
+		"Accel internal module for DagAmendment\n"
+		"\n"
+		"Thread safety: all functions release the GIL while processing, so\n"
+		"they can be called from several Python threads at once. Different\n"
+		"MeshIndex objects are fully independent. Calls to project() and\n"
+		"same_triangles() on the same MeshIndex may run concurrently, while\n"
+		"refit() waits for running queries to finish and blocks new ones.\n"
+		"Input arrays must not be modified by another thread during a call.\n"
+		"Each call uses its own OpenMP team, so when calling from a thread\n"
+		"pool one may limit OMP_NUM_THREADS to avoid oversubscription.";
+	m.attr("__version__") = version;
+
+	m.def("thread_count", &threadCount,
+		"Number of threads used by calls made from the current Python thread (1 if built without OpenMP)");
+	m.def("set_thread_count", &setThreadCount,
+		"Set the number of threads used by calls made from the current Python thread",
+		py::arg("count")
+		);
+
+	// Both overloads are tried without implicit conversion before allowing
+	// conversions, so float32 (resp. float64) arrays are used in place by
+	// the float (resp. double) version. Inputs that mix dtypes fall back to
+	// the double version, which is registered first.
+	defineProjectFunctions<double, glm::dvec3>(m);
+	defineProjectFunctions<float, glm::vec3>(m);
+
+	// Blender exposes mesh data as float32 so this is the default index,
+	// input arrays of another dtype are converted to float32.
+	defineMeshIndex<float, glm::vec3>(m, "MeshIndex",
+		"Mesh with a spatial index, built once and queried many times (float32)");
+	defineMeshIndex<double, glm::dvec3>(m, "MeshIndex64",
+		"Mesh with a spatial index, built once and queried many times (float64)");
+}
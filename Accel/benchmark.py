@@ -0,0 +1,564 @@
+# This file is part of DagAmendment, the reference implementation of:
+#
+#   Michel, Élie and Boubekeur, Tamy (2021).
+#   DAG Amendment for Inverse Control of Parametric Shapes
+#   ACM Transactions on Graphics (Proc. SIGGRAPH 2021), 173:1-173:14.
+#
+# Copyright (c) 2020-2021 -- Télécom Paris (Élie Michel <elie.michel@telecom-paris.fr>)
+#
+# The MIT license:
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the “Software”), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# The Software is provided “as is”, without warranty of any kind, express or
+# implied, including but not limited to the warranties of merchantability,
+# fitness for a particular purpose and non-infringement. In no event shall the
+# authors or copyright holders be liable for any claim, damages or other
+# liability, whether in an action of contract, tort or otherwise, arising
+# from, out of or in connection with the software or the use or other dealings
+# in the Software.
+
+"""
+Benchmark and correctness suite for Accel, that runs without Blender on
+synthetic meshes. Usage:
+
+    python benchmark.py [--build-dir path/to/build/dir] [--output results.json]
+
+For each mesh, a subset of the samples is checked against a pure numpy
+implementation of the closest point search (and of ray casting, and
+position evaluation), then the throughput of
+MeshIndex.project() is measured (in queries per second) for several
+sample counts and thread counts. Results are printed and optionally
+saved as JSON so that they can be compared across revisions.
+
+Run with --quick for a short correctness-only run (see test.py).
+"""
+
+import sys
+import json
+import time
+import platform
+import argparse
+from datetime import datetime
+import numpy as np
+
+# -------------------------------------------------------------------
+# Synthetic meshes
+
+def grid_mesh(resolution):
+    """Flat square grid with 2 * resolution² triangles"""
+    xs = np.linspace(0, 1, resolution + 1, dtype='f')
+    X, Y = np.meshgrid(xs, xs, indexing='ij')
+    vertices = np.stack((X.ravel(), Y.ravel(), np.zeros(X.size, 'f')), axis=1)
+    idx = np.arange((resolution + 1) ** 2, dtype='i').reshape(resolution + 1, resolution + 1)
+    a, b = idx[:-1,:-1].ravel(), idx[1:,:-1].ravel()
+    c, d = idx[1:,1:].ravel(), idx[:-1,1:].ravel()
+    triangles = np.concatenate((np.stack((a, b, c), axis=1), np.stack((a, c, d), axis=1)))
+    return vertices, triangles
+
+def sphere_mesh(resolution):
+    """UV sphere of radius 1 with 2 * resolution² triangles"""
+    vertices, triangles = grid_mesh(resolution)
+    theta = vertices[:,0] * 2 * np.pi
+    phi = vertices[:,1] * np.pi
+    vertices = np.stack((
+        np.sin(phi) * np.cos(theta),
+        np.sin(phi) * np.sin(theta),
+        np.cos(phi),
+    ), axis=1).astype('f')
+    return vertices, triangles
+
+def uv_mesh(resolution, material_count=4, seed=0):
+    """
+    Mesh similar to the uv-coparam meshes built by uv_coparam.get_uv_mesh():
+    the grid is cut in square islands of random material, and the z
+    coordinate of each island is its material index.
+    """
+    rng = np.random.default_rng(seed)
+    vertices, triangles = grid_mesh(resolution)
+    # Unweld vertices so that islands are independent
+    vertices = vertices[triangles].reshape(-1, 3)
+    triangles = np.arange(len(vertices), dtype='i').reshape(-1, 3)
+    island_count = max(1, resolution // 8)
+    centroids = vertices[triangles].mean(axis=1)
+    island = (centroids[:,0] * island_count).astype('i') * island_count + (centroids[:,1] * island_count).astype('i')
+    island_material = rng.integers(0, material_count, island_count * island_count)
+    vertices[:,2] = np.repeat(island_material[island], 3)
+    return vertices, triangles
+
+def make_meshes(sizes):
+    """Generate all kinds of meshes for each target number of triangles"""
+    generators = {
+        "grid": grid_mesh,
+        "sphere": sphere_mesh,
+        "uv": uv_mesh,
+    }
+    for triangle_count in sizes:
+        resolution = max(1, int(round(np.sqrt(triangle_count / 2))))
+        for kind, generator in generators.items():
+            yield f"{kind}-{triangle_count}", generator(resolution)
+
+def make_samples(vertices, triangles, sample_count, jitter, seed=0):
+    """Random points on the mesh, displaced by up to jitter"""
+    rng = np.random.default_rng(seed)
+    triangle_indices = rng.integers(0, len(triangles), sample_count)
+    bcoords = rng.dirichlet((1, 1, 1), sample_count)
+    corners = vertices[triangles[triangle_indices]].astype('d')
+    samples = np.einsum('ij,ijk->ik', bcoords, corners)
+    samples += (rng.random(samples.shape) * 2 - 1) * jitter
+    return samples.astype('f')
+
+# -------------------------------------------------------------------
+# Numpy reference
+
+def reference_closest_points(p, a, b, c):
+    """
+    Closest point from each p to the triangles (a, b, c), vectorized over
+    all dimensions but the last one (following Ericson's Real-Time Collision
+    Detection, like closest_point.h). Returns the closest points.
+    """
+    def dot(u, v):
+        return (u * v).sum(axis=-1)
+    ab, ac, ap = b - a, c - a, p - a
+    bp, cp = p - b, p - c
+    d1, d2 = dot(ab, ap), dot(ac, ap)
+    d3, d4 = dot(ab, bp), dot(ac, bp)
+    d5, d6 = dot(ab, cp), dot(ac, cp)
+    va = d3 * d6 - d5 * d4
+    vb = d5 * d2 - d1 * d6
+    vc = d1 * d4 - d3 * d2
+
+    # Degenerate triangles (e.g. at the poles of spheres) yield NaNs in
+    # branches that are not selected for them
+    with np.errstate(divide='ignore', invalid='ignore'):
+        v_ab = d1 / (d1 - d3)
+        w_ac = d2 / (d2 - d6)
+        w_bc = (d4 - d3) / ((d4 - d3) + (d5 - d6))
+        denom = 1 / (va + vb + vc)
+        v_in, w_in = vb * denom, vc * denom
+
+        conditions = [
+            (d1 <= 0) & (d2 <= 0),
+            (d3 >= 0) & (d4 <= d3),
+            (d6 >= 0) & (d5 <= d6),
+            (vc <= 0) & (d1 >= 0) & (d3 <= 0),
+            (vb <= 0) & (d2 >= 0) & (d6 <= 0),
+            (va <= 0) & (d4 - d3 >= 0) & (d5 - d6 >= 0),
+        ]
+        choices = [
+            a,
+            b,
+            c,
+            a + v_ab[...,np.newaxis] * ab,
+            a + w_ac[...,np.newaxis] * ac,
+            b + w_bc[...,np.newaxis] * (c - b),
+        ]
+        inside = a + v_in[...,np.newaxis] * ab + w_in[...,np.newaxis] * ac
+    conditions = [cond[...,np.newaxis] for cond in conditions]
+    return np.select(conditions, choices, inside)
+
+def reference_distances(vertices, triangles, samples, chunk_size=1 << 22):
+    """Distance from each sample to the mesh, by brute force"""
+    vertices = vertices.astype('d')
+    corners = vertices[triangles]
+    distances = np.full(len(samples), np.inf)
+    samples_per_chunk = max(1, chunk_size // max(1, len(triangles)))
+    for start in range(0, len(samples), samples_per_chunk):
+        p = samples[start:start + samples_per_chunk,np.newaxis,:].astype('d')
+        closest = reference_closest_points(p, corners[:,0], corners[:,1], corners[:,2])
+        distances[start:start + samples_per_chunk] = np.linalg.norm(closest - p, axis=-1).min(axis=1)
+    return distances
+
+def reference_ray_distances(vertices, triangles, origins, directions, chunk_size=1 << 22):
+    """
+    Parameter t of the first hit of each ray (origin + t * direction) with
+    the mesh, by brute force (Möller-Trumbore, like ray_triangle.h), and
+    the index of the hit triangle. Rays that miss get (inf, -1).
+    """
+    corners = vertices[triangles].astype('d')
+    a = corners[:,0]
+    e1, e2 = corners[:,1] - a, corners[:,2] - a
+    distances = np.full(len(origins), np.inf)
+    hit_triangles = np.full(len(origins), -1)
+    rays_per_chunk = max(1, chunk_size // max(1, len(triangles)))
+    for start in range(0, len(origins), rays_per_chunk):
+        o = origins[start:start + rays_per_chunk,np.newaxis,:].astype('d')
+        d = directions[start:start + rays_per_chunk,np.newaxis,:].astype('d')
+        p = np.cross(d, e2)
+        det = (e1 * p).sum(axis=-1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            inv_det = 1 / det
+            s = o - a
+            u = (s * p).sum(axis=-1) * inv_det
+            q = np.cross(s, e1)
+            v = (d * q).sum(axis=-1) * inv_det
+            t = (e2 * q).sum(axis=-1) * inv_det
+        valid = (np.abs(det) > 1e-12) & (u >= 0) & (v >= 0) & (u + v <= 1) & (t > 0)
+        t = np.where(valid, t, np.inf)
+        distances[start:start + rays_per_chunk] = t.min(axis=1)
+        hit_triangles[start:start + rays_per_chunk] = np.where(np.isfinite(t.min(axis=1)), t.argmin(axis=1), -1)
+    return distances, hit_triangles
+
+# -------------------------------------------------------------------
+# Checks
+
+def check_projection(Accel, name, vertices, triangles, samples, method, tolerance=1e-4, expected=None):
+    """
+    Compare the result of Accel.project() with the numpy reference and
+    check the consistency of its outputs. Returns a list of error messages.
+    @param expected: result of reference_distances(), computed if None
+    """
+    errors = []
+    projections, bcoords, proj_triangles = Accel.project(vertices, triangles, samples, method=method)
+
+    if (proj_triangles < 0).any() or (proj_triangles >= len(triangles)).any():
+        return [f"{name} ({method}): triangle indices out of range"]
+
+    distances = np.linalg.norm(projections.astype('d') - samples, axis=1)
+    if expected is None:
+        expected = reference_distances(vertices, triangles, samples)
+    wrong = np.abs(distances - expected) > tolerance
+    if wrong.any():
+        errors.append(f"{name} ({method}): {wrong.sum()} samples are not projected onto the closest point (max error {np.abs(distances - expected).max()})")
+
+    # The returned point must be the one at bcoords on the returned triangle
+    corners = vertices[triangles[proj_triangles]].astype('d')
+    reconstructed = np.einsum('ij,ijk->ik', bcoords, corners)
+    drift = np.linalg.norm(reconstructed - projections, axis=1)
+    if (drift > tolerance).any():
+        errors.append(f"{name} ({method}): barycentric coordinates do not match projections (max error {drift.max()})")
+
+    if (np.abs(bcoords.sum(axis=1) - 1) > tolerance).any() or (bcoords < -tolerance).any():
+        errors.append(f"{name} ({method}): invalid barycentric coordinates")
+
+    return errors
+
+def check_index_consistency(Accel, name, vertices, triangles, samples):
+    """MeshIndex, refit and batched projection must agree with project()"""
+    errors = []
+    expected = Accel.project(vertices, triangles, samples)
+
+    index = Accel.MeshIndex(vertices * 2, triangles)
+    index.refit(vertices)
+    result = index.project(samples)
+    if not (result[2] == expected[2]).all():
+        errors.append(f"{name}: refitted MeshIndex does not match project()")
+
+    # Same mesh twice in a batch, each half of the samples on one copy
+    half = len(samples) // 2
+    vertex_offsets = np.array([0, len(vertices), 2 * len(vertices)], 'i')
+    triangle_offsets = np.array([0, len(triangles), 2 * len(triangles)], 'i')
+    object_ids = (np.arange(len(samples)) >= half).astype('i')
+    result = Accel.project_batch(
+        np.concatenate((vertices, vertices)),
+        np.concatenate((triangles, triangles)),
+        vertex_offsets, triangle_offsets,
+        samples, object_ids,
+    )
+    if not (result[2] == expected[2]).all():
+        errors.append(f"{name}: project_batch() does not match project()")
+
+    return errors
+
+def make_rays(vertices, triangles, ray_count, seed=0):
+    """
+    Rays aiming at random points of the mesh from random directions, half
+    of them being then flipped so that they may miss the mesh
+    """
+    rng = np.random.default_rng(seed)
+    targets = make_samples(vertices, triangles, ray_count, 0.0, seed)
+    offsets = rng.normal(size=(ray_count, 3))
+    offsets /= np.linalg.norm(offsets, axis=1)[:,np.newaxis]
+    origins = (targets + 2 * offsets).astype('f')
+    directions = (targets - origins).astype('f')
+    directions[::2] *= -1
+    return origins, directions
+
+def check_ray_casts(Accel, name, vertices, triangles, ray_count, tolerance=1e-4):
+    """
+    Compare MeshIndex.cast_rays() with the brute force method and the numpy
+    reference, on two copies of the mesh (the second one being shifted) to
+    check that hits are reported on the right object.
+    """
+    errors = []
+    shift = np.array([0, 0, 0.5], 'f')
+    all_vertices = np.concatenate((vertices, vertices + shift))
+    all_triangles = np.concatenate((triangles, triangles))
+    vertex_offsets = np.array([0, len(vertices), 2 * len(vertices)], 'i')
+    triangle_offsets = np.array([0, len(triangles), 2 * len(triangles)], 'i')
+    origins, directions = make_rays(vertices, triangles, ray_count)
+
+    index = Accel.MeshIndex(all_vertices, all_triangles, vertex_offsets, triangle_offsets)
+    hits, locations, bcoords, hit_triangles, object_ids = index.cast_rays(origins, directions)
+    brute_force = Accel.cast_rays(all_vertices, all_triangles, origins, directions, vertex_offsets, triangle_offsets, method="brute_force")
+
+    global_triangles = np.concatenate((triangles, triangles + len(vertices)))
+    expected_distances, expected_triangles = reference_ray_distances(all_vertices, global_triangles, origins, directions)
+    expected_hits = np.isfinite(expected_distances)
+    # Rays that graze an edge of the mesh may legitimately hit or miss it
+    # depending on rounding, they are the ones the reference hits at a
+    # distance that Accel does not agree with
+    if (hits != expected_hits).sum() > ray_count // 100:
+        errors.append(f"{name}: cast_rays() hits {hits.sum()} rays, {expected_hits.sum()} expected")
+    if (hits != brute_force[0]).any():
+        errors.append(f"{name}: cast_rays() does not hit the same rays with 'bvh' and 'brute_force'")
+
+    both = hits & expected_hits & brute_force[0]
+    expected_locations = origins[both] + expected_distances[both,np.newaxis] * directions[both]
+    error = np.linalg.norm(locations[both] - expected_locations, axis=1)
+    if (error > tolerance).any():
+        errors.append(f"{name}: cast_rays() hit locations differ from the reference (max error {error.max()})")
+    if not np.allclose(locations[both], brute_force[1][both], atol=tolerance):
+        errors.append(f"{name}: cast_rays() hit locations differ between 'bvh' and 'brute_force'")
+
+    expected_object_ids = (expected_triangles[both] >= len(triangles)).astype('i')
+    if (object_ids[both] != expected_object_ids).any() or (object_ids[both] != brute_force[4][both]).any():
+        errors.append(f"{name}: cast_rays() reports hits on the wrong object")
+    if (object_ids[~hits] != -1).any() or (hit_triangles[~hits] != -1).any() or not np.isnan(locations[~hits]).all():
+        errors.append(f"{name}: cast_rays() reports data for rays that miss")
+
+    # The returned location must be the one at bcoords on the returned triangle
+    corners = all_vertices[global_triangles[hit_triangles[hits] + triangle_offsets[object_ids[hits]]]].astype('d')
+    reconstructed = np.einsum('ij,ijk->ik', bcoords[hits], corners)
+    drift = np.linalg.norm(reconstructed - locations[hits], axis=1)
+    if (drift > tolerance).any():
+        errors.append(f"{name}: cast_rays() barycentric coordinates do not match hit locations (max error {drift.max()})")
+
+    return errors
+
+def check_early_exit(Accel, name, vertices, triangles, samples, early_exit_distance=1e-3, tolerance=1e-4, expected=None):
+    """
+    With an early exit distance, MeshIndex.project() may return any point
+    closer than this distance, otherwise the closest point. The early exit
+    counter must count the former.
+    @param expected: result of reference_distances(), computed if None
+    """
+    errors = []
+    index = Accel.MeshIndex(vertices, triangles)
+    if expected is None:
+        expected = reference_distances(vertices, triangles, samples)
+    index.reset_counters()
+    projections, _, _ = index.project(samples, early_exit_distance=early_exit_distance)
+    distances = np.linalg.norm(projections.astype('d') - samples, axis=1)
+
+    early = distances <= early_exit_distance
+    wrong = ~early & (np.abs(distances - expected) > tolerance)
+    if wrong.any():
+        errors.append(f"{name}: {wrong.sum()} samples farther than early_exit_distance are not projected onto the closest point")
+    if (early & (expected > early_exit_distance + tolerance)).any():
+        errors.append(f"{name}: early exit reported for samples that are far from the mesh")
+    if index.query_count != len(samples) or index.early_exit_count != early.sum():
+        errors.append(f"{name}: early exit counters are {index.early_exit_count}/{index.query_count}, expected {early.sum()}/{len(samples)}")
+    return errors
+
+def check_bound_positions(Accel, name, vertices, triangles, samples, max_error=1e-3, tolerance=1e-3, seed=0):
+    """
+    eval_bound_positions() must give the transformed position, on the
+    original mesh, of the projection of samples onto the indexed mesh
+    (this is how uv_coparam.CoparamBinding evaluates coparams). The
+    original mesh of each part is an affine function of the indexed one,
+    so that the expected position does not depend on which triangle a
+    sample is projected onto when it lies on an edge.
+    """
+    errors = []
+    rng = np.random.default_rng(seed)
+    n = len(vertices)
+    affine = rng.normal(size=(2, 3, 3))
+    translation = rng.normal(size=(2, 3))
+    orig_vertices = [(vertices @ affine[i].T + translation[i]).astype('f') for i in range(2)]
+    matrices = np.tile(np.eye(4), (2, 1, 1))
+    matrices[:,:3,:] = rng.normal(size=(2, 3, 4))
+    matrices = matrices.astype('f')
+
+    vertex_offsets = np.array([0, n, 2 * n], 'i')
+    triangle_offsets = np.array([0, len(triangles), 2 * len(triangles)], 'i')
+    index = Accel.MeshIndex(np.concatenate((vertices, vertices)), np.concatenate((triangles, triangles)), vertex_offsets, triangle_offsets)
+    object_ids = (np.arange(len(samples)) % 2).astype('i')
+
+    projections, bcoords, proj_triangles = index.project(samples, object_ids)
+    distances = np.linalg.norm(projections.astype('d') - samples, axis=1)
+    found = distances <= max_error
+
+    positions = Accel.eval_bound_positions(triangles[proj_triangles], bcoords, object_ids, orig_vertices, matrices, found)
+
+    # Expected result, from the exact closest points
+    local = np.einsum('ijk,ik->ij', affine[object_ids], projections.astype('d')) + translation[object_ids]
+    M = matrices[object_ids].astype('d')
+    expected = np.einsum('ijk,ik->ij', M[:,:3,:3], local) + M[:,:3,3]
+
+    error = np.linalg.norm(positions[found] - expected[found], axis=1)
+    if (error > tolerance).any():
+        errors.append(f"{name}: eval_bound_positions() differs from the reference (max error {error.max()})")
+    if not np.isnan(positions[~found]).all():
+        errors.append(f"{name}: eval_bound_positions() does not give NaN positions where found is false")
+
+    return errors
+
+def check_coparam_binding(Accel, name, vertices, triangles, sample_count, min_found_rate=0.99, seed=0):
+    """
+    Coparams are float32 barycentric combinations of the corners of uv mesh
+    triangles (see uv_coparam.hits_to_coparams()). Binding them projects
+    them with a MeshIndex64 and considers them found when closer than a
+    tolerance that accounts for float32 precision (see
+    uv_coparam.bind_coparams() and projection_tolerance(), replicated here
+    since they require Blender). Nearly all of them must be found.
+    """
+    rng = np.random.default_rng(seed)
+    triangle_indices = rng.integers(0, len(triangles), sample_count)
+    bcoords = rng.dirichlet((1, 1, 1), sample_count).astype('f')
+    samples = np.einsum('ij,ijk->ik', bcoords, vertices[triangles[triangle_indices]])
+
+    max_projection_error = 1e-7  # default of the SmartGrab operator
+    scale = max(1.0, float(np.abs(samples).max(initial=0)))
+    tolerance = max(max_projection_error, 4 * np.finfo(samples.dtype).eps * scale)
+
+    index = Accel.MeshIndex64(vertices, triangles)
+    projections, _, _ = index.project(samples.astype('d'), early_exit_distance=tolerance)
+    found_rate = (np.linalg.norm(projections - samples, axis=1) <= tolerance).mean()
+    if found_rate < min_found_rate:
+        return [f"{name}: only {found_rate:.1%} of coparams are found when binding them"]
+    return []
+
+# -------------------------------------------------------------------
+# Benchmark
+
+def measure_throughput(Accel, vertices, triangles, samples, thread_counts, repeat):
+    """Queries per second of MeshIndex.project() for each thread count"""
+    index = Accel.MeshIndex(vertices, triangles)
+    results = []
+    initial_thread_count = Accel.thread_count()
+    for thread_count in thread_counts:
+        Accel.set_thread_count(thread_count)
+        durations = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            index.project(samples)
+            durations.append(time.perf_counter() - start)
+        best = min(durations)
+        results.append({
+            "threads": thread_count,
+            "best_seconds": best,
+            "median_seconds": float(np.median(durations)),
+            "queries_per_second": len(samples) / best if best > 0 else float('inf'),
+        })
+    Accel.set_thread_count(initial_thread_count)
+    return results
+
+def measure_build(Accel, vertices, triangles, repeat):
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        Accel.MeshIndex(vertices, triangles)
+        durations.append(time.perf_counter() - start)
+    return min(durations)
+
+def default_thread_counts(Accel):
+    max_count = Accel.thread_count()
+    counts = [1]
+    while counts[-1] * 2 < max_count:
+        counts.append(counts[-1] * 2)
+    if max_count > 1:
+        counts.append(max_count)
+    return counts
+
+# -------------------------------------------------------------------
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--build-dir", action='append', default=[],
+                        help="Directory containing the built Accel module (may be repeated)")
+    parser.add_argument("--output", help="Save results to this JSON file")
+    parser.add_argument("--sizes", type=int, nargs='+', default=[1000, 10000, 100000, 1000000],
+                        help="Approximate number of triangles of the test meshes")
+    parser.add_argument("--sample-counts", type=int, nargs='+', default=[1000, 10000, 100000],
+                        help="Number of samples projected at once")
+    parser.add_argument("--thread-counts", type=int, nargs='+',
+                        help="Number of threads to test (default: powers of 2 up to the number of cores)")
+    parser.add_argument("--check-samples", type=int, default=256,
+                        help="Number of samples checked against the numpy reference")
+    parser.add_argument("--repeat", type=int, default=5,
+                        help="Number of runs of each measure, the best one is reported")
+    parser.add_argument("--quick", action='store_true',
+                        help="Only run correctness checks on small meshes")
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    sys.path.extend(args.build_dir)
+    import Accel
+
+    if args.quick:
+        args.sizes = [1000, 10000]
+
+    thread_counts = args.thread_counts or default_thread_counts(Accel)
+    report = {
+        "date": datetime.now().isoformat(),
+        "accel_version": Accel.__version__,
+        "numpy_version": np.__version__,
+        "python_version": platform.python_version(),
+        "platform": platform.platform(),
+        "processor": platform.processor(),
+        "max_threads": Accel.thread_count(),
+        "meshes": [],
+        "errors": [],
+    }
+
+    for name, (vertices, triangles) in make_meshes(args.sizes):
+        print(f"{name}: {len(vertices)} vertices, {len(triangles)} triangles")
+        mesh_report = {
+            "name": name,
+            "vertex_count": len(vertices),
+            "triangle_count": len(triangles),
+        }
+
+        # Correctness, on both points close to the mesh and far from it
+        errors = []
+        for jitter in (0.0, 0.01, 0.5):
+            samples = make_samples(vertices, triangles, args.check_samples, jitter)
+            expected = reference_distances(vertices, triangles, samples)
+            methods = ["bvh", "brute_force"] if len(triangles) <= 10000 else ["bvh"]
+            for method in methods:
+                errors += check_projection(Accel, name, vertices, triangles, samples, method, expected=expected)
+            errors += check_index_consistency(Accel, name, vertices, triangles, samples)
+            errors += check_early_exit(Accel, name, vertices, triangles, samples, expected=expected)
+            errors += check_bound_positions(Accel, name, vertices, triangles, samples)
+        if len(triangles) <= 10000:
+            errors += check_ray_casts(Accel, name, vertices, triangles, args.check_samples)
+        errors += check_coparam_binding(Accel, name, vertices, triangles, args.check_samples)
+        for error in errors:
+            print(f"  ERROR: {error}")
+        mesh_report["errors"] = errors
+        report["errors"] += errors
+
+        if not args.quick:
+            mesh_report["build_seconds"] = measure_build(Accel, vertices, triangles, args.repeat)
+            print(f"  build: {mesh_report['build_seconds'] * 1000:.3f}ms")
+            mesh_report["throughput"] = []
+            for sample_count in args.sample_counts:
+                samples = make_samples(vertices, triangles, sample_count, 0.01)
+                for result in measure_throughput(Accel, vertices, triangles, samples, thread_counts, args.repeat):
+                    result["sample_count"] = sample_count
+                    mesh_report["throughput"].append(result)
+                    print(f"  {sample_count:>8} samples, {result['threads']:>3} threads: {result['queries_per_second']:>14,.0f} queries/s")
+
+        report["meshes"].append(mesh_report)
+
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Results saved to {args.output}")
+
+    if report["errors"]:
+        print(f"{len(report['errors'])} errors")
+        sys.exit(1)
+    print("All checks passed")
+
+if __name__ == "__main__":
+    main()
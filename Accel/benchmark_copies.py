@@ -0,0 +1,133 @@
+# This file is part of DagAmendment, the reference implementation of:
+#
+#   Michel, Élie and Boubekeur, Tamy (2021).
+#   DAG Amendment for Inverse Control of Parametric Shapes
+#   ACM Transactions on Graphics (Proc. SIGGRAPH 2021), 173:1-173:14.
+#
+# Copyright (c) 2020-2021 -- Télécom Paris (Élie Michel <elie.michel@telecom-paris.fr>)
+#
+# The MIT license:
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the “Software”), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# The Software is provided “as is”, without warranty of any kind, express or
+# implied, including but not limited to the warranties of merchantability,
+# fitness for a particular purpose and non-infringement. In no event shall the
+# authors or copyright holders be liable for any claim, damages or other
+# liability, whether in an action of contract, tort or otherwise, arising
+# from, out of or in connection with the software or the use or other dealings
+# in the Software.
+
+"""
+Measure the amount of memory that pybind11 allocates to convert input
+arrays when calling Accel with the float32 arrays that Blender provides.
+"Before" is a build of Accel from before float32 kernels were bound, in
+which MeshIndex and project() only accept float64 arrays; "after" is the
+current build. Both are called the way DagAmendment calls them, each one
+in its own process since pybind11 cannot load both. Usage:
+
+    python benchmark_copies.py --build-dir path/to/build --before-build-dir path/to/previous/build
+
+where the previous build is made with CMake from the Accel directory of a
+checkout of the commit that precedes the float32 kernels.
+
+Numpy reports its allocations to tracemalloc, so the peak traced memory
+minus the size of the returned arrays is what got allocated for temporary
+copies.
+"""
+
+import sys
+import json
+import argparse
+import subprocess
+import tracemalloc
+import numpy as np
+
+# Grid resolution and sample count of each measure
+SIZES = [(32, 256), (128, 1024), (512, 4096)]
+
+# -------------------------------------------------------------------
+
+def grid_mesh(resolution):
+    """Flat square grid with 2 * resolution² triangles, in float32"""
+    xs = np.linspace(0, 1, resolution + 1, dtype='f')
+    X, Y = np.meshgrid(xs, xs, indexing='ij')
+    vertices = np.stack((X.ravel(), Y.ravel(), np.zeros(X.size, 'f')), axis=1)
+    idx = np.arange((resolution + 1) ** 2, dtype='i').reshape(resolution + 1, resolution + 1)
+    a, b = idx[:-1,:-1].ravel(), idx[1:,:-1].ravel()
+    c, d = idx[1:,1:].ravel(), idx[:-1,1:].ravel()
+    triangles = np.concatenate((np.stack((a, b, c), axis=1), np.stack((a, c, d), axis=1)))
+    return vertices, triangles
+
+def copied_bytes(func, *args):
+    """Bytes allocated during func(*args) that are not part of its output"""
+    tracemalloc.start()
+    result = func(*args)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    outputs = result if isinstance(result, tuple) else ()
+    return peak - sum(x.nbytes for x in outputs)
+
+def measure(build_dirs):
+    """
+    Bytes copied when building a MeshIndex, projecting onto it, and calling
+    project(), for each entry of SIZES, using the Accel module found in
+    build_dirs
+    """
+    sys.path.extend(build_dirs)
+    import Accel
+
+    rng = np.random.default_rng(3615)
+    measures = []
+    for resolution, sample_count in SIZES:
+        vertices, triangles = grid_mesh(resolution)
+        samples = rng.random((sample_count, 3), dtype='f')
+        build = copied_bytes(Accel.MeshIndex, vertices, triangles)
+        index = Accel.MeshIndex(vertices, triangles)
+        index_project = copied_bytes(index.project, samples)
+        project = copied_bytes(Accel.project, vertices, triangles, samples)
+        measures.append((build, index_project, project))
+    return measures
+
+def measure_in_subprocess(build_dirs):
+    command = [sys.executable, __file__, "--measure-only"]
+    for build_dir in build_dirs:
+        command += ["--build-dir", build_dir]
+    output = subprocess.run(command, check=True, capture_output=True, text=True).stdout
+    return json.loads(output)
+
+# -------------------------------------------------------------------
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--build-dir", action='append', default=[],
+                        help="Directory containing the current Accel module (can be repeated)")
+    parser.add_argument("--before-build-dir", action='append', default=[],
+                        help="Directory containing the Accel module to compare with (can be repeated)")
+    parser.add_argument("--measure-only", action='store_true',
+                        help="Only print the measures of the module found in --build-dir, as JSON")
+    args = parser.parse_args()
+
+    if args.measure_only:
+        print(json.dumps(measure(args.build_dir)))
+        return
+    if not args.before_build_dir:
+        parser.error("--before-build-dir is required")
+
+    before = measure_in_subprocess(args.before_build_dir)
+    after = measure_in_subprocess(args.build_dir)
+
+    print(f"{'triangles':>10} {'samples':>8} | {'build before':>12} {'after':>10} | {'index.project before':>20} {'after':>10} | {'project before':>14} {'after':>10}")
+    for (resolution, sample_count), (build_before, index_before, project_before), (build_after, index_after, project_after) in zip(SIZES, before, after):
+        triangle_count = 2 * resolution * resolution
+        print(f"{triangle_count:>10} {sample_count:>8} | {build_before:>12} {build_after:>10} | {index_before:>20} {index_after:>10} | {project_before:>14} {project_after:>10}")
+
+if __name__ == "__main__":
+    main()
@@ -104,7 +104,7 @@ def main():
         return
     sys.path.append(join(build_dir, "Release"))
 
-    import DiffParamAccel
+    import Accel
 
     sample_count_per_face = 1
 
@@ -129,7 +129,7 @@ def main():
         jittered_samples = samples + jitter
         
         timer = Timer()
-        projections, bcoords, proj_triangles = DiffParamAccel.project(vertices, triangles, samples)
+        projections, bcoords, proj_triangles = Accel.project(vertices, triangles, samples)
         profiling["project"].add_sample(timer)
 
         norms = norm(projections - samples, axis=1)
@@ -0,0 +1,345 @@
+/**
+ * This file is part of DagAmendment, the reference implementation of:
+ *
+ *   Michel, Élie and Boubekeur, Tamy (2021).
+ *   DAG Amendment for Inverse Control of Parametric Shapes
+ *   ACM Transactions on Graphics (Proc. SIGGRAPH 2021), 173:1-173:14.
+ *
+ * Copyright (c) 2020-2021 -- Télécom Paris (Élie Michel <elie.michel@telecom-paris.fr>)
+ *
+ * The MIT license:
+ * Permission is hereby granted, free of charge, to any person obtaining a copy
+ * of this software and associated documentation files (the “Software”), to
+ * deal in the Software without restriction, including without limitation the
+ * rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+ * sell copies of the Software, and to permit persons to whom the Software is
+ * furnished to do so, subject to the following conditions:
+ *
+ * The above copyright notice and this permission notice shall be included in
+ * all copies or substantial portions of the Software.
+ *
+ * The Software is provided “as is”, without warranty of any kind, express or
+ * implied, including but not limited to the warranties of merchantability,
+ * fitness for a particular purpose and non-infringement. In no event shall the
+ * authors or copyright holders be liable for any claim, damages or other
+ * liability, whether in an action of contract, tort or otherwise, arising
+ * from, out of or in connection with the software or the use or other dealings
+ * in the Software.
+ */
+
+#pragma once
+
+#include <glm/glm.hpp>
+
+#include <vector>
+#include <algorithm>
+#include <limits>
+
+#include "closest_point.h"
+#include "ray_triangle.h"
+
+template<typename Float, typename Vec3>
+struct Aabb {
+	Vec3 min = Vec3(std::numeric_limits<Float>::max());
+	Vec3 max = Vec3(std::numeric_limits<Float>::lowest());
+
+	void extend(Vec3 const& p) {
+		min = glm::min(min, p);
+		max = glm::max(max, p);
+	}
+
+	void extend(Aabb const& other) {
+		min = glm::min(min, other.min);
+		max = glm::max(max, other.max);
+	}
+
+	/**
+	 * Squared distance from p to the box (0 if p is inside)
+	 */
+	Float squaredDistance(Vec3 const& p) const {
+		Vec3 d = glm::max(Vec3(0), glm::max(min - p, p - max));
+		return dot(d, d);
+	}
+
+	/**
+	 * Distance along the ray at which it enters the box (0 if the origin
+	 * is inside), or infinity if it misses it. invDirection is 1/direction
+	 * (componentwise, with infinities for null components).
+	 */
+	Float rayEntryDistance(Vec3 const& origin, Vec3 const& invDirection) const {
+		Vec3 t0 = (min - origin) * invDirection;
+		Vec3 t1 = (max - origin) * invDirection;
+		Vec3 tmin = glm::min(t0, t1);
+		Vec3 tmax = glm::max(t0, t1);
+		// Written so that NaNs (0 * inf when the origin is on a slab) are ignored
+		Float entry = 0;
+		Float exit = std::numeric_limits<Float>::max();
+		for (int k = 0; k < 3; ++k) {
+			if (tmin[k] > entry) entry = tmin[k];
+			if (tmax[k] < exit) exit = tmax[k];
+		}
+		return entry <= exit ? entry : std::numeric_limits<Float>::infinity();
+	}
+};
+
+/**
+ * Result of a closest point query on a BVH
+ */
+template<typename Float, typename Vec3>
+struct BvhHit {
+	Hit<Float, Vec3> hit;
+	Float squaredDistance = std::numeric_limits<Float>::max();
+	long long triangle = -1;
+};
+
+/**
+ * Bounding volume hierarchy over the triangles of a mesh, used to
+ * answer closest point queries without visiting all triangles.
+ * The BVH does not hold the mesh data, the same vertex and triangle
+ * arrays that were used to build it must be provided to queries.
+ */
+template<typename Float, typename Vec3>
+class Bvh {
+public:
+	using Box = Aabb<Float, Vec3>;
+
+	struct Node {
+		Box box;
+		// For leaves, range of triangles in m_triangleOrder,
+		// otherwise firstChild is the index of the left child (the right
+		// child is always at firstChild + 1) and triangleCount is 0.
+		int firstChild = -1;
+		int firstTriangle = 0;
+		int triangleCount = 0;
+	};
+
+	static constexpr int maxLeafSize = 4;
+
+	/**
+	 * Build the hierarchy over the triangles in range
+	 * [firstTriangle, firstTriangle + triangleCount), or over all triangles
+	 * if triangleCount is negative. Triangle indices returned by queries are
+	 * indices in the full triangle array.
+	 */
+	void build(std::vector<Vec3> const& vertices, std::vector<glm::ivec3> const& triangles, int firstTriangle = 0, int triangleCount = -1) {
+		if (triangleCount < 0) triangleCount = static_cast<int>(triangles.size()) - firstTriangle;
+		std::vector<int> subset(triangleCount);
+		for (int i = 0; i < triangleCount; ++i) {
+			subset[i] = firstTriangle + i;
+		}
+		build(vertices, triangles, subset);
+	}
+
+	/**
+	 * Build the hierarchy over an arbitrary subset of the triangles, given
+	 * by their indices in the full triangle array.
+	 */
+	void build(std::vector<Vec3> const& vertices, std::vector<glm::ivec3> const& triangles, std::vector<int> const& subset) {
+		int triangleCount = static_cast<int>(subset.size());
+
+		// During the build, m_triangleOrder holds indices in subset
+		m_nodes.clear();
+		m_triangleOrder.resize(triangleCount);
+		for (int i = 0; i < triangleCount; ++i) {
+			m_triangleOrder[i] = i;
+		}
+		if (triangleCount == 0) return;
+
+		std::vector<Vec3> centroids(triangleCount);
+		for (int i = 0; i < triangleCount; ++i) {
+			glm::ivec3 const& tri = triangles[subset[i]];
+			centroids[i] = (vertices[tri.x] + vertices[tri.y] + vertices[tri.z]) / Float(3);
+		}
+
+		m_nodes.reserve(2 * triangleCount / maxLeafSize + 1);
+		m_nodes.emplace_back();
+		buildRec(0, 0, triangleCount, subset, vertices, triangles, centroids);
+
+		for (int & triangle_idx : m_triangleOrder) {
+			triangle_idx = subset[triangle_idx];
+		}
+	}
+
+	/**
+	 * Recompute bounding boxes after vertices moved, keeping the same tree
+	 * structure. This is much cheaper than build() but the tree quality
+	 * degrades if vertices move a lot relatively to each others.
+	 */
+	void refit(std::vector<Vec3> const& vertices, std::vector<glm::ivec3> const& triangles) {
+		// Children are always stored after their parent
+		for (size_t nodeIdx = m_nodes.size(); nodeIdx-- > 0;) {
+			Node & node = m_nodes[nodeIdx];
+			Box box;
+			if (node.triangleCount > 0) {
+				for (int i = node.firstTriangle; i < node.firstTriangle + node.triangleCount; ++i) {
+					glm::ivec3 const& tri = triangles[m_triangleOrder[i]];
+					box.extend(vertices[tri.x]);
+					box.extend(vertices[tri.y]);
+					box.extend(vertices[tri.z]);
+				}
+			} else {
+				box.extend(m_nodes[node.firstChild].box);
+				box.extend(m_nodes[node.firstChild + 1].box);
+			}
+			node.box = box;
+		}
+	}
+
+	/**
+	 * Find the closest point to query on the mesh. Subtrees whose bounding
+	 * box is further than the best hit found so far are skipped.
+	 */
+	BvhHit<Float, Vec3> closestPoint(Vec3 const& query, std::vector<Vec3> const& vertices, std::vector<glm::ivec3> const& triangles) const {
+		BvhHit<Float, Vec3> best;
+		closestPoint(query, vertices, triangles, best);
+		return best;
+	}
+
+	/**
+	 * Same as above, but only replace best if a closer point is found. This
+	 * is used to search several hierarchies while pruning with the best hit
+	 * found in the previous ones.
+	 * The search stops as soon as a hit closer than earlyExitSquaredDistance
+	 * is found (never if it is negative), in which case that hit is kept
+	 * even though another triangle may be closer.
+	 */
+	void closestPoint(Vec3 const& query, std::vector<Vec3> const& vertices, std::vector<glm::ivec3> const& triangles, BvhHit<Float, Vec3> & best, Float earlyExitSquaredDistance = -1) const {
+		if (m_nodes.empty() || best.squaredDistance <= earlyExitSquaredDistance) return;
+
+		// Depth is in O(log n) since we split at the median
+		int stack[64];
+		int stackSize = 0;
+		stack[stackSize++] = 0;
+
+		while (stackSize > 0) {
+			Node const& node = m_nodes[stack[--stackSize]];
+			// Ties are explored too, to pick the same triangle as a brute force search
+			if (node.box.squaredDistance(query) > best.squaredDistance) continue;
+
+			if (node.triangleCount > 0) {
+				for (int i = node.firstTriangle; i < node.firstTriangle + node.triangleCount; ++i) {
+					int triangle_idx = m_triangleOrder[i];
+					glm::ivec3 const& tri = triangles[triangle_idx];
+					auto hit = closestPointTriangle<Float, Vec3>(query, vertices[tri.x], vertices[tri.y], vertices[tri.z]);
+					Vec3 diff = hit.point - query;
+					Float err = dot(diff, diff);
+					if (err < best.squaredDistance || (err == best.squaredDistance && triangle_idx < best.triangle)) {
+						best.hit = hit;
+						best.squaredDistance = err;
+						best.triangle = triangle_idx;
+						if (err <= earlyExitSquaredDistance) return;
+					}
+				}
+			} else {
+				// Push the furthest child first so that the closest one is visited first
+				int left = node.firstChild;
+				int right = node.firstChild + 1;
+				Float leftDistance = m_nodes[left].box.squaredDistance(query);
+				Float rightDistance = m_nodes[right].box.squaredDistance(query);
+				if (leftDistance < rightDistance) {
+					std::swap(left, right);
+					std::swap(leftDistance, rightDistance);
+				}
+				if (leftDistance <= best.squaredDistance) stack[stackSize++] = left;
+				if (rightDistance <= best.squaredDistance) stack[stackSize++] = right;
+			}
+		}
+	}
+
+	/**
+	 * Find the first intersection of the ray with the mesh, only replacing
+	 * best if it is closer to the origin. Ties pick the lowest triangle
+	 * index, like a brute force search.
+	 */
+	void intersectRay(Vec3 const& origin, Vec3 const& direction, std::vector<Vec3> const& vertices, std::vector<glm::ivec3> const& triangles, RayHit<Float> & best) const {
+		if (m_nodes.empty()) return;
+		Vec3 invDirection = Float(1) / direction;
+
+		int stack[64];
+		int stackSize = 0;
+		stack[stackSize++] = 0;
+
+		while (stackSize > 0) {
+			Node const& node = m_nodes[stack[--stackSize]];
+			if (node.box.rayEntryDistance(origin, invDirection) > best.distance) continue;
+
+			if (node.triangleCount > 0) {
+				for (int i = node.firstTriangle; i < node.firstTriangle + node.triangleCount; ++i) {
+					int triangle_idx = m_triangleOrder[i];
+					glm::ivec3 const& tri = triangles[triangle_idx];
+					Float distance, u, v;
+					if (!intersectRayTriangle<Float, Vec3>(origin, direction, vertices[tri.x], vertices[tri.y], vertices[tri.z], distance, u, v)) continue;
+					if (distance < best.distance || (distance == best.distance && triangle_idx < best.triangle)) {
+						best.distance = distance;
+						best.bb = u;
+						best.bc = v;
+						best.triangle = triangle_idx;
+					}
+				}
+			} else {
+				// Push the furthest child first so that the closest one is visited first
+				int left = node.firstChild;
+				int right = node.firstChild + 1;
+				Float leftDistance = m_nodes[left].box.rayEntryDistance(origin, invDirection);
+				Float rightDistance = m_nodes[right].box.rayEntryDistance(origin, invDirection);
+				if (leftDistance < rightDistance) {
+					std::swap(left, right);
+					std::swap(leftDistance, rightDistance);
+				}
+				if (leftDistance <= best.distance) stack[stackSize++] = left;
+				if (rightDistance <= best.distance) stack[stackSize++] = right;
+			}
+		}
+	}
+
+	bool empty() const { return m_nodes.empty(); }
+	size_t nodeCount() const { return m_nodes.size(); }
+
+private:
+	/**
+	 * centroids[i] is the centroid of triangle subset[i]
+	 */
+	void buildRec(int nodeIdx, int begin, int end, std::vector<int> const& subset, std::vector<Vec3> const& vertices, std::vector<glm::ivec3> const& triangles, std::vector<Vec3> const& centroids) {
+		Box box;
+		Box centroidBox;
+		for (int i = begin; i < end; ++i) {
+			glm::ivec3 const& tri = triangles[subset[m_triangleOrder[i]]];
+			box.extend(vertices[tri.x]);
+			box.extend(vertices[tri.y]);
+			box.extend(vertices[tri.z]);
+			centroidBox.extend(centroids[m_triangleOrder[i]]);
+		}
+		m_nodes[nodeIdx].box = box;
+
+		if (end - begin <= maxLeafSize) {
+			m_nodes[nodeIdx].firstTriangle = begin;
+			m_nodes[nodeIdx].triangleCount = end - begin;
+			return;
+		}
+
+		// Split at the median along the largest extent of the centroids
+		Vec3 extent = centroidBox.max - centroidBox.min;
+		int axis = 0;
+		if (extent.y > extent[axis]) axis = 1;
+		if (extent.z > extent[axis]) axis = 2;
+
+		int mid = begin + (end - begin) / 2;
+		std::nth_element(
+			m_triangleOrder.begin() + begin,
+			m_triangleOrder.begin() + mid,
+			m_triangleOrder.begin() + end,
+			[&centroids, axis](int a, int b) { return centroids[a][axis] < centroids[b][axis]; }
+		);
+
+		int firstChild = static_cast<int>(m_nodes.size());
+		m_nodes[nodeIdx].firstChild = firstChild;
+		m_nodes.emplace_back();
+		m_nodes.emplace_back();
+		buildRec(firstChild, begin, mid, subset, vertices, triangles, centroids);
+		buildRec(firstChild + 1, mid, end, subset, vertices, triangles, centroids);
+	}
+
+private:
+	std::vector<Node> m_nodes;
+	std::vector<int> m_triangleOrder;
+};
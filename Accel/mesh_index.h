@@ -0,0 +1,329 @@
+/**
+ * This file is part of DagAmendment, the reference implementation of:
+ *
+ *   Michel, Élie and Boubekeur, Tamy (2021).
+ *   DAG Amendment for Inverse Control of Parametric Shapes
+ *   ACM Transactions on Graphics (Proc. SIGGRAPH 2021), 173:1-173:14.
+ *
+ * Copyright (c) 2020-2021 -- Télécom Paris (Élie Michel <elie.michel@telecom-paris.fr>)
+ *
+ * The MIT license:
+ * Permission is hereby granted, free of charge, to any person obtaining a copy
+ * of this software and associated documentation files (the “Software”), to
+ * deal in the Software without restriction, including without limitation the
+ * rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+ * sell copies of the Software, and to permit persons to whom the Software is
+ * furnished to do so, subject to the following conditions:
+ *
+ * The above copyright notice and this permission notice shall be included in
+ * all copies or substantial portions of the Software.
+ *
+ * The Software is provided “as is”, without warranty of any kind, express or
+ * implied, including but not limited to the warranties of merchantability,
+ * fitness for a particular purpose and non-infringement. In no event shall the
+ * authors or copyright holders be liable for any claim, damages or other
+ * liability, whether in an action of contract, tort or otherwise, arising
+ * from, out of or in connection with the software or the use or other dealings
+ * in the Software.
+ */
+
+#pragma once
+
+#include <glm/glm.hpp>
+
+#include <vector>
+#include <map>
+#include <cmath>
+#include <algorithm>
+#include <stdexcept>
+#include <mutex>
+#include <atomic>
+#include <shared_mutex>
+
+#include "closest_point.h"
+#include "bvh.h"
+#include "ray_triangle.h"
+
+enum class ProjectionMethod {
+	Bvh,
+	BruteForce,
+};
+
+/**
+ * Range of vertices and triangles that belong to the same object when
+ * several meshes are concatenated into a single MeshIndex.
+ */
+struct MeshPart {
+	int firstVertex = 0;
+	int vertexCount = 0;
+	int firstTriangle = 0;
+	int triangleCount = 0;
+};
+
+/**
+ * A mesh together with the acceleration structure used to project points
+ * onto it. It is built once and can then be queried many times, and
+ * refitted when only vertex positions change.
+ *
+ * The mesh may be the concatenation of several parts (typically one per
+ * object), in which case each query targets one part only. Triangles
+ * hold indices in the full vertex array.
+ *
+ * Triangles lying in a plane z = k for some integer k (which is the case of
+ * all triangles of the uv-coparam meshes, k being the material index) are
+ * grouped in one BVH per value of k, called a layer. A query only visits
+ * the layer of its own z, then neighbor layers only when they are closer
+ * than the best hit so far, so the result is the same as with a single BVH
+ * but the cost depends on the size of one layer only.
+ *
+ * Thread safety: const methods may be called concurrently from any number
+ * of threads, but refit() must not run concurrently with any other call.
+ * Callers shared across threads hold readLock() while querying and
+ * writeLock() while refitting. When called from Python, the GIL must be
+ * released *before* taking these locks, otherwise a thread waiting for
+ * the lock while holding the GIL may deadlock with a thread holding the
+ * lock and waiting for the GIL.
+ */
+template<typename Float, typename Vec3>
+class MeshIndex {
+public:
+	using Hit = BvhHit<Float, Vec3>;
+
+	/**
+	 * If parts is empty, the whole mesh is a single part
+	 */
+	MeshIndex(std::vector<Vec3> && vertices, std::vector<glm::ivec3> && triangles, std::vector<MeshPart> && parts, ProjectionMethod method = ProjectionMethod::Bvh)
+		: m_vertices(std::move(vertices))
+		, m_triangles(std::move(triangles))
+		, m_parts(std::move(parts))
+		, m_method(method)
+	{
+		if (m_parts.empty()) {
+			MeshPart part;
+			part.vertexCount = static_cast<int>(m_vertices.size());
+			part.triangleCount = static_cast<int>(m_triangles.size());
+			m_parts.push_back(part);
+		}
+
+		if (m_method == ProjectionMethod::Bvh) {
+			m_partIndices.resize(m_parts.size());
+			#pragma omp parallel for
+			for (long long i = 0; i < static_cast<long long>(m_parts.size()); ++i) {
+				buildPartIndex(i);
+			}
+		}
+	}
+
+	/**
+	 * Replace vertex positions, the number of vertices must not change.
+	 */
+	void refit(std::vector<Vec3> && vertices) {
+		if (vertices.size() != m_vertices.size())
+			throw std::runtime_error("refit must not change the number of vertices");
+		m_vertices = std::move(vertices);
+		#pragma omp parallel for
+		for (long long i = 0; i < static_cast<long long>(m_partIndices.size()); ++i) {
+			PartIndex & partIndex = m_partIndices[i];
+			if (!isStillLayered(partIndex)) {
+				// Some triangle left its layer (e.g. its material changed)
+				buildPartIndex(i);
+				continue;
+			}
+			for (auto & layer : partIndex.layers) {
+				layer.bvh.refit(m_vertices, m_triangles);
+			}
+			partIndex.others.refit(m_vertices, m_triangles);
+		}
+	}
+
+	/**
+	 * Closest point to query on the given part of the mesh. If a point
+	 * closer than earlyExitDistance is found, it is returned right away
+	 * without looking for a closer one. This is the case of samples that
+	 * lie within a triangle, typically because they were computed from
+	 * the very same mesh. A negative value disables this shortcut.
+	 */
+	Hit closestPoint(Vec3 const& query, size_t partIdx = 0, Float earlyExitDistance = -1) const {
+		Float earlyExitSquaredDistance = earlyExitDistance >= 0 ? earlyExitDistance * earlyExitDistance : -1;
+		Hit best;
+		if (m_method == ProjectionMethod::Bvh) {
+			best = closestPointInLayers(query, m_partIndices[partIdx], earlyExitSquaredDistance);
+		} else {
+			MeshPart const& part = m_parts[partIdx];
+			for (int triangle_idx = part.firstTriangle ; triangle_idx < part.firstTriangle + part.triangleCount ; ++triangle_idx) {
+				glm::ivec3 const& tri = m_triangles[triangle_idx];
+				auto hit = closestPointTriangle<Float,Vec3>(query, m_vertices[tri.x], m_vertices[tri.y], m_vertices[tri.z]);
+				Vec3 diff = hit.point - query;
+				Float err = dot(diff, diff);
+				if (err < best.squaredDistance) {
+					best.squaredDistance = err;
+					best.hit = hit;
+					best.triangle = static_cast<long long>(triangle_idx);
+					if (err <= earlyExitSquaredDistance) break;
+				}
+			}
+		}
+
+		return best;
+	}
+
+	/**
+	 * First intersection of the ray with any part of the mesh. The
+	 * returned triangle index is global, see partOfTriangle().
+	 */
+	RayHit<Float> intersectRay(Vec3 const& origin, Vec3 const& direction) const {
+		RayHit<Float> best;
+		if (m_method == ProjectionMethod::Bvh) {
+			for (PartIndex const& partIndex : m_partIndices) {
+				for (Layer const& layer : partIndex.layers) {
+					layer.bvh.intersectRay(origin, direction, m_vertices, m_triangles, best);
+				}
+				partIndex.others.intersectRay(origin, direction, m_vertices, m_triangles, best);
+			}
+		} else {
+			for (int triangle_idx = 0 ; triangle_idx < static_cast<int>(m_triangles.size()) ; ++triangle_idx) {
+				glm::ivec3 const& tri = m_triangles[triangle_idx];
+				Float distance, u, v;
+				if (!intersectRayTriangle<Float, Vec3>(origin, direction, m_vertices[tri.x], m_vertices[tri.y], m_vertices[tri.z], distance, u, v)) continue;
+				if (distance < best.distance) {
+					best.distance = distance;
+					best.bb = u;
+					best.bc = v;
+					best.triangle = triangle_idx;
+				}
+			}
+		}
+		return best;
+	}
+
+	/**
+	 * Index of the part that contains the given (global) triangle index
+	 */
+	int partOfTriangle(long long triangleIdx) const {
+		auto it = std::upper_bound(m_parts.begin(), m_parts.end(), triangleIdx, [](long long t, MeshPart const& part) { return t < part.firstTriangle; });
+		return static_cast<int>(it - m_parts.begin()) - 1;
+	}
+
+	/**
+	 * Statistics about the queries, to be reported by callers of
+	 * closestPoint() (counting in closestPoint() itself would make all
+	 * threads contend on the same counters).
+	 */
+	void countQueries(long long queryCount, long long earlyExitCount) const {
+		m_queryCount += queryCount;
+		m_earlyExitCount += earlyExitCount;
+	}
+	long long queryCount() const { return m_queryCount; }
+	long long earlyExitCount() const { return m_earlyExitCount; }
+	void resetCounters() {
+		m_queryCount = 0;
+		m_earlyExitCount = 0;
+	}
+
+	std::shared_lock<std::shared_mutex> readLock() const { return std::shared_lock<std::shared_mutex>(m_mutex); }
+	std::unique_lock<std::shared_mutex> writeLock() { return std::unique_lock<std::shared_mutex>(m_mutex); }
+
+	std::vector<Vec3> const& vertices() const { return m_vertices; }
+	std::vector<glm::ivec3> const& triangles() const { return m_triangles; }
+	std::vector<MeshPart> const& parts() const { return m_parts; }
+	ProjectionMethod method() const { return m_method; }
+
+	/**
+	 * Number of layers of a part, for diagnostic purposes
+	 */
+	size_t layerCount(size_t partIdx = 0) const {
+		return m_partIndices.empty() ? 0 : m_partIndices[partIdx].layers.size();
+	}
+
+private:
+	struct Layer {
+		Float z;
+		std::vector<int> triangles;
+		Bvh<Float, Vec3> bvh;
+	};
+
+	struct PartIndex {
+		std::vector<Layer> layers; // sorted by increasing z
+		Bvh<Float, Vec3> others; // triangles that are not in any layer
+	};
+
+	bool isInPlane(glm::ivec3 const& tri, Float z) const {
+		return m_vertices[tri.x].z == z && m_vertices[tri.y].z == z && m_vertices[tri.z].z == z;
+	}
+
+	void buildPartIndex(long long partIdx) {
+		MeshPart const& part = m_parts[partIdx];
+		PartIndex & partIndex = m_partIndices[partIdx];
+
+		std::map<Float, std::vector<int>> layerTriangles;
+		std::vector<int> otherTriangles;
+		for (int triangle_idx = part.firstTriangle ; triangle_idx < part.firstTriangle + part.triangleCount ; ++triangle_idx) {
+			glm::ivec3 const& tri = m_triangles[triangle_idx];
+			Float z = m_vertices[tri.x].z;
+			if (z == std::round(z) && isInPlane(tri, z)) {
+				layerTriangles[z].push_back(triangle_idx);
+			} else {
+				otherTriangles.push_back(triangle_idx);
+			}
+		}
+
+		partIndex.layers.clear();
+		partIndex.layers.reserve(layerTriangles.size());
+		for (auto & it : layerTriangles) {
+			partIndex.layers.emplace_back();
+			Layer & layer = partIndex.layers.back();
+			layer.z = it.first;
+			layer.triangles = std::move(it.second);
+			layer.bvh.build(m_vertices, m_triangles, layer.triangles);
+		}
+		partIndex.others.build(m_vertices, m_triangles, otherTriangles);
+	}
+
+	bool isStillLayered(PartIndex const& partIndex) const {
+		for (auto const& layer : partIndex.layers) {
+			for (int triangle_idx : layer.triangles) {
+				if (!isInPlane(m_triangles[triangle_idx], layer.z)) return false;
+			}
+		}
+		return true;
+	}
+
+	Hit closestPointInLayers(Vec3 const& query, PartIndex const& partIndex, Float earlyExitSquaredDistance) const {
+		Hit best;
+		auto const& layers = partIndex.layers;
+
+		// Visit layers by increasing distance to the query, starting from
+		// the first layer above it and the last one below it.
+		auto above = std::lower_bound(layers.begin(), layers.end(), query.z, [](Layer const& layer, Float z) { return layer.z < z; });
+		auto below = above;
+		bool searchAbove = above != layers.end();
+		bool searchBelow = below != layers.begin();
+		while (searchAbove || searchBelow) {
+			Float dzAbove = searchAbove ? above->z - query.z : std::numeric_limits<Float>::max();
+			Float dzBelow = searchBelow ? query.z - (below - 1)->z : std::numeric_limits<Float>::max();
+			Float dz = std::min(dzAbove, dzBelow);
+			// Ties are explored too, to pick the same triangle as a brute force search
+			if (dz * dz > best.squaredDistance || best.squaredDistance <= earlyExitSquaredDistance) break;
+			if (dzAbove <= dzBelow) {
+				above->bvh.closestPoint(query, m_vertices, m_triangles, best, earlyExitSquaredDistance);
+				searchAbove = ++above != layers.end();
+			} else {
+				(--below)->bvh.closestPoint(query, m_vertices, m_triangles, best, earlyExitSquaredDistance);
+				searchBelow = below != layers.begin();
+			}
+		}
+
+		partIndex.others.closestPoint(query, m_vertices, m_triangles, best, earlyExitSquaredDistance);
+		return best;
+	}
+
+private:
+	std::vector<Vec3> m_vertices;
+	std::vector<glm::ivec3> m_triangles;
+	std::vector<MeshPart> m_parts;
+	ProjectionMethod m_method;
+	std::vector<PartIndex> m_partIndices; // one per part
+	mutable std::atomic<long long> m_queryCount{0};
+	mutable std::atomic<long long> m_earlyExitCount{0};
+	mutable std::shared_mutex m_mutex;
+};
@@ -0,0 +1,208 @@
+# This file is part of DagAmendment, the reference implementation of:
+#
+#   Michel, Élie and Boubekeur, Tamy (2021).
+#   DAG Amendment for Inverse Control of Parametric Shapes
+#   ACM Transactions on Graphics (Proc. SIGGRAPH 2021), 173:1-173:14.
+#
+# Copyright (c) 2020-2021 -- Télécom Paris (Élie Michel <elie.michel@telecom-paris.fr>)
+#
+# The MIT license:
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the “Software”), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# The Software is provided “as is”, without warranty of any kind, express or
+# implied, including but not limited to the warranties of merchantability,
+# fitness for a particular purpose and non-infringement. In no event shall the
+# authors or copyright holders be liable for any claim, damages or other
+# liability, whether in an action of contract, tort or otherwise, arising
+# from, out of or in connection with the software or the use or other dealings
+# in the Software.
+
+"""
+Correctness checks of DagAmendment's OfflineParametricShape, which runs
+without Blender: modifier evaluation, transform hierarchy, ray casts and
+the JSON round trip. Usage:
+
+    python offline_shape_test.py [--build-dir path/to/build/dir]
+
+The DagAmendment package needs Blender to be imported as a whole, so its
+bpy free modules are loaded as a bare package, with Accel taken from the
+build directory.
+"""
+
+import sys
+import json
+import types
+import argparse
+from os.path import dirname, join, abspath
+import numpy as np
+
+# -------------------------------------------------------------------
+
+def import_offline_parametric_shape(Accel):
+    package = types.ModuleType("DagAmendment")
+    package.__path__ = [join(dirname(dirname(abspath(__file__))), "DagAmendment")]
+    sys.modules["DagAmendment"] = package
+    sys.modules["DagAmendment.Accel"] = Accel
+    from DagAmendment.OfflineParametricShape import OfflineParametricShape
+    return OfflineParametricShape
+
+def quad(x, y, z, size=1):
+    """Square in the XY plane with its lower corner at (x, y, z), facing +Z"""
+    vertices = [[x, y, z], [x + size, y, z], [x + size, y + size, z], [x, y + size, z]]
+    triangles = [[0, 1, 2], [0, 2, 3]]
+    return vertices, triangles
+
+def normals(vertices, triangles):
+    corners = vertices[triangles]
+    return np.cross(corners[:,1] - corners[:,0], corners[:,2] - corners[:,0])
+
+def make_scene():
+    """Serialized scene exercising all supported features"""
+    mirrored_vertices, mirrored_triangles = quad(1, 0, 0)
+    array_vertices, array_triangles = quad(0, 0, 0)
+    child_vertices, child_triangles = quad(0, 0, 0, size=0.5)
+    return {
+        "objects": [
+            {
+                "name": "Mirrored", "vertices": mirrored_vertices, "triangles": mirrored_triangles,
+                "location": [0, 0, 0],
+                "modifiers": [{"type": "MIRROR", "use_axis": [True, False, False]}],
+            },
+            {
+                "name": "Array", "vertices": array_vertices, "triangles": array_triangles,
+                "location": [0, 5, 0],
+                "modifiers": [
+                    {"type": "ARRAY", "count": 3, "use_relative_offset": True,
+                     "relative_offset_displace": [1, 0, 0],
+                     "use_constant_offset": True, "constant_offset_displace": [0.5, 0, 0]},
+                    {"type": "SUBSURF"},  # not supported, skipped
+                ],
+            },
+            {
+                "name": "Child", "vertices": child_vertices, "triangles": child_triangles,
+                "location": [0, 0, 1], "parent": "Array",
+            },
+        ],
+        "hyperparams": [
+            {"name": "Array TX", "object": "Array", "prop": "location", "index": 0,
+             "minimum": -2, "maximum": 2, "default": 0},
+            {"name": "Child TZ", "object": "Child", "prop": "location", "index": 2,
+             "minimum": 0, "maximum": 2, "default": 1},
+        ],
+    }
+
+# -------------------------------------------------------------------
+
+def check_modifiers(shape):
+    errors = []
+
+    vertices, triangles = shape.get_mesh("Mirrored")
+    original, _ = (np.array(x, 'f') for x in quad(1, 0, 0))
+    if len(vertices) != 8 or len(triangles) != 4:
+        errors.append(f"mirror: got {len(vertices)} vertices and {len(triangles)} triangles, expected 8 and 4")
+    else:
+        expected = np.concatenate((original, original * [-1, 1, 1]))
+        if not np.allclose(vertices, expected):
+            errors.append("mirror: mirrored vertices are not the original ones with x negated")
+        # Mirrored triangles must keep facing the same side
+        if not (normals(vertices, triangles)[:,2] > 0).all():
+            errors.append("mirror: mirrored triangles have a flipped orientation")
+
+    vertices, triangles = shape.get_mesh("Array")
+    if len(vertices) != 12 or len(triangles) != 6:
+        errors.append(f"array: got {len(vertices)} vertices and {len(triangles)} triangles, expected 12 and 6")
+    else:
+        # Relative offset of 1 times the unit size, plus a constant 0.5
+        base = np.array(quad(0, 5, 0)[0], 'f')
+        expected = np.concatenate([base + [1.5 * i, 0, 0] for i in range(3)])
+        if not np.allclose(vertices, expected):
+            errors.append("array: copies are not offset by the relative plus constant offset")
+
+    return errors
+
+def check_hierarchy(shape):
+    """Moving a parent with a hyper-parameter must move its children"""
+    errors = []
+    child_before = shape.get_mesh("Child")[0].copy()
+    array_before = shape.get_mesh("Array")[0].copy()
+
+    shape.set_hyperparams(np.array([1.5, 0.5]))
+    shape.update()
+    if not np.allclose(shape.get_hyperparams(), [1.5, 0.5]):
+        errors.append(f"hierarchy: hyper-parameters are {shape.get_hyperparams()} after setting them to [1.5, 0.5]")
+    if not np.allclose(shape.get_mesh("Array")[0], array_before + [1.5, 0, 0]):
+        errors.append("hierarchy: object did not follow its hyper-parameter")
+    if not np.allclose(shape.get_mesh("Child")[0], child_before + [1.5, 0, -0.5]):
+        errors.append("hierarchy: child did not follow its parent and its own hyper-parameter")
+    return errors
+
+def check_ray_casts(shape):
+    """Rays going down onto the first copy of the array hit the child, and
+    onto the last copy hit the array itself"""
+    errors = []
+    x = shape.get_mesh("Array")[0][:,0]
+    origins = np.array([[x.min() + 0.25, 5.25, 10], [x.max() - 0.25, 5.5, 10], [-10, -10, 10]], 'f')
+    directions = np.array([[0, 0, -1]] * 3, 'f')
+    hits, locations, objects, object_ids, *_ = shape.cast_rays(origins, directions)
+    # Outputs other than hits only list the rays that hit something
+    hit_names = iter(objects[i].name for i in object_ids)
+    names = [next(hit_names) if hit else None for hit in hits]
+    if names != ["Child", "Array", None]:
+        errors.append(f"ray casts: hit {names}, expected ['Child', 'Array', None]")
+    return errors
+
+def check_json_round_trip(OfflineParametricShape, shape):
+    """Reloading a saved shape must give the very same evaluated scene"""
+    errors = []
+    data = json.loads(json.dumps(shape.to_json()))
+    reloaded = OfflineParametricShape.from_json(data)
+    if reloaded.to_json() != data:
+        errors.append("json: to_json() differs after a round trip")
+    if [obj.name for obj in reloaded.objects] != [obj.name for obj in shape.objects]:
+        errors.append("json: objects differ after a round trip")
+    if not np.allclose(reloaded.get_hyperparams(), shape.get_hyperparams()):
+        errors.append("json: hyper-parameters differ after a round trip")
+    for obj in shape.objects:
+        vertices, triangles = shape.get_mesh(obj.name)
+        reloaded_vertices, reloaded_triangles = reloaded.get_mesh(obj.name)
+        if not np.array_equal(triangles, reloaded_triangles) or not np.allclose(vertices, reloaded_vertices):
+            errors.append(f"json: evaluated mesh of {obj.name} differs after a round trip")
+    return errors
+
+# -------------------------------------------------------------------
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--build-dir", action='append', default=[],
+                        help="Directory containing the built Accel module (may be repeated)")
+    args = parser.parse_args()
+    sys.path.extend(args.build_dir)
+    import Accel
+
+    OfflineParametricShape = import_offline_parametric_shape(Accel)
+    shape = OfflineParametricShape.from_json(make_scene())
+
+    errors = []
+    errors += check_modifiers(shape)
+    errors += check_json_round_trip(OfflineParametricShape, shape)
+    errors += check_hierarchy(shape)
+    errors += check_ray_casts(shape)
+    errors += check_json_round_trip(OfflineParametricShape, shape)
+
+    for error in errors:
+        print(f"  ERROR: {error}")
+    if errors:
+        print(f"{len(errors)} errors")
+        sys.exit(1)
+    print("All checks passed")
+
+if __name__ == "__main__":
+    main()
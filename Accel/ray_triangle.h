@@ -0,0 +1,71 @@
+/**
+ * This file is part of DagAmendment, the reference implementation of:
+ *
+ *   Michel, Élie and Boubekeur, Tamy (2021).
+ *   DAG Amendment for Inverse Control of Parametric Shapes
+ *   ACM Transactions on Graphics (Proc. SIGGRAPH 2021), 173:1-173:14.
+ *
+ * Copyright (c) 2020-2021 -- Télécom Paris (Élie Michel <elie.michel@telecom-paris.fr>)
+ *
+ * The MIT license:
+ * Permission is hereby granted, free of charge, to any person obtaining a copy
+ * of this software and associated documentation files (the “Software”), to
+ * deal in the Software without restriction, including without limitation the
+ * rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+ * sell copies of the Software, and to permit persons to whom the Software is
+ * furnished to do so, subject to the following conditions:
+ *
+ * The above copyright notice and this permission notice shall be included in
+ * all copies or substantial portions of the Software.
+ *
+ * The Software is provided “as is”, without warranty of any kind, express or
+ * implied, including but not limited to the warranties of merchantability,
+ * fitness for a particular purpose and non-infringement. In no event shall the
+ * authors or copyright holders be liable for any claim, damages or other
+ * liability, whether in an action of contract, tort or otherwise, arising
+ * from, out of or in connection with the software or the use or other dealings
+ * in the Software.
+ */
+
+#pragma once
+
+#include <limits>
+
+/**
+ * Intersection of a ray with a mesh, the hit point is at
+ * origin + distance * direction (so distance is in units of the direction's
+ * length) and has barycentric coordinates (1 - bb - bc, bb, bc)
+ */
+template<typename Float>
+struct RayHit {
+    Float distance = std::numeric_limits<Float>::max();
+    Float bb = 0, bc = 0;
+    long long triangle = -1;
+};
+
+/**
+ * Möller–Trumbore ray-triangle intersection, both sides of the triangle
+ * are hit. Returns true and sets distance, u and v if the ray hits the
+ * triangle in front of its origin.
+ */
+template<typename Float, typename Vec3>
+bool intersectRayTriangle(Vec3 const& origin, Vec3 const& direction, Vec3 const& a, Vec3 const& b, Vec3 const& c, Float & distance, Float & u, Float & v)
+{
+    const Vec3 ab = b - a;
+    const Vec3 ac = c - a;
+    const Vec3 pvec = cross(direction, ac);
+    const Float det = dot(ab, pvec);
+    if (det == 0) return false;  // ray parallel to the triangle, or degenerate triangle
+
+    const Float invDet = Float(1) / det;
+    const Vec3 tvec = origin - a;
+    u = dot(tvec, pvec) * invDet;
+    if (u < 0 || u > 1) return false;
+
+    const Vec3 qvec = cross(tvec, ab);
+    v = dot(direction, qvec) * invDet;
+    if (v < 0 || u + v > 1) return false;
+
+    distance = dot(ac, qvec) * invDet;
+    return distance >= 0;
+}
@@ -1,19 +1,24 @@
 #!C:\Python37\python.exe
+"""
+Build Accel then run the correctness checks of benchmark.py on small
+meshes, and the ones of offline_shape_test.py. Usage:
+
+    python test.py [build dir]
+"""
 from subprocess import run
 import sys
 from os.path import join
 
-build_dir = "build-msvc16"
+build_dir = sys.argv[1] if len(sys.argv) > 1 else "build-msvc16"
 proc = run(["cmake", "--build", build_dir, "--config", "Release"])
 if proc.returncode != 0:
 	exit(proc.returncode)
-sys.path.append(join(build_dir, "Release"))
-
-import DiffParamAccel
-import numpy as np
 
-vertices = np.zeros((128, 3), 'f')
-triangles = np.zeros((12, 3), 'i')
-out_data, foo, bar = DiffParamAccel.pack(vertices, triangles)
+# Multi-config generators (e.g. MSVC) put the module in a Release subdirectory
+build_dir_args = ["--build-dir", join(build_dir, "Release"), "--build-dir", build_dir]
+proc = run([sys.executable, "benchmark.py", "--quick"] + build_dir_args)
+if proc.returncode != 0:
+	exit(proc.returncode)
 
-print((out_data, foo, bar))
+proc = run([sys.executable, "offline_shape_test.py"] + build_dir_args)
+exit(proc.returncode)
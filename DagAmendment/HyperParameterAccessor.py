@@ -0,0 +1,87 @@
+# This file is part of DagAmendment, the reference implementation of:
+#
+#   Michel, Élie and Boubekeur, Tamy (2021).
+#   DAG Amendment for Inverse Control of Parametric Shapes
+#   ACM Transactions on Graphics (Proc. SIGGRAPH 2021), 173:1-173:14.
+#
+# Copyright (c) 2020-2021 -- Télécom Paris (Élie Michel <elie.michel@telecom-paris.fr>)
+# 
+# The MIT license:
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the “Software”), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# The Software is provided “as is”, without warranty of any kind, express or
+# implied, including but not limited to the warranties of merchantability,
+# fitness for a particular purpose and non-infringement. In no event shall the
+# authors or copyright holders be liable for any claim, damages or other
+# liability, whether in an action of contract, tort or otherwise, arising
+# from, out of or in connection with the software or the use or other dealings
+# in the Software.
+
+# no bpy here
+
+import numpy as np
+
+class HyperParameterAccessor:
+    """Reads and writes the values of all hyper-parameters at once, as a
+    numpy vector. It is compiled from a list of HyperParameterProperty:
+    parameters that target the same property of the same object are
+    grouped, so that each property is accessed once and each object is
+    tagged for update once, no matter how many parameters point to it.
+
+    The accessor must be built again whenever the list of parameters or
+    their targets change (in practice, once per stroke)."""
+
+    def __init__(self, hyperparams):
+        self.count = len(hyperparams)
+
+        # List of (object, property name, indices in the valuation vector,
+        # indices in the property's vector)
+        self._groups = []
+        self._objects = {}  # by name, to tag each object once
+        groups = {}
+        for i, hparam in enumerate(hyperparams):
+            obj = hparam.obj
+            if obj is None or not hasattr(obj, hparam.prop):
+                print(f"ERROR: object {obj} has no property {hparam.prop}")
+                continue
+            attr = getattr(obj, hparam.prop)
+            if hparam.index < 0 or hparam.index >= len(attr):
+                print(f"ERROR: index out of bounds: {hparam.index} (should be in range (0, {len(attr) - 1})")
+                continue
+
+            key = (obj.name, hparam.prop)
+            if key not in groups:
+                groups[key] = (obj, hparam.prop, [], [])
+                self._objects[obj.name] = obj
+            groups[key][2].append(i)
+            groups[key][3].append(hparam.index)
+
+        for obj, prop, params, components in groups.values():
+            self._groups.append((obj, prop, np.array(params), np.array(components)))
+
+    def get(self):
+        """Return the value of all hyper-parameters (0 for invalid ones,
+        like HyperParameterProperty.eval())"""
+        values = np.zeros(self.count)
+        for obj, prop, params, components in self._groups:
+            values[params] = np.array(getattr(obj, prop))[components]
+        return values
+
+    def set(self, values):
+        """Set the value of all hyper-parameters (invalid ones are ignored)"""
+        values = np.asarray(values)
+        assert(len(values) == self.count)
+        for obj, prop, params, components in self._groups:
+            current = np.array(getattr(obj, prop))
+            current[components] = values[params]
+            setattr(obj, prop, current)
+        for obj in self._objects.values():
+            obj.update_tag()
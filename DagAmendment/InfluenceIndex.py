@@ -0,0 +1,209 @@
+# This file is part of DagAmendment, the reference implementation of:
+#
+#   Michel, Élie and Boubekeur, Tamy (2021).
+#   DAG Amendment for Inverse Control of Parametric Shapes
+#   ACM Transactions on Graphics (Proc. SIGGRAPH 2021), 173:1-173:14.
+#
+# Copyright (c) 2020-2021 -- Télécom Paris (Élie Michel <elie.michel@telecom-paris.fr>)
+# 
+# The MIT license:
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the “Software”), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# The Software is provided “as is”, without warranty of any kind, express or
+# implied, including but not limited to the warranties of merchantability,
+# fitness for a particular purpose and non-infringement. In no event shall the
+# authors or copyright holders be liable for any claim, damages or other
+# liability, whether in an action of contract, tort or otherwise, arising
+# from, out of or in connection with the software or the use or other dealings
+# in the Software.
+
+# no bpy here
+
+from collections import defaultdict
+
+class InfluenceIndex:
+    """Tells which objects each hyper-parameter may move, from the
+    dependency graph built by the DepsgraphNodes add-on (the 'DEPSGRAPH'
+    node group). A parameter reaches an object when there is a path
+    PARAM -> PROP:* -> OP:* -> ... -> PROP:OUT_MESH in this graph.
+
+    The graph is only rebuilt when the user asks for it, and it does not
+    model all dependencies (e.g. some driver variables, or objects used by
+    modifiers like the mirror object of a mirror modifier). So the index is
+    conservative: a parameter is considered as influencing everything
+    when the index does not know it, when it reaches no mesh, or when its
+    path goes through an object that is referenced in a way that the graph
+    does not model. So is an object that the index does not know about."""
+
+    # Nodes that a parameter may go through while only rigidly moving meshes
+    transform_subtypes = {
+        'PARAM',
+        'PROP:TX', 'PROP:TY', 'PROP:TZ', 'PROP:T',
+        'PROP:RX', 'PROP:RY', 'PROP:RZ', 'PROP:R',
+        'PROP:SX', 'PROP:SY', 'PROP:SZ', 'PROP:S',
+        'OP:XFORM', 'PROP:XFORM', 'OP:XFORM_MESH',
+        'PROP:OUT_MESH', 'OTHER:VIEW_LAYER',
+    }
+
+    def __init__(self):
+        # Name of the PARAM node -> set of names of reached objects
+        self.reached_objects = {}
+        # Names of objects that have a PROP:OUT_MESH node
+        self.known_objects = set()
+        # Name of the PARAM node -> names of the objects it directly drives,
+        # used to detect that the graph is outdated
+        self._driven_objects = {}
+        # Names of the PARAM nodes that only reach meshes through object
+        # transforms (see is_pure_transform)
+        self._pure_transforms = set()
+        # Name of the PARAM node -> names of the objects of all nodes on its
+        # paths to meshes
+        self._path_objects = {}
+        # Names of objects that other objects depend on through links that
+        # are missing from the graph
+        self.unmodeled_references = set()
+
+    @classmethod
+    def from_graph(cls, graph, unmodeled_references=()):
+        """Build the index from a DEPSGRAPH node tree, or return an empty
+        index (that skips nothing) if graph is None
+        @param unmodeled_references: names of the objects that some other
+               objects depend on without the graph knowing it (see
+               utils.get_unmodeled_object_references). Parameters whose
+               path goes through them are unknown to the index."""
+        index = InfluenceIndex()
+        index.unmodeled_references = set(unmodeled_references)
+        if graph is None:
+            return index
+
+        # Walking through socket.links is linear in the number of links of
+        # the whole tree, so we build the adjacency list once.
+        successors = defaultdict(list)
+        for link in graph.links:
+            successors[link.from_node.name].append(link.to_node)
+
+        # Objects whose modifier stack depends on other objects, hence on
+        # their own transform relatively to them
+        boolean_objects = set()
+        for node in graph.nodes:
+            if node.subtype == 'PROP:OUT_MESH':
+                index.known_objects.add(node.objname)
+            elif node.subtype == 'OP:MODIFIER_DUARY':
+                boolean_objects.add(node.objname)
+
+        for node in graph.nodes:
+            if node.subtype != 'PARAM':
+                continue
+            reached = set()
+            path_objects = set()
+            pure_transform = True
+            visited = {node.name}
+            stack = [node]
+            while stack:
+                current = stack.pop()
+                path_objects.add(current.objname)
+                if current.subtype == 'PROP:OUT_MESH':
+                    reached.add(current.objname)
+                if current.subtype not in InfluenceIndex.transform_subtypes:
+                    pure_transform = False
+                for next_node in successors[current.name]:
+                    if next_node.name not in visited:
+                        visited.add(next_node.name)
+                        stack.append(next_node)
+            index.reached_objects[node.name] = reached
+            index._path_objects[node.name] = path_objects
+            index._driven_objects[node.name] = {n.objname for n in successors[node.name]}
+            if pure_transform and reached.isdisjoint(boolean_objects):
+                index._pure_transforms.add(node.name)
+
+        return index
+
+    def _reached_objects(self, hparam):
+        """Return the names of the objects reached by hparam, or None if
+        the graph does not know, is outdated or may miss some of them"""
+        node_name = f"PARAM@{hparam.name}"
+        reached = self.reached_objects.get(node_name)
+        if reached is None:
+            return None
+
+        # A parameter that reaches no mesh is more likely used through a link
+        # that the graph misses (e.g. a driver variable) than actually useless
+        if not reached:
+            return None
+
+        if not self.unmodeled_references.isdisjoint(self._path_objects[node_name]):
+            return None
+
+        # The graph is outdated if the parameter now drives another object
+        driven_object = hparam.obj.name if hparam.obj is not None else None
+        if driven_object not in self._driven_objects[node_name]:
+            return None
+
+        return reached
+
+    def influenced_objects(self, hparam, object_names):
+        """Return the subset of object_names that changing hparam may move.
+        When the graph is not certain of it, this is the whole object_names."""
+        object_names = set(object_names)
+        reached = self._reached_objects(hparam)
+
+        # The graph is also outdated if some of the objects were created
+        # after it was built
+        if reached is None or not self.known_objects.issuperset(object_names):
+            return object_names
+
+        return reached & object_names
+
+    def is_pure_transform(self, hparam, object_names):
+        """Tell whether hparam only changes the transform of hparam.obj, and
+        reaches meshes only through this transform (the object's own mesh
+        and the ones of its children), with no downstream modifier. Changing
+        such a parameter moves the points of all objects it reaches among
+        object_names with the same affine map."""
+        if self._reached_objects(hparam) is None:
+            return False
+        if not self.known_objects.issuperset(object_names):
+            return False
+        return f"PARAM@{hparam.name}" in self._pure_transforms
+
+    def may_influence(self, hparam, object_names):
+        """Tell whether changing hparam may move any of the objects whose
+        names are in object_names. Only return False when the graph is
+        certain of it."""
+        return len(self.influenced_objects(hparam, object_names)) > 0
+
+    def group_hyperparams(self, hyperparams, object_names, indices=None):
+        """Partition the hyper-parameters that may move some of object_names
+        into groups of parameters that move disjoint sets of objects. All
+        parameters of a group can be perturbed at once and their finite
+        differences read back separately (Curtis, Powell and Reid, 1974).
+        Groups are built greedily, each parameter going to the first group
+        that it does not conflict with.
+        @param indices: if not None, only consider hyperparams[k] for k in indices
+        @return list of groups, each group being a list of pairs
+        (index of the parameter, set of names of the objects it moves)"""
+        groups = []
+        group_objects = []  # union of the objects moved by each group
+        if indices is None:
+            indices = range(len(hyperparams))
+        for k in indices:
+            objects = self.influenced_objects(hyperparams[k], object_names)
+            if not objects:
+                continue
+            for group, moved in zip(groups, group_objects):
+                if moved.isdisjoint(objects):
+                    group.append((k, objects))
+                    moved |= objects
+                    break
+            else:
+                groups.append([(k, objects)])
+                group_objects.append(set(objects))
+        return groups
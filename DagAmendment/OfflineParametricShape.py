@@ -0,0 +1,444 @@
+# This file is part of DagAmendment, the reference implementation of:
+#
+#   Michel, Élie and Boubekeur, Tamy (2021).
+#   DAG Amendment for Inverse Control of Parametric Shapes
+#   ACM Transactions on Graphics (Proc. SIGGRAPH 2021), 173:1-173:14.
+#
+# Copyright (c) 2020-2021 -- Télécom Paris (Élie Michel <elie.michel@telecom-paris.fr>)
+# 
+# The MIT license:
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the “Software”), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# The Software is provided “as is”, without warranty of any kind, express or
+# implied, including but not limited to the warranties of merchantability,
+# fitness for a particular purpose and non-infringement. In no event shall the
+# authors or copyright holders be liable for any claim, damages or other
+# liability, whether in an action of contract, tort or otherwise, arising
+# from, out of or in connection with the software or the use or other dealings
+# in the Software.
+
+# no bpy here
+
+"""
+A ParametricShape that does not need Blender, evaluated with numpy from
+a small serialized scene: meshes, a transform hierarchy and a subset of
+modifiers (mirror and array, in object space). This is meant to run
+solvers and jfilters headlessly, for instance to benchmark them:
+
+    shape = OfflineParametricShape.load("scene.json")
+    for valuation in valuations:
+        shape.set_hyperparams(valuation)
+        shape.update()
+        hits, locations, *_ = shape.cast_rays(origins, directions)
+
+The scene file is the JSON returned by OfflineParametricShape.to_json():
+{
+    "objects": [
+        {
+            "name": "Cube",
+            "vertices": [[x, y, z], ...],
+            "triangles": [[a, b, c], ...],
+            "location": [x, y, z],
+            "rotation_euler": [x, y, z],
+            "rotation_mode": "XYZ",
+            "scale": [x, y, z],
+            "parent": "Other object name", (optional)
+            "matrix_parent_inverse": 4x4 nested list, (optional)
+            "modifiers": [
+                {"type": "MIRROR", "use_axis": [true, false, false]},
+                {"type": "ARRAY", "count": 3, "use_relative_offset": true,
+                 "relative_offset_displace": [1, 0, 0],
+                 "use_constant_offset": false,
+                 "constant_offset_displace": [0, 0, 0]}
+            ]
+        }
+    ],
+    "hyperparams": [
+        {"name": "Cube TX", "object": "Cube", "prop": "location", "index": 0,
+         "minimum": 0.0, "maximum": 1.0, "default": 0.5}
+    ]
+}
+Modifier properties are named after Blender's ones.
+"""
+
+import json
+import numpy as np
+
+from .profiling import Timer, ProfilingPool
+from .numpy_utils import euler_to_matrix
+from .HyperParameterAccessor import HyperParameterAccessor
+from .Accel import MeshIndex
+
+# -------------------------------------------------------------------
+
+def apply_mirror_modifier(vertices, triangles, modifier):
+    """Mirror modifier in object space (no mirror object, no merge)"""
+    for axis, use_axis in enumerate(modifier.get("use_axis", [True, False, False])):
+        if not use_axis:
+            continue
+        mirrored = vertices.copy()
+        mirrored[:,axis] *= -1
+        # Mirroring flips the orientation of triangles
+        triangles = np.concatenate((triangles, triangles[:,::-1] + len(vertices)))
+        vertices = np.concatenate((vertices, mirrored))
+    return vertices, triangles
+
+def apply_array_modifier(vertices, triangles, modifier):
+    """Array modifier with a fixed count (no offset object, no caps)"""
+    count = modifier.get("count", 2)
+    offset = np.zeros(3, 'f')
+    if modifier.get("use_relative_offset", True) and len(vertices) > 0:
+        size = vertices.max(axis=0) - vertices.min(axis=0)
+        offset += np.array(modifier.get("relative_offset_displace", [1, 0, 0]), 'f') * size
+    if modifier.get("use_constant_offset", False):
+        offset += np.array(modifier.get("constant_offset_displace", [0, 0, 0]), 'f')
+    triangles = np.concatenate([triangles + i * len(vertices) for i in range(count)])
+    vertices = np.concatenate([vertices + i * offset for i in range(count)])
+    return vertices, triangles
+
+modifier_evaluators = {
+    'MIRROR': apply_mirror_modifier,
+    'ARRAY': apply_array_modifier,
+}
+
+# -------------------------------------------------------------------
+
+class OfflineObject:
+    """Stand-in for a Blender mesh object, exposing the same transform
+    properties (location, rotation_euler, rotation_mode, scale) so that
+    hyper-parameters can target it"""
+
+    def __init__(self, name, vertices, triangles,
+                 location=(0, 0, 0), rotation_euler=(0, 0, 0), rotation_mode='XYZ',
+                 scale=(1, 1, 1), parent=None, matrix_parent_inverse=None, modifiers=()):
+        self.name = name
+        self.vertices = np.array(vertices, 'f').reshape(-1, 3)
+        self.triangles = np.array(triangles, 'i').reshape(-1, 3)
+        self.location = np.array(location, dtype=float)
+        self.rotation_euler = np.array(rotation_euler, dtype=float)
+        self.rotation_mode = rotation_mode
+        self.scale = np.array(scale, dtype=float)
+        self.parent = parent
+        self.matrix_parent_inverse = np.eye(4) if matrix_parent_inverse is None else np.array(matrix_parent_inverse)
+        self.modifiers = list(modifiers)
+
+        # Filled by OfflineParametricShape.update()
+        self.matrix_world = np.eye(4)
+        self.evaluated_vertices = None  # world space, after modifiers
+        self.evaluated_triangles = None
+
+        # Modifiers do not depend on hyper-parameters, so the object space
+        # mesh is evaluated only once
+        self.local_vertices, self.evaluated_triangles = self.vertices, self.triangles
+        for modifier in self.modifiers:
+            evaluator = modifier_evaluators.get(modifier["type"])
+            if evaluator is None:
+                print(f"Warning: Unsupported modifier '{modifier['type']}' on object '{name}', skipping.")
+                continue
+            self.local_vertices, self.evaluated_triangles = evaluator(self.local_vertices, self.evaluated_triangles, modifier)
+
+    @property
+    def matrix_basis(self):
+        """Local transform matrix, from location, rotation and scale"""
+        M = np.eye(4)
+        M[:3,:3] = euler_to_matrix(self.rotation_euler, self.rotation_mode) * self.scale
+        M[:3,3] = self.location
+        return M
+
+    def update_tag(self):
+        """Blender objects must be tagged after being changed, here update()
+        detects changes by itself"""
+        pass
+
+    def to_json(self):
+        data = {
+            'name': self.name,
+            'vertices': self.vertices.tolist(),
+            'triangles': self.triangles.tolist(),
+            'location': self.location.tolist(),
+            'rotation_euler': self.rotation_euler.tolist(),
+            'rotation_mode': self.rotation_mode,
+            'scale': self.scale.tolist(),
+            'modifiers': self.modifiers,
+        }
+        if self.parent is not None:
+            data['parent'] = self.parent.name
+            data['matrix_parent_inverse'] = self.matrix_parent_inverse.tolist()
+        return data
+
+# -------------------------------------------------------------------
+
+class OfflineHyperParameter:
+    """Stand-in for HyperParameterProperty"""
+
+    def __init__(self, name, obj, prop, index, minimum=0.0, maximum=1.0, default=0.5, normalizer=1.0):
+        self.name = name
+        self.obj = obj
+        self.prop = prop
+        self.index = index
+        self.minimum = minimum
+        self.maximum = maximum
+        self.default = default
+        self.normalizer = normalizer
+
+    def eval(self):
+        """Return 0 if the parameter is not valid, and its value otherwise"""
+        if self.obj is None or not hasattr(self.obj, self.prop):
+            return 0.0
+        attr = getattr(self.obj, self.prop)
+        if self.index < 0 or self.index >= len(attr):
+            return 0.0
+        return attr[self.index]
+
+    def update(self, set=None, add=None):
+        """Set or increment by <add> the value of the parameter if it is valid"""
+        if self.obj is None or not hasattr(self.obj, self.prop):
+            print(f"ERROR: object {self.obj} has no property {self.prop}")
+            return
+        attr = getattr(self.obj, self.prop)
+        if self.index < 0 or self.index >= len(attr):
+            print(f"ERROR: index out of bounds: {self.index} (should be in range (0, {len(attr) - 1})")
+            return
+        if set is not None:
+            attr[self.index] = set
+        elif add is not None:
+            attr[self.index] += add
+
+    def delta(self, fac=1e-5):
+        """Define what a "small" increment means for this parameter"""
+        delta = (self.maximum - self.minimum) * fac
+        value = self.eval()
+        if self.maximum - value < value - self.minimum:
+            return -delta
+        else:
+            return delta
+
+    def to_json(self):
+        return {
+            'name': self.name,
+            'object': self.obj.name,
+            'prop': self.prop,
+            'index': self.index,
+            'minimum': self.minimum,
+            'maximum': self.maximum,
+            'default': self.default,
+            'normalizer': self.normalizer,
+        }
+
+# -------------------------------------------------------------------
+
+class OfflineParametricShape:
+    """Same interface as ParametricShape, but evaluated with numpy from a
+    serialized scene rather than from a Blender scene (see module doc).
+
+    Use OfflineParametricShape.load(filename) or from_json(data)."""
+
+    def __init__(self, objects, hyperparams):
+        # Parents are listed before their children, so that world matrices
+        # can be evaluated in order
+        self.objects = []
+        def add_with_parents(obj):
+            if obj in self.objects:
+                return
+            if obj.parent is not None:
+                add_with_parents(obj.parent)
+            self.objects.append(obj)
+        for obj in objects:
+            add_with_parents(obj)
+
+        self.hyperparams = hyperparams
+        self.profiling = ProfilingPool()
+        self._accessor = None
+
+        # World space vertices of all objects, concatenated in the layout
+        # of Accel.MeshIndex. Each object's evaluated_vertices is a view on
+        # its part.
+        counts = [len(obj.local_vertices) for obj in self.objects]
+        self._vertex_offsets = np.cumsum([0] + counts, dtype='i')
+        self._triangle_offsets = np.cumsum([0] + [len(obj.evaluated_triangles) for obj in self.objects], dtype='i')
+        self._vertices = np.zeros((self._vertex_offsets[-1], 3), 'f')
+        if self.objects:
+            self._triangles = np.concatenate([obj.evaluated_triangles for obj in self.objects])
+        else:
+            self._triangles = np.empty((0, 3), 'i')
+        for obj, start, end in zip(self.objects, self._vertex_offsets[:-1], self._vertex_offsets[1:]):
+            obj.evaluated_vertices = self._vertices[start:end]
+            obj.matrix_world = None
+
+        # Built on first ray cast, then refit when vertices move
+        self._index = None
+        self._index_outdated = True
+
+        self.update()
+
+    # Serialization
+
+    @classmethod
+    def from_json(cls, data):
+        objects = {}
+        for obj_data in data["objects"]:
+            obj_data = dict(obj_data)
+            obj_data.pop("parent", None)
+            objects[obj_data["name"]] = OfflineObject(**obj_data)
+        for obj_data in data["objects"]:
+            if obj_data.get("parent") is not None:
+                objects[obj_data["name"]].parent = objects[obj_data["parent"]]
+
+        hyperparams = []
+        for param_data in data.get("hyperparams", []):
+            param_data = dict(param_data)
+            obj = objects.get(param_data.pop("object"))
+            hyperparams.append(OfflineHyperParameter(obj=obj, **param_data))
+
+        return OfflineParametricShape(list(objects.values()), hyperparams)
+
+    def to_json(self):
+        return {
+            'objects': [obj.to_json() for obj in self.objects],
+            'hyperparams': [hparam.to_json() for hparam in self.hyperparams],
+        }
+
+    @classmethod
+    def load(cls, filename):
+        with open(filename) as f:
+            return cls.from_json(json.load(f))
+
+    def save(self, filename):
+        with open(filename, 'w') as f:
+            json.dump(self.to_json(), f)
+
+    # ParametricShape interface
+
+    def compile_hyperparams(self):
+        self._accessor = HyperParameterAccessor(self.hyperparams)
+
+    def get_hyperparams(self):
+        if self._accessor is None:
+            self.compile_hyperparams()
+        return self._accessor.get()
+
+    def set_hyperparams(self, values):
+        assert(len(values) == len(self.hyperparams))
+        if self._accessor is None:
+            self.compile_hyperparams()
+        self._accessor.set(values)
+
+    def update(self):
+        """
+        Update the evaluated geometry from the hyper parameters. Only the
+        objects whose world matrix changed get their vertices transformed.
+        """
+        timer = Timer()
+        for obj in self.objects:
+            matrix_world = obj.matrix_basis
+            if obj.parent is not None:
+                matrix_world = obj.parent.matrix_world @ obj.matrix_parent_inverse @ matrix_world
+            if obj.matrix_world is not None and np.array_equal(matrix_world, obj.matrix_world):
+                continue
+            obj.matrix_world = matrix_world
+            M = matrix_world.astype('f')
+            np.matmul(obj.local_vertices, M[:3,:3].T, out=obj.evaluated_vertices)
+            obj.evaluated_vertices += M[:3,3]
+            self._index_outdated = True
+        self.profiling["OfflineParametricShape:update"].add_sample(timer)
+
+    def get_mesh(self, name):
+        """
+        Return the evaluated mesh of an object, as (world space vertices,
+        triangles). The vertices are a view that update() overwrites.
+        """
+        obj = next(obj for obj in self.objects if obj.name == name)
+        return obj.evaluated_vertices, obj.evaluated_triangles
+
+    def ray_cast_session(self):
+        """Same as ParametricShape.ray_cast_session()"""
+        return OfflineRayCastSession(self)
+
+    def cast_ray(self, ray, make_coparam=None):
+        with self.ray_cast_session() as session:
+            return session.cast_ray(ray, make_coparam)
+
+    def cast_rays(self, origins, directions):
+        with self.ray_cast_session() as session:
+            return session.cast_rays(origins, directions)
+
+    def _get_index(self):
+        if self._index is None:
+            self._index = MeshIndex(self._vertices, self._triangles, self._vertex_offsets, self._triangle_offsets)
+        elif self._index_outdated:
+            self._index.refit(self._vertices)
+        self._index_outdated = False
+        return self._index
+
+# -------------------------------------------------------------------
+
+class OfflineRayCastSession:
+    """Same interface as ParametricShape.RayCastSession"""
+
+    def __init__(self, shape):
+        self._shape = shape
+        self._timer = None
+        self._ray_count = 0
+
+    def __enter__(self):
+        self._timer = Timer()
+        self._index = self._shape._get_index()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        profiling = self._shape.profiling
+        ellapsed = self._timer.ellapsed()
+        profiling["OfflineParametricShape:ray_cast_session"].add_sample(ellapsed)
+        profiling["OfflineParametricShape:rays"].add_count(self._ray_count)
+        if self._ray_count > 0:
+            profiling["OfflineParametricShape:time_per_ray"].add_sample(ellapsed / self._ray_count)
+        return False
+
+    def cast_ray(self, ray, make_coparam=None):
+        """
+        @param ray: Ray to intersect with the shape
+        @param make_coparam: Optional callback returning a coparam from a hit
+        point, called as make_coparam(location, normal, triangle index, object, matrix_world)
+        @return (hit position, hit coparam) or None
+        """
+        hits, locations, objects, object_ids, triangles, _ = self.cast_rays(
+            np.array(ray.origin, 'f').reshape(1, 3),
+            np.array(ray.direction, 'f').reshape(1, 3),
+        )
+        if not hits[0]:
+            return None
+
+        location = locations[0]
+        if make_coparam is not None:
+            obj = objects[object_ids[0]]
+            a, b, c = obj.evaluated_vertices[obj.evaluated_triangles[triangles[0]]]
+            normal = np.cross(b - a, c - a)
+            normal /= np.linalg.norm(normal)
+            coparam = make_coparam(location, normal, triangles[0], obj, obj.matrix_world)
+        else:
+            coparam = None
+
+        return location, coparam
+
+    def cast_rays(self, origins, directions):
+        """Same as ParametricShape.RayCastSession.cast_rays(), objects being
+        OfflineObject instances"""
+        self._ray_count += len(origins)
+        objects = self._shape.objects
+        if not objects:
+            hits = np.zeros(len(origins), dtype=bool)
+            return hits, np.empty((0, 3), 'f'), objects, np.empty(0, 'i'), np.empty(0, 'i'), np.empty((0, 3), 'f')
+
+        hits, locations, bcoords, loop_triangles, object_ids = self._index.cast_rays(
+            np.array(origins, 'f'),
+            np.array(directions, 'f'),
+        )
+        return hits, locations[hits], objects, object_ids[hits], loop_triangles[hits], bcoords[hits]
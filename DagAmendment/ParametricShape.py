@@ -27,21 +27,28 @@
 
 # no bpy here
 
+import numpy as np
+
 from .profiling import Timer
+from .Accel import MeshIndex
+from .HyperParameterAccessor import HyperParameterAccessor
 
 class ParametricShape:
     """Wraps the Blender scene to provide an interface whose names
     match better the terms of the paper and that may be used to
     more easily port this to other software.
 
-    Use ParametricShape.from_scene(scene) to get the parametric shape
-    of a given scene."""
+    Use ParametricShape.from_scene(scene, get_world_space_meshes) to get
+    the parametric shape of a given scene."""
 
     __init_guard = object()  # to prevent one from using __init__
 
     @classmethod
-    def from_scene(cls, scene):
-        """Get the parametric shape from the current Blender scene"""
+    def from_scene(cls, scene, get_world_space_meshes=None):
+        """Get the parametric shape from the current Blender scene
+        @param get_world_space_meshes: function that gathers the meshes of a
+               depsgraph for Accel (typically utils.get_world_space_meshes),
+               required to cast rays in batches (see RayCastSession.cast_rays)"""
         import bpy
         scene.diffparam.ensure_view_layer_depsgraph(bpy.context)
         view_layer = scene.diffparam.view_layer
@@ -52,6 +59,7 @@ class ParametricShape:
         shape._scene = scene
         shape._depsgraph = depsgraph
         shape._view_layer = view_layer
+        shape._get_world_space_meshes = get_world_space_meshes
         return shape
 
     def __init__(self, init_guard):
@@ -62,11 +70,33 @@ class ParametricShape:
         self._scene = None
         self._depsgraph = None
         self._view_layer = None
+        self._get_world_space_meshes = None
+        self._accessor = None
+
+    def compile_hyperparams(self):
+        """
+        Build the accessor used by get_hyperparams() and set_hyperparams().
+        This is done automatically on first use, call it again if the
+        hyper-parameters changed their target object or property.
+        """
+        self._accessor = HyperParameterAccessor(self.hyperparams)
+
+    def get_hyperparams(self):
+        """Return the current value of all hyper-parameters as a numpy vector"""
+        timer = Timer()
+        if self._accessor is None:
+            self.compile_hyperparams()
+        values = self._accessor.get()
+        self._scene.profiling["ParametricShape:get_hyperparams"].add_sample(timer)
+        return values
 
     def set_hyperparams(self, values):
+        timer = Timer()
         assert(len(values) == len(self.hyperparams))
-        for hparam, val in zip(self.hyperparams, values):
-            hparam.update(set=val)
+        if self._accessor is None:
+            self.compile_hyperparams()
+        self._accessor.set(values)
+        self._scene.profiling["ParametricShape:set_hyperparams"].add_sample(timer)
 
     def update(self):
         """
@@ -76,28 +106,126 @@ class ParametricShape:
         self._depsgraph.update()
         self._scene.profiling["ParametricShape:update"].add_sample(timer)
 
+    def ray_cast_session(self):
+        """
+        Open a session to cast any number of rays onto the currently
+        evaluated geometry (call update() to reevaluate). The view layer
+        is updated and checked only once, when entering the session:
+            with parametric_shape.ray_cast_session() as session:
+                hit = session.cast_ray(ray)
+                hits, ... = session.cast_rays(origins, directions)
+        """
+        return RayCastSession(self)
+
     def cast_ray(self, ray, make_coparam=None):
         """
-        Cast a ray onto the currently evaluated geometry (call update()
-        to reevaluate)
+        Cast a single ray onto the currently evaluated geometry, see
+        RayCastSession.cast_ray(). Prefer opening a ray_cast_session() to
+        cast many rays.
+        """
+        with self.ray_cast_session() as session:
+            return session.cast_ray(ray, make_coparam)
+
+    def cast_rays(self, origins, directions):
+        """
+        Cast a batch of rays onto the currently evaluated geometry in a
+        single parallel call, see RayCastSession.cast_rays()
+        """
+        with self.ray_cast_session() as session:
+            return session.cast_rays(origins, directions)
+
+# -------------------------------------------------------------------
+
+class RayCastSession:
+    """Serves ray casts onto the geometry of a ParametricShape as it was
+    evaluated when the session started. Get one with
+    ParametricShape.ray_cast_session() and use it as a context manager."""
+
+    def __init__(self, shape):
+        self._shape = shape
+        self._timer = None
+        self._ray_count = 0
+
+        # World space meshes of all objects, gathered on first call to
+        # cast_rays() then reused by the next ones
+        self._objects = None
+        self._index = None
+
+    def __enter__(self):
+        shape = self._shape
+        self._timer = Timer()
+        shape._view_layer.update()
+        assert(shape._scene == shape._view_layer.id_data)
+        assert(shape._depsgraph == shape._view_layer.depsgraph)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        profiling = self._shape._scene.profiling
+        ellapsed = self._timer.ellapsed()
+        profiling["ParametricShape:ray_cast_session"].add_sample(ellapsed)
+        profiling["ParametricShape:rays"].add_count(self._ray_count)
+        if self._ray_count > 0:
+            profiling["ParametricShape:time_per_ray"].add_sample(ellapsed / self._ray_count)
+        return False
+
+    def cast_ray(self, ray, make_coparam=None):
+        """
+        Cast a single ray using Blender's ray casting
         @param ray: Ray to intersect with the shape
         @param make_coparam: Optional callback returning a coparam from a hit point
         @return (hit position, hit coparam)
         """
-        self._view_layer.update()
-        assert(self._scene == self._view_layer.id_data)
-        assert(self._depsgraph == self._view_layer.depsgraph)
-
-        hit = self._scene.ray_cast(self._depsgraph, ray.origin, ray.direction)
+        shape = self._shape
+        self._ray_count += 1
+        hit = shape._scene.ray_cast(shape._depsgraph, ray.origin, ray.direction)
         success, location, normal, poly_index, obj, matrix = hit
 
         if not success:
             return None
 
         if make_coparam is not None:
-            coparam = make_coparam(location, normal, poly_index, obj.evaluated_get(self._depsgraph), matrix)
+            coparam = make_coparam(location, normal, poly_index, obj.evaluated_get(shape._depsgraph), matrix)
         else:
             coparam = None
 
         return location, coparam
 
+    def cast_rays(self, origins, directions):
+        """
+        Cast a batch of rays in a single parallel call
+        @param origins: (n,3) array of ray origins
+        @param directions: (n,3) array of ray directions
+        @return (hits, locations, objects, object_ids, loop_triangles, bcoords)
+        where hits is a boolean mask of rays that hit the shape and, for
+        these rays only, locations are the hit positions, objects[object_ids]
+        the evaluated objects that were hit, loop_triangles the index of the
+        hit triangle in the object's loop_triangles and bcoords the
+        barycentric coordinates of the hit point within this triangle.
+        """
+        timer = Timer()
+        self._ray_count += len(origins)
+        if self._objects is None:
+            self._build_index()
+
+        objects = self._objects
+        if not objects:
+            hits = np.zeros(len(origins), dtype=bool)
+            return hits, np.empty((0, 3), 'f'), objects, np.empty(0, 'i'), np.empty(0, 'i'), np.empty((0, 3), 'f')
+
+        hits, locations, bcoords, loop_triangles, object_ids = self._index.cast_rays(
+            np.array(origins, 'f'),
+            np.array(directions, 'f'),
+        )
+
+        self._shape._scene.profiling["ParametricShape:cast_rays"].add_sample(timer)
+        return hits, locations[hits], objects, object_ids[hits], loop_triangles[hits], bcoords[hits]
+
+    def _build_index(self):
+        shape = self._shape
+        if shape._get_world_space_meshes is None:
+            raise Exception("Casting rays in batches requires the shape to be created with " +
+                            "ParametricShape.from_scene(scene, get_world_space_meshes)")
+        instances, vertices, triangles, vertex_offsets, triangle_offsets = shape._get_world_space_meshes(shape._depsgraph)
+        self._objects = [obj for obj, _ in instances]
+        if self._objects:
+            self._index = MeshIndex(vertices, triangles, vertex_offsets, triangle_offsets)
@@ -51,6 +51,7 @@ class Projector:
         self.P = self.perspective_matrix @ self.view_matrix
         self.w = 3
         self.inv_view_matrix = inv(view_matrix)
+        self.inv_perspective_matrix = inv(perspective_matrix)
         self.lens = lens
         #assert(np.isclose(self.P, np.array(M @ rv3d.perspective_matrix)).all())
 
@@ -68,17 +69,21 @@ class Projector:
     def unproject(self, uv):
         """Take a uv screen pos in range [0,1]² and return a world space
         direction"""
-        u, v = uv
-        proj = self.perspective_matrix
+        return self.unproject_batch(np.array(uv)[np.newaxis,:])[0]
 
-        screenspace = np.array((u, v, 0.0, 1.0))
-        viewspace = inv(proj) @ screenspace
-        viewspace[3] = 1
-        worldspace = self.inv_view_matrix @ viewspace
-        worldspace = worldspace[:3]
+    def unproject_batch(self, uvs):
+        """Same as unproject() for a (n,2) array of uv screen positions,
+        returns a (n,3) array of world space directions"""
+        screenspace = np.zeros((len(uvs), 4))
+        screenspace[:,:2] = uvs
+        screenspace[:,3] = 1
+        viewspace = screenspace @ self.inv_perspective_matrix.T
+        viewspace[:,3] = 1
+        worldspace = viewspace @ self.inv_view_matrix.T
+        worldspace = worldspace[:,:3]
 
-        direction = worldspace - self.position
-        return direction / norm(direction)
+        directions = worldspace - self.position
+        return directions / norm(directions, axis=1, keepdims=True)
 
     @property
     def position(self):
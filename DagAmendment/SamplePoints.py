@@ -20,16 +20,16 @@
 # along with DagAmendment.  If not, see <https://www.gnu.org/licenses/>.
 
 import bpy
-from mathutils import Vector
-from mathutils.interpolate import poly_3d_calc
 
 import numpy as np
 from numpy.linalg import norm
 
-from .utils import visible_objects_and_duplis, unproject_circle
-from .numpy_utils import random_in_unit_disc, sqnorm
+from .utils import visible_objects_and_duplis, unproject_circle, get_transform_derivative, VertexBufferCache, get_unmodeled_object_references, get_modifier_object_references
+from .numpy_utils import random_in_unit_disc_batch, simultaneous_omp, sqnorm
 from .profiling import Timer
-from .uv_coparam import coparam_to_position
+from .uv_coparam import bind_coparams, hits_to_coparams
+from .InfluenceIndex import InfluenceIndex
+from .HyperParameterAccessor import HyperParameterAccessor
 
 class SamplePoints:
     """
@@ -37,11 +37,14 @@ class SamplePoints:
     the jacobian.
     Could also be called "Jacobian Buffer"
     """
-    def __init__(self, context):
+    def __init__(self, context, seed=None):
         # Struct of arrays: all these arrays are supposed to have the
-        # same length or be all None.
+        # same length or be all None. They are views on the first rows of
+        # preallocated buffers, reused from one sampling to the next.
         self.positions = None
         self.coparams = None
+        self.ss_offsets = None
+        self.original_positions = None
 
         # When ready, jacobians has shape (n, 3, k) where:
         #  n is the number of sample points (length of self.positions
@@ -51,9 +54,80 @@ class SamplePoints:
         #     F_i: hyperparams -> point of coparam self.coparams[i]
         self.jacobians = None
 
+        # Estimated relative error of the last jacobians, zero when they
+        # were measured with finite differences (see compute_jacobians)
+        self.jacobian_error = None
+
         # Is overriden with the parameter given to sample_from_view
         self.max_projection_error = 1e-7
 
+        # Spatial index of each object's uv mesh, kept for the whole
+        # stroke because the uv layout rarely changes (see uv_coparam.py)
+        self.mesh_indices = {}
+        # Result of get_uv_mesh() for each object, reused while the topology
+        # does not change
+        self.uv_meshes = {}
+        # Vertex positions of each evaluated object, read in place at each
+        # finite difference step and kept across samplings (see
+        # utils.VertexBufferCache)
+        self.vertex_buffers = VertexBufferCache()
+
+        # Random generator used to sample screen space offsets, seed it to
+        # get reproducible samplings
+        self.rng = np.random.default_rng(seed)
+
+        # Triangle and barycentric coordinates of each coparam, reused
+        # across finite difference steps (see uv_coparam.CoparamBinding)
+        self.binding = None
+
+        # Objects that each hyper-parameter may move, built from the
+        # DEPSGRAPH node tree at the first compute_jacobians of a sampling
+        self.influence = None
+
+        # Buffers backing the struct of arrays, see _reserve()
+        self._capacity = 0
+        self._positions_buffer = None
+        self._coparams_buffer = None
+        self._ss_offsets_buffer = None
+        self._original_positions_buffer = None
+        self._new_positions_buffer = None  # scratch array of compute_jacobians
+        self._jacobians_buffer = None
+        self._measures_buffer = None  # scratch array of _compute_sparse_jacobians
+        self._allocation_count = 0
+
+    def _allocate(self, shape, dtype='f'):
+        self._allocation_count += 1
+        return np.empty(shape, dtype)
+
+    def _reserve(self, point_count, hyperparam_count=None, measure_count=None):
+        """Ensure that buffers can hold point_count sample points (and their
+        jacobians with respect to hyperparam_count hyper-parameters, and
+        measure_count displacements of each of them), only allocating when
+        the current capacity is not enough"""
+        if point_count > self._capacity:
+            self._capacity = max(point_count, 2 * self._capacity)
+            self._positions_buffer = self._allocate((self._capacity, 3))
+            self._coparams_buffer = self._allocate((self._capacity, 3))
+            self._ss_offsets_buffer = self._allocate((self._capacity, 2))
+            self._original_positions_buffer = self._allocate((self._capacity, 3))
+            self._new_positions_buffer = self._allocate((self._capacity, 3))
+            self._jacobians_buffer = None
+            self._measures_buffer = None
+        if hyperparam_count is not None:
+            buffer = self._jacobians_buffer
+            if buffer is None or buffer.shape[0] < self._capacity or buffer.shape[2] != hyperparam_count:
+                self._jacobians_buffer = self._allocate((self._capacity, 3, hyperparam_count))
+        if measure_count is not None:
+            buffer = self._measures_buffer
+            if buffer is None or buffer.shape[0] < measure_count or buffer.shape[1] < self._capacity:
+                self._measures_buffer = self._allocate((measure_count, self._capacity, 3), 'd')
+
+    def _report_allocations(self):
+        profiling = bpy.context.scene.profiling
+        profiling["SamplePoints:allocations"].add_count(self._allocation_count)
+        profiling["SamplePoints:vertex_buffer_allocations"].add_count(self.vertex_buffers.pop_allocation_count())
+        self._allocation_count = 0
+
     def is_ready(self):
         """Tells whether some points have been sampled"""
         return self.positions is not None
@@ -62,7 +136,7 @@ class SamplePoints:
         """Tells whether some points have been sampled"""
         return self.jacobians is not None
 
-    def compute_jacobians(self, parametric_shape, delta=1e-5):
+    def compute_jacobians(self, parametric_shape, delta=1e-5, estimator='FINITE_DIFFERENCES', budget=16):
         """
         Measure the jacobians at the sampled points.
         It is assumed that there are sample points available, i.e. that
@@ -71,6 +145,13 @@ class SamplePoints:
         @param delta: factor multiplied by the range of an
                hyper-parameter to get the delta used for finite
                differences.
+        @param estimator: 'FINITE_DIFFERENCES' to measure each column
+               separately, or 'SPARSE' to recover the jacobian from at most
+               budget random perturbations of all hyper-parameters at once,
+               assuming that few of them move each object (see
+               _compute_sparse_jacobians)
+        @param budget: maximum number of scene updates used by the 'SPARSE'
+               estimator, not counting the update of the base positions
         """
         base_delta = delta
         timer = Timer()
@@ -78,36 +159,200 @@ class SamplePoints:
 
         n = len(self.positions)
         k = len(parametric_shape.hyperparams)
-        self.jacobians = np.zeros((n, 3, k), 'f')
+        self._reserve(n, k)
+        self.jacobians = self._jacobians_buffer[:n]
+        self.jacobians.fill(0)
+        self.jacobian_error = 0.0
 
         if len(self.positions) == 0:
+            self._report_allocations()
             return
 
-        self.original_positions = np.array(self.positions, 'f')  # copy for error display
+        # copy for error display
+        self.original_positions = self._original_positions_buffer[:n]
+        self.original_positions[:] = self.positions
         parametric_shape.update()
 
-        self._eval_positions(self.positions, parametric_shape)
+        # Bind coparams again from the current state (see _eval_positions)
+        self.binding = None
 
-        new_positions = np.empty_like(self.positions)
-        for k, hparam in enumerate(parametric_shape.hyperparams):
-            delta = hparam.delta(fac=base_delta)
-            value = hparam.eval()
+        self._eval_positions(self.positions, parametric_shape)
 
-            # Basic finite differences:
-            # Add 'delta' to the current parameter, and reevaluate the scene
-            hparam.update(add=delta)
+        # Parameters that cannot move any of the sampled objects have a null
+        # jacobian, there is no need to reevaluate the scene for them. Among
+        # the others, parameters that move disjoint sets of objects are
+        # grouped and perturbed at once, with a single scene update per group.
+        if self.influence is None:
+            self.influence = InfluenceIndex.from_graph(
+                bpy.data.node_groups.get('DEPSGRAPH'),
+                unmodeled_references=get_unmodeled_object_references(),
+            )
+        object_rows = {
+            obj.name: indices
+            for obj, indices in zip(self.objects, self.per_object_ranges)
+            if indices.stop > indices.start
+        }
+        hyperparams = parametric_shape.hyperparams
+
+        # Parameters that only move objects rigidly have a closed form
+        # jacobian, finite differences remain for the other ones
+        analytic = self._compute_transform_jacobians(parametric_shape, object_rows)
+        remaining = [k for k in range(len(hyperparams)) if k not in analytic]
+
+        groups = self.influence.group_hyperparams(hyperparams, object_rows.keys(), indices=remaining)
+        grouped_count = sum(len(group) for group in groups) + len(analytic)
+
+        # The sparse estimator is only worth it when there are more groups
+        # than its budget, otherwise finite differences are exact and cheaper
+        if estimator == 'SPARSE' and len(groups) > budget:
+            params = [param for group in groups for param in group]
+            update_count = self._compute_sparse_jacobians(parametric_shape, params, object_rows, base_delta, budget)
+            # Counters only hold integers, so the relative error is in per mille
+            profiling = bpy.context.scene.profiling
+            profiling["SamplePoints:sparse_params"].add_count(len(params))
+            profiling["SamplePoints:sparse_updates"].add_count(update_count)
+            profiling["SamplePoints:sparse_error_permille"].add_count(int(round(self.jacobian_error * 1000)))
+        else:
+            update_count = self._compute_grouped_jacobians(parametric_shape, groups, object_rows, base_delta)
+
+        profiling = bpy.context.scene.profiling
+        profiling["SamplePoints:skipped_params"].add_count(len(hyperparams) - grouped_count)
+        profiling["SamplePoints:jacobian_updates"].add_count(update_count + 1)
+        profiling["SamplePoints:analytic_params"].add_count(len(analytic))
+        profiling["SamplePoints:compute_jacobians"].add_sample(timer)
+        self._report_allocations()
+
+    def _compute_grouped_jacobians(self, parametric_shape, groups, object_rows, base_delta):
+        """Internal step of compute_jacobians, fill the columns of the
+        hyper-parameters using finite differences, with one scene update
+        per group of hyper-parameters (see InfluenceIndex.group_hyperparams)
+        @return the number of scene updates"""
+        hyperparams = parametric_shape.hyperparams
+        new_positions = self._new_positions_buffer[:len(self.positions)]
+        for group in groups:
+            deltas = []
+            values = []
+            for k, _ in group:
+                hparam = hyperparams[k]
+                deltas.append(hparam.delta(fac=base_delta))
+                values.append(hparam.eval())
+
+                # Basic finite differences:
+                # Add 'delta' to the current parameter, and reevaluate the scene
+                hparam.update(add=deltas[-1])
             parametric_shape.update()
 
             self._eval_positions(new_positions, parametric_shape)
-            self.jacobians[:,:,k] = (new_positions - self.positions) / delta
 
-            if norm(self.jacobians[:,:,k]) == 0:
-                print(f"WARNING null axis {k} (delta={delta})")
+            # Each sample is moved by at most one parameter of the group
+            for (k, objects), delta in zip(group, deltas):
+                for name in objects:
+                    rows = object_rows[name]
+                    np.subtract(new_positions[rows], self.positions[rows], out=self.jacobians[rows,:,k])
+                    self.jacobians[rows,:,k] /= delta
+
+                if norm(self.jacobians[:,:,k]) == 0:
+                    print(f"WARNING null axis {k} (delta={delta})")
+
+            # Restore the original value of the parameters
+            for (k, _), value in zip(group, values):
+                hyperparams[k].update(set=value)
+
+        return len(groups)
+
+    def _compute_sparse_jacobians(self, parametric_shape, params, object_rows, base_delta, budget):
+        """Internal step of compute_jacobians, estimate the columns of the
+        hyper-parameters from random simultaneous perturbations of all of
+        them (as in SPSA). Each perturbation j measures the displacement
+        Y_j = sum_p s_jp * delta_p * J_p with random signs s_jp = ±1. Since
+        each object is usually moved by few parameters, the columns are
+        recovered object per object as the sparsest ones that explain the
+        measures (compressed sensing, see simultaneous_omp).
+        The last perturbation is not used for the recovery but to measure
+        the error of the estimate, saved in self.jacobian_error.
+        @param params: list of pairs (index of the parameter, names of the
+               objects that it moves)
+        @return the number of scene updates"""
+        hyperparams = parametric_shape.hyperparams
+        budget = max(budget, 3)
+        deltas = np.array([hyperparams[k].delta(fac=base_delta) for k, _ in params])
+        signs = self.rng.choice((-1.0, 1.0), size=(budget, len(params)))
+
+        # All perturbed parameters are set at once at each step
+        accessor = HyperParameterAccessor([hyperparams[k] for k, _ in params])
+        valuation = accessor.get()
+
+        n = len(self.positions)
+        self._reserve(n, measure_count=budget)
+        new_positions = self._new_positions_buffer[:n]
+        measures = self._measures_buffer[:budget,:n]
+        for j in range(budget):
+            accessor.set(valuation + signs[j] * deltas)
+            parametric_shape.update()
+            self._eval_positions(new_positions, parametric_shape)
+            measures[j] = new_positions - self.positions
+
+        # Restore the original value of the parameters
+        accessor.set(valuation)
+
+        # Points that get lost by some of the perturbations cannot be used
+        lost = np.isnan(measures).any(axis=(0, 2))
 
-            # Restore the original value of the parameter
-            hparam.update(set=value)
+        residual_sq = 0.0
+        measured_sq = 0.0
+        for name, indices in object_rows.items():
+            rows = np.arange(indices.start, indices.stop)
+            candidates = [i for i, (_, objects) in enumerate(params) if name in objects]
+            if not candidates:
+                continue
+            valid_rows = rows[~lost[rows]]
+            for i in candidates:
+                self.jacobians[rows[lost[rows]],:,params[i][0]] = np.nan
+
+            Y = measures[:,valid_rows].reshape(budget, -1)
+            A = signs[:,candidates]
+            X = simultaneous_omp(A[:-1], Y[:-1], max_support=budget - 2)
+            for c, i in enumerate(candidates):
+                self.jacobians[valid_rows,:,params[i][0]] = X[c].reshape(-1, 3) / deltas[i]
+
+            residual_sq += sqnorm(Y[-1] - A[-1] @ X)
+            measured_sq += sqnorm(Y[-1])
+
+        self.jacobian_error = np.sqrt(residual_sq / measured_sq) if measured_sq > 0 else 0.0
+        return budget
+
+    def _compute_transform_jacobians(self, parametric_shape, object_rows):
+        """Internal step of compute_jacobians, fill the columns of the
+        hyper-parameters that are a location, Euler rotation or scale of an
+        object whose meshes do not go through any modifier afterwards.
+        @param object_rows: slice of the samples of each sampled object, by name
+        @return the set of indices of the parameters that have been filled"""
+        analytic = set()
+        sampled_objects = {obj.name: obj for obj in self.objects if obj.name in object_rows}
+        for k, hparam in enumerate(parametric_shape.hyperparams):
+            if not self.influence.is_pure_transform(hparam, object_rows.keys()):
+                continue
+            objects = self.influence.influenced_objects(hparam, object_rows.keys())
+            if not objects:
+                continue
+            # Constraints of the children are not part of the graph
+            if any(len(sampled_objects[name].constraints) > 0 for name in objects if name != hparam.obj.name):
+                continue
+            # Nor are the objects used by modifiers (mirror object, array offset
+            # object, hook...), relatively to which moving the object is not rigid
+            if any(next(get_modifier_object_references(sampled_objects[name]), None) is not None for name in objects):
+                continue
 
-        bpy.context.scene.profiling["SamplePoints:compute_jacobians"].add_sample(timer)
+            obj = hparam.obj.evaluated_get(parametric_shape._depsgraph)
+            D = get_transform_derivative(obj, hparam.prop, hparam.index)
+            if D is None:
+                continue
+
+            analytic.add(k)
+            for name in objects:
+                rows = object_rows[name]
+                self.jacobians[rows,:,k] = self.positions[rows] @ D[:3,:3].T + D[:3,3]
+        return analytic
 
     def _eval_positions(self, output_array, parametric_shape):
         """Internal step of compute_jacobians, evaluate the current positions
@@ -115,16 +360,40 @@ class SamplePoints:
         that must have shape (point count, 3)"""
         timer = Timer()
 
-        # All points belonging to the same object are evaluated at the same time
-        # (thanks to coparam_to_position() being vectorized)
+        # All points are evaluated at once, the meshes of all objects being
+        # concatenated (thanks to bind_coparams() being vectorized)
+        objects = []
+        counts = []
         for obj, indices in zip(self.objects, self.per_object_ranges):
-            if not indices:
+            if indices.stop == indices.start:
                 continue
             # This part should be in ParametricShape, but we don't want to move
             # the per-primitive sort mechanism to ParametricShape so it is easier
             # to keep this here
-            eval_obj = obj.evaluated_get(parametric_shape._depsgraph)
-            output_array[indices] = coparam_to_position(self.coparams[indices], eval_obj, max_projection_error=self.max_projection_error)
+            objects.append(obj.evaluated_get(parametric_shape._depsgraph))
+            counts.append(indices.stop - indices.start)
+
+        if objects:
+            # Coparams are sorted by object (see sample_from_view). They are
+            # projected only once, then the triangle and barycentric coordinates
+            # they are bound to are reused as long as the topology does not change.
+            profiling = bpy.context.scene.profiling
+            positions = None
+            if self.binding is not None:
+                positions = self.binding.eval_positions(objects, uv_mesh_cache=self.uv_meshes, vertex_cache=self.vertex_buffers)
+                profiling["SamplePoints:binding_reused" if positions is not None else "SamplePoints:binding_invalidated"].add_count(1)
+            if positions is None:
+                object_ids = np.repeat(np.arange(len(objects), dtype='i'), counts)
+                self.binding = bind_coparams(
+                    self.coparams,
+                    object_ids,
+                    objects,
+                    max_projection_error=self.max_projection_error,
+                    mesh_index_cache=self.mesh_indices,
+                    uv_mesh_cache=self.uv_meshes,
+                )
+                positions = self.binding.eval_positions(objects, uv_mesh_cache=self.uv_meshes, vertex_cache=self.vertex_buffers)
+            output_array[:] = positions
 
         bpy.context.scene.profiling["SamplePoints:eval_positions"].add_sample(timer)
 
@@ -134,7 +403,46 @@ class SamplePoints:
         self._eval_positions(positions[:], parametric_shape)
         return positions
 
-    def sample_from_view(self, parametric_shape, viewport_state, mouse_x, mouse_y, radius, sample_count=32, max_projection_error=1e-7, discard_by_world_distance=True):
+    def update_jacobians_broyden(self, parametric_shape, delta_valuation, tolerance=0.1):
+        """
+        Cheap alternative to compute_jacobians once the hyper-parameters
+        moved by delta_valuation since the jacobians were last measured:
+        the jacobian of each point gets a rank one secant update ("good"
+        Broyden update) so that it maps delta_valuation to the displacement
+        that the point actually had.
+        This also moves self.positions to the current positions.
+        @param tolerance: maximum relative error of the current jacobians
+               at predicting the displacement, beyond which the shape is
+               considered to be too non linear for a secant update
+        @return False, leaving the jacobians untouched, if the error is
+                beyond tolerance, in which case compute_jacobians must be
+                called instead
+        """
+        assert(self.is_jacobian_ready())
+        step = np.asarray(delta_valuation, dtype='f')
+        step_sq = step @ step
+        if step_sq == 0:
+            return True
+
+        positions = self._new_positions_buffer[:len(self.positions)]
+        self._eval_positions(positions, parametric_shape)
+        displacement = positions - self.positions
+        error = displacement - self.jacobians @ step
+
+        # Points that got lost or have no jacobian are not updated
+        valid = ~np.isnan(error).any(axis=1)
+        if not valid.any():
+            return False
+        error_norm = norm(error[valid])
+        displacement_norm = norm(displacement[valid])
+        if error_norm > tolerance * displacement_norm:
+            return False
+
+        self.jacobians[valid] += error[valid][:,:,np.newaxis] * (step / step_sq)
+        self.positions[:] = positions
+        return True
+
+    def sample_from_view(self, parametric_shape, viewport_state, mouse_x, mouse_y, radius, sample_count=32, max_projection_error=1e-7, discard_by_world_distance=True, seed=None):
         """
         Resample positions by unprojecting screen space samples around
         the mouse cursor. Only keep points in a given sphere around the
@@ -142,45 +450,42 @@ class SamplePoints:
 
         This fills self.positions and self.coparams hence
         making is_ready() return True
+        @param seed: if not None, reseed the random generator used for this
+               sampling and the following jacobian estimations
         """
         timer = Timer()
+
+        if seed is not None:
+            self.rng = np.random.default_rng(seed)
         
         self.max_projection_error = max_projection_error
+        self.mesh_indices = {}
+        self.uv_meshes = {}
+        self.binding = None
+        self.influence = None
 
         parametric_shape.update()
         self._init_object_lut(parametric_shape)
+        self._reserve(sample_count)
 
-        all_samples = []
-        main_position = None  # closest successful ray cast to the mouse cursor
-        min_d2 = None
-        sample_count_per_object = [0 for _ in self.object_lut]
-        for i in range(sample_count):
-            ss_offset = random_in_unit_disc() * radius if i > 0 else np.zeros(2)
-            ss_sample = np.array((mouse_x, mouse_y)) + ss_offset
-            u, v = ss_sample[0] / viewport_state.width, ss_sample[1] / viewport_state.height
-            ray = viewport_state.ray_from_screenpoint(ss_sample)
-            hit = parametric_shape.cast_ray(ray, make_coparam=self.coparam_from_hit)
-            if hit is None:
-                continue
-            pos, (coparam, object_id) = hit
-            all_samples.append((pos, coparam, object_id, ss_offset))
-            sample_count_per_object[object_id] += 1
-
-            if discard_by_world_distance:
-                d2 = sqnorm(ss_offset)
-                if main_position is None or d2 < min_d2:
-                    main_position = pos
-                    min_d2 = d2
+        # The first sample is exactly under the mouse cursor
+        ss_offsets = random_in_unit_disc_batch(sample_count, self.rng) * radius
+        ss_offsets[:1] = 0
+        origins, directions = viewport_state.rays_from_screenpoints(np.array((mouse_x, mouse_y)) + ss_offsets)
 
-        if not all_samples:
+        # All rays are cast at once
+        hits, positions, objects, hit_object_ids, loop_triangles, bcoords = parametric_shape.cast_rays(origins, directions)
+        if not hits.any():
             return
-
-        # We sort by object ID so that samples that belong to the same object are
-        # at consecutive positions in the array. This speeds up slicing when there
-        # is a need for treating each object separately (e.g. in compute_jacobians)
-        all_samples.sort(key=lambda x: x[2])
+        coparams = hits_to_coparams(objects, hit_object_ids, loop_triangles, bcoords, self.uv_meshes)
+        ss_offsets = ss_offsets[hits]
+        object_lut = np.array([self.object_lut[obj.name] for obj in objects], 'i')
+        object_ids = object_lut[hit_object_ids]
 
         if discard_by_world_distance:
+            # Closest successful ray cast to the mouse cursor
+            main_position = positions[np.argmin((ss_offsets * ss_offsets).sum(axis=1))]
+
             ray_origin = viewport_state.projector.position
             lens = viewport_state.projector.lens
             depth_gt = norm(ray_origin - main_position)
@@ -188,58 +493,33 @@ class SamplePoints:
             ws_radius *= 1.1
             ws_radius2 = ws_radius * ws_radius
 
-            filtered_samples = []
-            sample_count_per_object = [0 for _ in self.object_lut]
-            for s in all_samples:
-                pos, _, object_id, _ = s
-                if sqnorm(pos - main_position) < ws_radius2:
-                    filtered_samples.append(s)
-                    sample_count_per_object[object_id] += 1
-            all_samples = filtered_samples
-
-        # Also remember slicing indices, so that all_samples[samples_per_object_ranges[i]]
-        # is all the samples from object #i.
-        self.per_object_ranges = [None for _ in self.object_lut]
-        prefix_sum = 0
-        for object_id, count in enumerate(sample_count_per_object):
-            self.per_object_ranges[object_id] = range(prefix_sum, prefix_sum + count)
-            prefix_sum += count
-
-        self.positions = np.array([pos for pos, _, _, _ in all_samples], 'f')
-        self.coparams = np.array([coparam for _, coparam, _, _ in all_samples], 'f')
-        self.ss_offsets = np.array([offset for _, _, _, offset in all_samples], 'f')
+            diff = positions - main_position
+            keep = (diff * diff).sum(axis=1) < ws_radius2
+            positions, coparams, ss_offsets, object_ids = positions[keep], coparams[keep], ss_offsets[keep], object_ids[keep]
+
+        # We sort by object ID so that samples that belong to the same object are
+        # at consecutive positions in the array. This speeds up slicing when there
+        # is a need for treating each object separately (e.g. in compute_jacobians)
+        order = np.argsort(object_ids, kind='stable')
+
+        # Also remember slicing indices, so that self.positions[self.per_object_ranges[i]]
+        # is all the samples from object #i. These are slices, so that this is
+        # a view rather than a copy.
+        sample_count_per_object = np.bincount(object_ids, minlength=len(self.object_lut))
+        prefix_sum = np.concatenate(([0], np.cumsum(sample_count_per_object)))
+        self.per_object_ranges = [slice(int(start), int(end)) for start, end in zip(prefix_sum[:-1], prefix_sum[1:])]
+
+        n = len(order)
+        self.positions = self._positions_buffer[:n]
+        self.coparams = self._coparams_buffer[:n]
+        self.ss_offsets = self._ss_offsets_buffer[:n]
+        self.positions[:] = positions[order]
+        self.coparams[:] = coparams[order]
+        self.ss_offsets[:] = ss_offsets[order]
         self.jacobians = None
 
         bpy.context.scene.profiling["SamplePoints:sample_from_view"].add_sample(timer)
-
-    def coparam_from_hit(self, location, normal, poly_index, object, matrix):
-        """
-        Callback provided to cast_ray, that returns the coparam at hit point
-        It gets troubled by this issue in Blender's ray_cast:
-            https://developer.blender.org/T72113#1077887
-        """
-        poly = object.data.polygons[poly_index]
-        material_index = poly.material_index
-        corners = [matrix @ object.data.vertices[vid].co for vid in poly.vertices]
-        bcoords = poly_3d_calc(corners, location)
-
-        uv_layer = object.data.uv_layers.active.data
-        corners_uv = [uv_layer[l].uv for l in poly.loop_indices]
-
-        uv = (np.array(corners_uv) * np.array(bcoords)[:,np.newaxis]).sum(axis=0)
-
-        check = sum([b * c for c, b in zip(corners, bcoords)], Vector((0,0,0)))
-
-        if (location - check).magnitude > 0.01:
-            print(f"High error in coparam estimation, hit object {object.name} at poly {poly} (#{poly_index}), material_index = {poly.material_index}")
-        
-        object_id = self.object_lut[object.name]
-        #primitive_id = material_index * len(self.object_lut) + object_id
-        primitive_id = material_index
-
-        coparam = (*uv, primitive_id)
-
-        return coparam, object_id
+        self._report_allocations()
 
     def _init_object_lut(self, parametric_shape):
         """
@@ -261,10 +541,11 @@ class SamplePoints:
     def get_main_point(self):
         """
         Return the first non-nan position or None, and screen space
-        offset to the mouse cursor.
+        offset to the mouse cursor. These are copies, since the buffers
+        get reused by the next sampling.
         TODO: test by proximity to the mouse cursor
         """
         for i, pos in enumerate(self.positions):
             if not np.isnan(pos.sum()):
-                return pos, self.ss_offsets[i]
+                return pos.copy(), self.ss_offsets[i].copy()
         return None, None
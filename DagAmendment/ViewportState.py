@@ -48,6 +48,16 @@ class ViewportState:
         direction = self.projector.unproject(point)
         return Ray(origin, direction)
 
+    def rays_from_screenpoints(self, points):
+        """
+        Same as ray_from_screenpoint() for a (n,2) array of points
+        @return (origins, directions), two arrays of shape (n,3)
+        """
+        uvs = np.array(points) / np.array((self.width, self.height))
+        directions = self.projector.unproject_batch(uvs)
+        origins = np.broadcast_to(self.projector.position, directions.shape)
+        return origins, directions
+
     def to_json(self):
         return {
             'projector': self.projector.to_json(),
@@ -38,12 +38,36 @@ def diffparam_ensure_parameter_boundaries(scene):
         if v > param.maximum:
             param.update(set=param.maximum)
 
+# Number of geometry updates of each original mesh datablock, by name
+# (see mesh_update_stamp())
+_mesh_update_stamps = {}
+
+@persistent
+def diffparam_track_mesh_updates(scene, depsgraph):
+    """
+    Count the geometry updates of mesh datablocks themselves (edit mode,
+    uv editing, etc.) as opposed to updates of the objects using them
+    (modifiers), so that data read from a mesh can be cached cheaply
+    """
+    for update in depsgraph.updates:
+        if update.is_updated_geometry and isinstance(update.id, bpy.types.Mesh):
+            name = update.id.name
+            _mesh_update_stamps[name] = _mesh_update_stamps.get(name, 0) + 1
+
+def mesh_update_stamp(mesh):
+    """
+    Value that changes whenever the original datablock of mesh (which may be
+    an evaluated mesh) gets a geometry update
+    """
+    return _mesh_update_stamps.get(mesh.original.name, 0)
+
 @persistent
 def diffparam_on_load(scene):
     if scene is not None:
         for obj in scene.objects:
             obj.jbuffer.reset()
         scene.jbuffer.reset()
+    _mesh_update_stamps.clear()
 
 # -------------------------------------------------------------------
 
@@ -56,10 +80,12 @@ def remove_handler(handlers_list, cb):
 def register():
     unregister()
     depsgraph_update_post.append(diffparam_ensure_parameter_boundaries)
+    depsgraph_update_post.append(diffparam_track_mesh_updates)
     load_post.append(diffparam_on_load)
 
 def unregister():
     remove_handler(depsgraph_update_post, diffparam_ensure_parameter_boundaries)
+    remove_handler(depsgraph_update_post, diffparam_track_mesh_updates)
     remove_handler(load_post, diffparam_on_load)
 
 # -------------------------------------------------------------------
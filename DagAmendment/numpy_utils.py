@@ -51,6 +51,52 @@ def random_in_unit_disc():
 
 # -------------------------------------------------------------------
 
+def random_in_unit_disc_batch(count, rng=None):
+    """
+    Sample count random 2D points uniformly in the unit disk at once
+    @param rng: optional np.random.Generator, for reproducible sampling
+    @return array of shape (count, 2)
+    """
+    if rng is None:
+        rng = np.random.default_rng()
+    radius = np.sqrt(rng.random(count))
+    angle = rng.random(count) * 2 * np.pi
+    return np.stack((radius * np.cos(angle), radius * np.sin(angle)), axis=1)
+
+# -------------------------------------------------------------------
+
+def axis_rotation_matrix(axis, angle, derivative=False):
+    """
+    3x3 matrix of the rotation of a given angle around axis 0, 1 or 2
+    (X, Y or Z), or its derivative with respect to the angle
+    """
+    c, s, one = np.cos(angle), np.sin(angle), 1.0
+    if derivative:
+        c, s, one = -s, c, 0.0
+    i, j = (axis + 1) % 3, (axis + 2) % 3
+    M = np.zeros((3, 3))
+    M[axis,axis] = one
+    M[i,i], M[i,j] = c, -s
+    M[j,i], M[j,j] = s, c
+    return M
+
+# -------------------------------------------------------------------
+
+def euler_to_matrix(angles, order='XYZ', derivative_axis=None):
+    """
+    3x3 rotation matrix of Euler angles, with Blender's convention that
+    the first axis of order is applied first
+    @param derivative_axis: if not None, return instead the derivative of
+    the matrix with respect to angles[derivative_axis]
+    """
+    M = np.eye(3)
+    for letter in order:
+        axis = 'XYZ'.index(letter)
+        M = axis_rotation_matrix(axis, angles[axis], derivative=(axis == derivative_axis)) @ M
+    return M
+
+# -------------------------------------------------------------------
+
 def matvecmul(M, v):
     """
     @param M batch of matrices, or single matrix
@@ -78,3 +124,31 @@ def svd_inverse(J):
 
 # -------------------------------------------------------------------
 
+def simultaneous_omp(A, Y, max_support, rtol=1e-3):
+    """
+    Simultaneous Orthogonal Matching Pursuit: find X with as few non null
+    rows as possible such that A @ X ~= Y, by greedily adding to the support
+    the row that best explains the residual of all columns of Y at once.
+    @param A: (measure count, unknown count) sensing matrix
+    @param Y: (measure count, signal count) measures
+    @param max_support: maximum number of non null rows in X
+    @param rtol: stop once the residual is below rtol times the norm of Y
+    @return X of shape (unknown count, signal count)
+    """
+    X = np.zeros((A.shape[1], Y.shape[1]))
+    column_norms = norm(A, axis=0)
+    column_norms[column_norms == 0] = 1
+    support = []
+    residual = Y
+    Y_norm = norm(Y)
+    while len(support) < min(max_support, A.shape[1]) and norm(residual) > rtol * Y_norm:
+        scores = norm(A.T @ residual, axis=1) / column_norms
+        scores[support] = -1
+        support.append(int(np.argmax(scores)))
+        coefficients = np.linalg.lstsq(A[:,support], Y, rcond=None)[0]
+        residual = Y - A[:,support] @ coefficients
+    if support:
+        X[support] = coefficients
+    return X
+
+# -------------------------------------------------------------------
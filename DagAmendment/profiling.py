@@ -49,3 +49,47 @@ class Timer():
 		return time.perf_counter() - self.start
 
 # -------------------------------------------------------------------
+
+class ProfilingCounter():
+	"""Same interface as profiling_properties.ProfilingCounterProperty,
+	for code that runs without Blender"""
+	def __init__(self, name):
+		self.name = name
+		self.is_count = False
+		self.reset()
+
+	def average(self):
+		return self.accumulated / self.sample_count if self.sample_count > 0 else 0
+
+	def add_sample(self, value):
+		if hasattr(value, 'ellapsed'):
+			value = value.ellapsed()
+		self.sample_count += 1
+		self.accumulated += value
+
+	def add_count(self, count):
+		self.is_count = True
+		self.sample_count += 1
+		self.accumulated += count
+
+	def reset(self):
+		self.sample_count = 0
+		self.accumulated = 0.0
+
+	def summary(self):
+		if self.is_count:
+			return f"{int(self.accumulated)} (in {self.sample_count} calls)"
+		return f"{self.average()*1000.:.03}ms ({self.sample_count} samples)"
+
+class ProfilingPool(dict):
+	"""Same interface as profiling_properties.ProfilingCounterPool, i.e.
+	a dict of ProfilingCounter that creates them on first access"""
+	def __missing__(self, key):
+		counter = ProfilingCounter(key)
+		self[key] = counter
+		return counter
+
+	def summary(self):
+		return [f" - {name}: {counter.summary()}" for name, counter in self.items()]
+
+# -------------------------------------------------------------------
@@ -54,6 +54,12 @@ class ProfilingCounterProperty(PropertyGroup):
         default=0.0,
     )
 
+    is_count: BoolProperty(
+        name="Is Count",
+        description="Whether this counts events (see add_count) rather than measuring durations",
+        default=False,
+    )
+
     def average(self):
         if self.sample_count == 0:
             return 0
@@ -75,6 +81,12 @@ class ProfilingCounterProperty(PropertyGroup):
         self.accumulated += value
         self.accumulated_sq += value * value
 
+    def add_count(self, count):
+        """Count occurrences of an event rather than timing it, e.g. cache hits"""
+        self.is_count = True
+        self.sample_count += 1
+        self.accumulated += count
+
     def reset(self):
         self.sample_count = 0
         self.accumulated = 0.0
@@ -82,6 +94,8 @@ class ProfilingCounterProperty(PropertyGroup):
 
     def summary(self):
         """returns something like XXms (±Xms, X samples)"""
+        if self.is_count:
+            return f"{int(self.accumulated)} (in {self.sample_count} calls)"
         return (
             f"{self.average()*1000.:.03}ms " +
             f"(±{self.stddev()*1000.:.03}ms, " +
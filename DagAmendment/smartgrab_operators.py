@@ -31,7 +31,7 @@ import numpy as np
 from random import randint
 import json
 
-from .utils import get_operator_properties
+from .utils import get_operator_properties, get_world_space_meshes
 from . import profiling
 from .jfilter_registry import jfilter_registry, instantiate_jfilter
 from .solver_registry import solver_registry, instantiate_solver
@@ -97,6 +97,13 @@ class SmartGrab(Operator):
         default=-1,
     )
 
+    broyden_tolerance: FloatProperty(
+        name="Broyden Tolerance",
+        description="During a stroke, the jacobian is updated from the observed displacement of the sample points (secant update), unless its relative error at predicting this displacement exceeds this tolerance, in which case it is measured again",
+        min=0.0,
+        default=0.1,
+    )
+
     max_projection_error_pow: FloatProperty(
         name="Max Projection Error",
         description="Log10 of the distance in UV space beyond which a point is considered as not found during jacobian estimation",
@@ -109,6 +116,30 @@ class SmartGrab(Operator):
         default=-5,
     )
 
+    jacobian_estimator: EnumProperty(
+        name="Jacobian Estimator",
+        description="Method used to measure the jacobian at sample points",
+        items=[
+            ('FINITE_DIFFERENCES', "Finite Differences", "Perturb hyper-parameters one by one (or by groups of independent ones)"),
+            ('SPARSE', "Sparse Perturbations", "Perturb all hyper-parameters at once in random directions, and recover a sparse jacobian from fewer scene updates (for scenes with many hyper-parameters)"),
+        ],
+        default='FINITE_DIFFERENCES',
+    )
+
+    jacobian_budget: IntProperty(
+        name="Jacobian Budget",
+        description="Maximum number of scene updates used by the Sparse Perturbations estimator to measure the jacobian",
+        min=3,
+        default=16,
+    )
+
+    frame_budget: FloatProperty(
+        name="Frame Budget",
+        description="In milliseconds. Mouse moves received less than this after the end of the previous update of the shape are coalesced, and only the latest one is processed. This keeps the shape close to the cursor on scenes that update slower than input events arrive. Set to 0 to process all events",
+        min=0.0,
+        default=0.0,
+    )
+
     discard_by_world_distance: BoolProperty(
         name="Discard by World Distance",
         description="After sampling point, removes the points that are outside of a sphere corresponding to the unprojection of the brush circle.",
@@ -138,6 +169,9 @@ class SmartGrab(Operator):
 
         # modal() is then called at each input event, and on its turn calls
         # on_mouse_move(), on_confirm() and on_cancel().
+        if self.frame_budget > 0:
+            # Timer events flush the mouse moves that were coalesced
+            self.event_timer = context.window_manager.event_timer_add(self.frame_budget / 1000, window=context.window)
         context.window_manager.modal_handler_add(self)
         return {'RUNNING_MODAL'}
 
@@ -172,10 +206,38 @@ class SmartGrab(Operator):
 
         return {'RUNNING_MODAL'}
 
+    def queue_mouse_move(self, x, y):
+        """
+        Record the latest mouse position, and only process it if the frame
+        budget since the previous update is exhausted. Otherwise it waits
+        for the next mouse move (that replaces it) or timer event.
+        """
+        if self.pending_mouse is not None:
+            bpy.context.scene.profiling["SmartGrab:skipped_events"].add_count(1)
+        self.pending_mouse = (x, y)
+        return self.flush_mouse_move()
+
+    def flush_mouse_move(self, force=False):
+        """Process the pending mouse position, if any, once the frame budget is over"""
+        if self.pending_mouse is None:
+            return {'RUNNING_MODAL'}
+        if not force and self.since_last_update.ellapsed() * 1000 < self.frame_budget:
+            return {'RUNNING_MODAL'}
+        x, y = self.pending_mouse
+        self.pending_mouse = None
+        result = self.on_mouse_move(x, y)
+        self.since_last_update = Timer()
+        return result
+
     def on_confirm(self, context):
+        # Apply the last position of the cursor before leaving
+        self.flush_mouse_move(force=True)
+        self.remove_event_timer(context)
         return {'FINISHED'}
 
     def on_cancel(self, context):
+        self.remove_event_timer(context)
+
         # Reset hyper-parameters
         self.parametric_shape.set_hyperparams(self.original_valuation)
         self.parametric_shape.update()
@@ -190,7 +252,7 @@ class SmartGrab(Operator):
         # be reused more easily.
         proj = Projector(context)
         self.viewport_state = ViewportState(proj, region.width, region.height)
-        self.parametric_shape = ParametricShape.from_scene(scene)
+        self.parametric_shape = ParametricShape.from_scene(scene, get_world_space_meshes)
 
         # The stroke is a radius plus a sequence of mouse position that will
         # get filled throughout the interaction and provided to the solver.
@@ -220,6 +282,16 @@ class SmartGrab(Operator):
         # Temporary object used to transmit info from this operator to the overlay
         self.solving_visualization = context.scene.diffparam.solving_visualization.get()
 
+        # Mouse move coalescing (see frame_budget)
+        self.pending_mouse = None
+        self.since_last_update = Timer()
+        self.event_timer = None
+
+    def remove_event_timer(self, context):
+        if self.event_timer is not None:
+            context.window_manager.event_timer_remove(self.event_timer)
+            self.event_timer = None
+
     def init_jbuffer(self):
         """
         Initialize the jacobian buffer, including sampling subshapes
@@ -227,8 +299,6 @@ class SmartGrab(Operator):
         a negative interaction jfilter), and computing the jacobians
         of these subshapes
         """
-        np.random.seed(self.random_seed)
-
         self.jbuffer.sample_from_view(
             self.parametric_shape,
             self.viewport_state,
@@ -238,6 +308,7 @@ class SmartGrab(Operator):
             sample_count=self.sample_count,
             max_projection_error=pow(10, self.max_projection_error_pow),
             discard_by_world_distance=self.discard_by_world_distance,
+            seed=self.random_seed,
         )
 
         if not self.jbuffer.is_ready():
@@ -256,7 +327,7 @@ class SmartGrab(Operator):
         self.update_jacobian(update_origin=False)
 
         # Cache original hyper-parameter values, in case the user cancels
-        self.original_valuation = self.base_valuation[:]
+        self.original_valuation = self.base_valuation.copy()
 
         self.stroke.append(
             self.init_mouse_x + self.mouse_offset[0],
@@ -265,15 +336,32 @@ class SmartGrab(Operator):
 
     def update_jacobian(self, update_origin=True):
         """
-        Cache the value of the jacobian where the stroke starts
+        Cache the value of the jacobian where the stroke starts, or at the
+        current point of the stroke if update_origin is True
         Updates self.jacobian and self.base_valuation
         """
+        profiling = bpy.context.scene.profiling
+        valuation = self.parametric_shape.get_hyperparams()
 
-        # 1. Measure the jacobian at each sample point
-        self.jbuffer.compute_jacobians(
+        # 1. Measure the jacobian at each sample point. During the stroke, a
+        # secant update is enough as long as the shape remains close to linear
+        # since the last measure.
+        broyden_success = update_origin and self.jbuffer.update_jacobians_broyden(
             self.parametric_shape,
-            delta=pow(10, self.relative_delta_pow)
+            valuation - self.base_valuation,
+            tolerance=self.broyden_tolerance,
         )
+        if broyden_success:
+            profiling["SmartGrab:broyden_update"].add_count(1)
+        else:
+            self.jbuffer.compute_jacobians(
+                self.parametric_shape,
+                delta=pow(10, self.relative_delta_pow),
+                estimator=self.jacobian_estimator,
+                budget=self.jacobian_budget,
+            )
+            if update_origin:
+                profiling["SmartGrab:full_jacobian_update"].add_count(1)
 
         # 2. Reduce all individual jacobians into a single one (jacobian filtering)
         timer = Timer()
@@ -281,16 +369,18 @@ class SmartGrab(Operator):
             self.brush_radius,
             self.jbuffer
         )
-        bpy.context.scene.profiling["SmartGrab:reduce_jacobian"].add_sample(timer.ellapsed())
+        profiling["SmartGrab:reduce_jacobian"].add_sample(timer.ellapsed())
 
         # Base valuation is the value of the hyper-parameters at the last jacobian update
-        self.base_valuation = [
-            param.eval()
-            for param in self.parametric_shape.hyperparams
-        ]
+        self.base_valuation = valuation
 
         if update_origin:
-            raise NotImplemented
+            # The solver now linearizes the shape around the current state,
+            # so the stroke continues from the current position of the main point
+            origin, _ = self.jbuffer.get_main_point()
+            if origin is not None:
+                self.origin = np.array(origin)
+            self.solver_instance.reset()
 
     def solve(self):
         timer = profiling.Timer()
@@ -316,7 +406,10 @@ class SmartGrab(Operator):
         if event.type == 'MOUSEMOVE':
             x = event.mouse_region_x
             y = event.mouse_region_y
-            return self.on_mouse_move(x, y)
+            return self.queue_mouse_move(x, y)
+
+        elif event.type == 'TIMER':
+            return self.flush_mouse_move()
 
         elif event.type in {'LEFTMOUSE'}:
             return self.on_confirm(context)
@@ -98,9 +98,15 @@ class SamplerPropertiesMenu(Menu):
         layout.prop(props, "brush_radius")
         layout.prop(props, "sample_count")
         layout.prop(props, "jacobian_update_period")
+        if props.jacobian_update_period > 0:
+            layout.prop(props, "broyden_tolerance")
         layout.prop(props, "relative_delta_pow")
+        layout.prop(props, "jacobian_estimator")
+        if props.jacobian_estimator == 'SPARSE':
+            layout.prop(props, "jacobian_budget")
         layout.prop(props, "max_projection_error_pow")
         layout.prop(props, "discard_by_world_distance")
+        layout.prop(props, "frame_budget")
 
 # -------------------------------------------------------------------
 
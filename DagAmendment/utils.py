@@ -27,6 +27,7 @@ import numpy as np
 from numpy.linalg import norm
 
 from .profiling import Timer
+from .numpy_utils import euler_to_matrix
 
 # -------------------------------------------------------------------
 
@@ -90,11 +91,51 @@ def trysetattr(obj, attr, value):
 
 # -------------------------------------------------------------------
 
-def get_vertex_positions_as_np(mesh):
+def get_vertex_positions_as_np(mesh, cache=None, key=None):
+    """
+    Read the positions of the vertices of a mesh
+    @param cache: optional VertexBufferCache in which the positions are
+           written, under the given key (typically the object name),
+           instead of allocating a new array. The returned array is then
+           overwritten by the next call with the same key.
+    """
+    if cache is not None:
+        return cache.read(mesh, key)
     data = np.empty((len(mesh.vertices), 3), 'f')
     mesh.vertices.foreach_get('co', data.ravel())
     return data
 
+class VertexBufferCache:
+    """
+    Per-object arrays receiving vertex positions (see
+    get_vertex_positions_as_np), reused as long as the vertex count does
+    not change.
+    """
+    def __init__(self):
+        # key -> buffer
+        self._buffers = {}
+        # Number of arrays allocated since the last call to pop_allocation_count()
+        self.allocation_count = 0
+
+    def read(self, mesh, key):
+        """Read the vertex positions of mesh into the buffer of key"""
+        n = len(mesh.vertices)
+        buffer = self._buffers.get(key)
+        if buffer is None or len(buffer) != n:
+            buffer = np.empty((n, 3), 'f')
+            self._buffers[key] = buffer
+            self.allocation_count += 1
+        mesh.vertices.foreach_get('co', buffer.ravel())
+        return buffer
+
+    def pop_allocation_count(self):
+        count = self.allocation_count
+        self.allocation_count = 0
+        return count
+
+    def clear(self):
+        self._buffers.clear()
+
 # -------------------------------------------------------------------
 
 def get_triangle_corners_as_np(mesh):
@@ -105,6 +146,124 @@ def get_triangle_corners_as_np(mesh):
 
 # -------------------------------------------------------------------
 
+def get_world_space_meshes(depsgraph):
+    """
+    Concatenate the world space triangles of all visible mesh instances,
+    in a layout that can be given to Accel.MeshIndex
+    @return (instances, vertices, triangles, vertex_offsets, triangle_offsets)
+    where instances lists (evaluated object, matrix) pairs and triangles
+    are the loop triangles of each mesh, with indices local to each mesh.
+    """
+    instances = []
+    vertices = []
+    triangles = []
+    for obj, matrix in visible_objects_and_duplis(depsgraph):
+        eval_obj = obj.evaluated_get(depsgraph)
+        mesh = eval_obj.data
+        M = np.array(matrix)
+        instances.append((eval_obj, matrix))
+        vertices.append(get_vertex_positions_as_np(mesh) @ M[:3,:3].T.astype('f') + M[:3,3].astype('f'))
+        triangles.append(get_triangle_corners_as_np(mesh))
+
+    vertex_offsets = np.cumsum([0] + [len(x) for x in vertices], dtype='i')
+    triangle_offsets = np.cumsum([0] + [len(x) for x in triangles], dtype='i')
+    if instances:
+        vertices = np.concatenate(vertices)
+        triangles = np.concatenate(triangles)
+    else:
+        vertices = np.empty((0, 3), 'f')
+        triangles = np.empty((0, 3), 'i')
+    return instances, vertices, triangles, vertex_offsets, triangle_offsets
+
+# -------------------------------------------------------------------
+
+def get_modifier_object_references(obj):
+    """
+    Yield (modifier, referenced object) for all modifiers of obj that point
+    at another object (boolean operand, mirror object, array offset object,
+    hook object, etc.)
+    """
+    for modifier in obj.modifiers:
+        for prop in modifier.bl_rna.properties:
+            if prop.type != 'POINTER' or prop.fixed_type.identifier != 'Object':
+                continue
+            target = getattr(modifier, prop.identifier)
+            if target is not None and target.name != obj.name:
+                yield modifier, target
+
+def get_unmodeled_object_references():
+    """
+    Names of the objects that some other datablock depends on in a way
+    that the DEPSGRAPH node tree does not represent: objects referenced by
+    non boolean modifiers, and targets of driver variables (the node tree
+    drops the variables it cannot parse, like transform channels and
+    custom properties, so all of them are considered unmodeled).
+    """
+    references = set()
+    for obj in bpy.data.objects:
+        for modifier, target in get_modifier_object_references(obj):
+            if modifier.type != 'BOOLEAN':
+                references.add(target.name)
+
+    for datablocks in (bpy.data.objects, bpy.data.meshes, bpy.data.shape_keys, bpy.data.node_groups):
+        for datablock in datablocks:
+            animation_data = datablock.animation_data
+            if animation_data is None:
+                continue
+            for fcurve in animation_data.drivers:
+                for variable in fcurve.driver.variables:
+                    for target in variable.targets:
+                        if isinstance(target.id, bpy.types.Object):
+                            references.add(target.id.name)
+    return references
+
+# -------------------------------------------------------------------
+
+def get_transform_derivative(obj, prop, index):
+    """
+    Derivative of world space positions with respect to obj.<prop>[index],
+    where prop is 'location', 'rotation_euler' or 'scale', for the points of
+    obj and of its children.
+    @param obj: evaluated object
+    @return a 4x4 matrix D such that the derivative of a world space point p
+    is D @ (p, 1), or None if the world matrix of obj does not only depend
+    on its own location, rotation and scale (constraints, parent that is not
+    an object, rotation that is not Euler, null scale)
+    """
+    euler_modes = {'XYZ', 'XZY', 'YXZ', 'YZX', 'ZXY', 'ZYX'}
+    if prop not in {'location', 'rotation_euler', 'scale'} or index >= 3:
+        return None
+    if len(obj.constraints) > 0:
+        return None
+    if obj.parent is not None and obj.parent_type != 'OBJECT':
+        return None
+    if prop == 'rotation_euler' and obj.rotation_mode not in euler_modes:
+        return None
+
+    # The world matrix is W = P @ L where L is the local matrix
+    # T @ R @ S (including delta transforms) and P does not depend on prop.
+    W = np.array(obj.matrix_world)
+    L = np.array(obj.matrix_basis)
+    if abs(np.linalg.det(L[:3,:3])) < 1e-12 or abs(np.linalg.det(W[:3,:3])) < 1e-12:
+        return None
+
+    dL = np.zeros((4, 4))
+    if prop == 'location':
+        dL[index,3] = 1
+    elif prop == 'scale':
+        dL[:3,index] = L[:3,index] / obj.scale[index]
+    else:
+        order = obj.rotation_mode
+        delta_R = euler_to_matrix(obj.delta_rotation_euler, order)
+        dR = euler_to_matrix(obj.rotation_euler, order, derivative_axis=index)
+        S = np.array(obj.scale) * np.array(obj.delta_scale)
+        dL[:3,:3] = delta_R @ dR * S
+
+    # dW @ W^-1 = P @ dL @ W^-1 with P = W @ L^-1
+    return W @ np.linalg.inv(L) @ dL @ np.linalg.inv(W)
+
+# -------------------------------------------------------------------
+
 def get_operator_properties(context, op_idname):
     # https://blenderartists.org/t/share-operator-properties-in-workspacetool/1253663
     any_tool = context.workspace.tools.from_space_view3d_mode(context.mode, create=True)
@@ -27,33 +27,53 @@ of UV space and material ID.
 import bpy
 
 import numpy as np
-from numpy.linalg import norm
 
 from .profiling import Timer
 from .utils import get_vertex_positions_as_np
-from .numpy_utils import matvecmul
-from .Accel import project as project_on_mesh
+from .handlers import mesh_update_stamp
+from .Accel import MeshIndex64, eval_bound_positions
 
 # -------------------------------------------------------------------
 
-def get_uv_mesh(mesh):
+def get_uv_mesh(mesh, cache=None, key=None):
     """
     Get a mesh whose spatial embedding has been replaced by
     (u, v, material_id) coordinates.
+    @param cache: optional dict in which the result is stored under the given
+           key (typically the object name). When the vertex, loop and
+           polygon counts did not change since the previous call with the
+           same key, and the mesh datablock itself was not updated (see
+           handlers.mesh_update_stamp()), the previous result is returned
+           without reading anything from the mesh. This assumes that
+           hyper-parameters do not change UVs without changing the topology.
+           Quads may still be triangulated along their other diagonal as
+           their vertices move, which only changes along which diagonal
+           positions are interpolated.
     @return the point positions, a triangle index list, and a mapping
     from corners of this uv mesh to the vertices of the original mesh.
     """
     timer = Timer()
+    profiling = bpy.context.scene.profiling
+
+    if cache is not None:
+        signature = (len(mesh.vertices), len(mesh.loops), len(mesh.polygons), mesh_update_stamp(mesh))
+        cached = cache.get(key)
+        if cached is not None and cached[0] == signature:
+            profiling["get_uv_mesh:cache_hit"].add_count(1)
+            profiling["build_uv_coords"].add_sample(timer)
+            return cached[1]
+        profiling["get_uv_mesh:cache_miss"].add_count(1)
 
     mesh.calc_loop_triangles()
-    uv_layer = mesh.uv_layers.active
 
     tri_to_mat = np.empty(len(mesh.loop_triangles), 'i')
     mesh.loop_triangles.foreach_get('material_index', tri_to_mat.ravel())
 
     tri_to_loop = np.empty((len(mesh.loop_triangles), 3), 'i')
     mesh.loop_triangles.foreach_get('loops', tri_to_loop.ravel())
-    
+
+    uv_layer = mesh.uv_layers.active
+
     loop_to_uv = np.empty((len(mesh.loops), 2), 'f')
     uv_layer.data.foreach_get('uv', loop_to_uv.ravel())
 
@@ -65,45 +85,192 @@ def get_uv_mesh(mesh):
     uv_coords[tri_to_loop,2] = tri_to_mat[:,np.newaxis]
     uv_loop_to_vert = loop_to_vert
 
-    bpy.context.scene.profiling["build_uv_coords"].add_sample(timer)
-    return uv_coords, uv_loop_triangles, uv_loop_to_vert
+    uv_mesh = uv_coords, uv_loop_triangles, uv_loop_to_vert
+    if cache is not None:
+        cache[key] = (signature, uv_mesh)
+
+    profiling["build_uv_coords"].add_sample(timer)
+    return uv_mesh
+
+# -------------------------------------------------------------------
+
+def hits_to_coparams(objects, object_ids, loop_triangles, bcoords, uv_mesh_cache=None):
+    """
+    Get the coparams of points given by a triangle of an object's
+    loop_triangles and their barycentric coordinates within this triangle,
+    e.g. as returned by ParametricShape.cast_rays().
+    @param uv_mesh_cache: optional cache forwarded to get_uv_mesh()
+    @return array of coparams with as many lines as in bcoords
+    """
+    coparams = np.empty((len(bcoords), 3), 'f')
+    for object_id in np.unique(object_ids):
+        mask = object_ids == object_id
+        obj = objects[object_id]
+        uv_coords, uv_loop_triangles, _ = get_uv_mesh(obj.data, uv_mesh_cache, obj.name)
+        corners = uv_coords[uv_loop_triangles[loop_triangles[mask]]]
+        coparams[mask] = np.einsum('ij,ijk->ik', bcoords[mask], corners)
+    return coparams
+
+# -------------------------------------------------------------------
+
+def get_uv_mesh_index(uv_coords, uv_loop_triangles, mesh_index=None, vertex_offsets=None, triangle_offsets=None):
+    """
+    Get a spatial index of the uv mesh returned by get_uv_mesh(), reusing
+    the previous mesh_index if any. If the triangles did not change, only
+    the uv coordinates are updated (refit), otherwise the index is rebuilt.
+    Offsets are used when several uv meshes are concatenated (see
+    bind_coparams()). The index is in float64 so that the precision of the
+    projection is only limited by the one of the (float32) coparams.
+    """
+    if mesh_index is not None and mesh_index.same_triangles(uv_loop_triangles, vertex_offsets, triangle_offsets):
+        mesh_index.refit(uv_coords)
+        return mesh_index
+    return MeshIndex64(uv_coords, uv_loop_triangles, vertex_offsets, triangle_offsets)
+
+def projection_tolerance(max_projection_error, samples):
+    """
+    Distance under which a coparam is considered to lie on its uv mesh.
+    Coparams are stored in float32, so they cannot be closer to the mesh
+    than the resolution of float32 around their coordinates, whatever
+    max_projection_error is.
+    """
+    scale = max(1.0, float(np.abs(samples).max(initial=0)))
+    return max(max_projection_error, 4 * np.finfo(samples.dtype).eps * scale)
 
 # -------------------------------------------------------------------
 
-def coparam_to_position(uv_coparam_vec, obj, max_projection_error = 1e-7):
+def _concatenate_uv_meshes(objects, uv_mesh_cache=None):
     """
-    Given a coparam, return the current position of points within the
-    given object.
-    @return array of 3D positions with as many lines as in uv_coparam_vec
+    Concatenate the uv meshes of objects, with offsets telling where the
+    data of each object starts (see Accel.MeshIndex).
+    @return (uv_meshes, uv_coords, uv_loop_triangles, uv_loop_to_vert,
+    vertex_offsets, triangle_offsets) where uv_meshes is the list of
+    individual uv meshes returned by get_uv_mesh()
     """
+    uv_meshes = [get_uv_mesh(obj.data, uv_mesh_cache, obj.name) for obj in objects]
+    uv_coords, uv_loop_triangles, uv_loop_to_vert = (np.concatenate(arrays) for arrays in zip(*uv_meshes))
+    vertex_offsets = _offsets([coords for coords, _, _ in uv_meshes])
+    triangle_offsets = _offsets([loop_triangles for _, loop_triangles, _ in uv_meshes])
+    return uv_meshes, uv_coords, uv_loop_triangles, uv_loop_to_vert, vertex_offsets, triangle_offsets
+
+def _offsets(arrays):
+    return np.cumsum([0] + [len(x) for x in arrays], dtype='i')
+
+def _get_concatenated_mesh_index(objects, uv_coords, uv_loop_triangles, vertex_offsets, triangle_offsets, mesh_index_cache=None):
     profiling = bpy.context.scene.profiling
-    timer = Timer()
-    
-    # start init
-    orig_me = obj.data
-    M = np.array(obj.matrix_world)
-    R, T = M[:3,:3], M[:3,3]
+    index_timer = Timer()
+    if mesh_index_cache is not None:
+        key = tuple(obj.name for obj in objects)
+        mesh_index = get_uv_mesh_index(uv_coords, uv_loop_triangles, mesh_index_cache.get(key), vertex_offsets, triangle_offsets)
+        mesh_index_cache[key] = mesh_index
+    else:
+        mesh_index = get_uv_mesh_index(uv_coords, uv_loop_triangles, None, vertex_offsets, triangle_offsets)
+    profiling["bind_coparams:index"].add_sample(index_timer)
+    return mesh_index
 
-    orig_coords = get_vertex_positions_as_np(orig_me)
+# -------------------------------------------------------------------
 
-    uv_coords, uv_loop_triangles, uv_loop_to_vert = get_uv_mesh(orig_me)
-    
+class CoparamBinding:
+    """
+    Result of the projection of coparams onto the uv meshes of their
+    objects, namely the vertices and barycentric coordinates of the
+    triangle each coparam lies in. As long as the topology of the objects
+    does not change, this is enough to evaluate the position of the points,
+    without projecting again (see bind_coparams()).
+    """
+    def __init__(self, object_names, uv_meshes, vertex_counts, object_ids, corner_vertices, bcoords, found):
+        self.object_names = object_names
+        self.uv_meshes = uv_meshes  # the (unchanged) uv meshes it was built from
+        self.vertex_counts = vertex_counts
+        self.object_ids = object_ids
+        self.corner_vertices = corner_vertices  # local to each object
+        self.bcoords = bcoords
+        self.found = found  # False for coparams that are too far from the mesh
+
+    def is_valid_for(self, objects, uv_meshes, vertex_counts):
+        """Tell whether the binding can be used with the current objects"""
+        if [obj.name for obj in objects] != self.object_names or vertex_counts != self.vertex_counts:
+            return False
+        for (_, loop_triangles, loop_to_vert), (_, ref_loop_triangles, ref_loop_to_vert) in zip(uv_meshes, self.uv_meshes):
+            if loop_triangles is ref_loop_triangles and loop_to_vert is ref_loop_to_vert:
+                continue  # returned from the uv mesh cache
+            if not np.array_equal(loop_triangles, ref_loop_triangles) or not np.array_equal(loop_to_vert, ref_loop_to_vert):
+                return False
+        return True
+
+    def eval_positions(self, objects, uv_mesh_cache=None, vertex_cache=None):
+        """
+        Evaluate the current position of the bound points
+        @param vertex_cache: optional utils.VertexBufferCache receiving the
+               vertex positions of the objects, to avoid allocating them
+        @return array of 3D positions, or None if the topology changed and
+        the coparams must be bound again
+        """
+        uv_meshes = [get_uv_mesh(obj.data, uv_mesh_cache, obj.name) for obj in objects]
+        orig_coords = [get_vertex_positions_as_np(obj.data, vertex_cache, obj.name) for obj in objects]
+        if not self.is_valid_for(objects, uv_meshes, [len(coords) for coords in orig_coords]):
+            return None
+
+        # Interpolation and transform are fused in a single pass over points
+        matrices = np.array([np.array(obj.matrix_world) for obj in objects], 'f')
+        return eval_bound_positions(
+            self.corner_vertices,
+            self.bcoords,
+            self.object_ids,
+            orig_coords,
+            matrices,
+            self.found,
+        )
+
+def bind_coparams(uv_coparam_vec, object_ids, objects, max_projection_error = 1e-7, mesh_index_cache=None, uv_mesh_cache=None):
+    """
+    Project coparams onto the uv meshes of their objects once, to get a
+    binding from which their position can be evaluated as long as the
+    topology does not change (e.g. during finite differences). The uv
+    meshes of all objects are concatenated so that all coparams get
+    projected in a single call to Accel.
+    @param object_ids: for each coparam, index of its object in objects
+    @param max_projection_error: coparams further than this from the uv
+           mesh are considered as not found (their position is NaN),
+           within the precision of float32 (see projection_tolerance())
+    @param mesh_index_cache: optional dict used to avoid rebuilding the
+           index each time this is called on the same list of objects
+    @param uv_mesh_cache: optional cache forwarded to get_uv_mesh()
+    @return a CoparamBinding
+    """
+    timer = Timer()
+
+    uv_meshes, uv_coords, uv_loop_triangles, uv_loop_to_vert, vertex_offsets, triangle_offsets = _concatenate_uv_meshes(objects, uv_mesh_cache)
     samples = np.array(uv_coparam_vec, 'f')
+    object_ids = np.array(object_ids, 'i')
+    mesh_index = _get_concatenated_mesh_index(objects, uv_coords, uv_loop_triangles, vertex_offsets, triangle_offsets, mesh_index_cache)
 
-    projections, bcoords, proj_triangle_indices = project_on_mesh(uv_coords, uv_loop_triangles, samples)
-    
-    # Convert parameter to position (quick once vectorized)
-    diff = projections - samples
-    sq_err = norm(diff, ord=2, axis=1)
-    sq_max = max_projection_error * max_projection_error
-
-    orig_corners_idx = uv_loop_to_vert[uv_loop_triangles[proj_triangle_indices]]
-    orig_corners_local = orig_coords[orig_corners_idx]
-    orig_loc_local = matvecmul(orig_corners_local.transpose(0,2,1), bcoords)
-    orig_loc = matvecmul(R, orig_loc_local) + T
-    orig_loc[sq_err > sq_max] = np.nan
-
-    profiling["coparam_to_position"].add_sample(timer)
-    return orig_loc
+    # Most samples lie exactly on the uv mesh, in which case the search stops
+    # early (since the error threshold is also used as early exit distance).
+    tolerance = projection_tolerance(max_projection_error, samples)
+    mesh_index.reset_counters()
+    projections, bcoords, proj_triangle_indices = mesh_index.project(samples.astype('d'), object_ids, early_exit_distance=tolerance)
+    profiling = bpy.context.scene.profiling
+    profiling["bind_coparams:queries"].add_count(mesh_index.query_count)
+    profiling["bind_coparams:fast_path"].add_count(mesh_index.early_exit_count)
+    found = np.linalg.norm(projections - samples, axis=1) <= tolerance
+    profiling["bind_coparams:found"].add_count(int(np.count_nonzero(found)))
+
+    # Triangle, loop and vertex indices are local to each object
+    corner_loops = uv_loop_triangles[proj_triangle_indices + triangle_offsets[object_ids]]
+    corner_vertices = uv_loop_to_vert[corner_loops + vertex_offsets[object_ids,np.newaxis]]
+
+    binding = CoparamBinding(
+        object_names=[obj.name for obj in objects],
+        uv_meshes=uv_meshes,
+        vertex_counts=[len(obj.data.vertices) for obj in objects],
+        object_ids=object_ids,
+        corner_vertices=corner_vertices,
+        bcoords=bcoords.astype('f'),  # same dtype as vertices, see eval_positions()
+        found=found,
+    )
+
+    profiling["bind_coparams"].add_sample(timer)
+    return binding
 
 # -------------------------------------------------------------------